@@ -0,0 +1,162 @@
+"""
+Adaptive Refresh Scheduler
+- Learns each market's publish window from when its data actually changed (change_log.changed_at and
+  price_events.ts over the last LEARN_DAYS days), as 30-minute slots of the local day
+- Only updates and deletes count: date_scraped is the poll date, so the first poll after midnight inserts
+  every row for the new day without anything being published (that would teach every market a 00:00 window)
+- Inside a window a market is polled every WINDOW_INTERVAL_MIN minutes
+- Outside a window every poll without a change doubles the interval (BASE_INTERVAL_MIN .. MAX_INTERVAL_MIN),
+  but a market always wakes up when its next window opens
+- Markets are scheduled independently and polled from their own worker thread, so a slow or unchanged
+  market does not delay the others
+- With too little history a market is treated as "always in window", i.e. the old fixed-interval behaviour
+"""
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import change_log
+
+SLOT_MIN = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MIN
+LEARN_DAYS = 28
+# a slot belongs to the window if it holds at least this share of the observed updates
+MIN_SLOT_SHARE = 0.05
+# fewer update runs than this -> no window learned yet
+MIN_OBSERVATIONS = 10
+WINDOW_INTERVAL_MIN = 5
+BASE_INTERVAL_MIN = 10
+MAX_INTERVAL_MIN = 240
+# re-learn windows this often
+RELEARN_HOURS = 6
+
+
+def update_times(conn, market_id, since_ts):
+    """Distinct epoch timestamps at which the market's data changed (date rollover inserts excluded)."""
+    times = set()
+    try:
+        seen = set()
+        cur = conn.execute('''
+            SELECT product, date_scraped, op, changed_at FROM change_log
+            WHERE market_id = ? AND changed_at >= ? ORDER BY version
+        ''', (market_id, since_ts))
+        for product, date_scraped, op, changed_at in cur:
+            # an upsert of a key not seen before is an insert: a new day's rows, not a publish
+            if changed_at is not None and (op != change_log.OP_UPSERT or (product, date_scraped) in seen):
+                times.add(changed_at)
+            seen.add((product, date_scraped))
+    except sqlite3.OperationalError:  # table missing in an older DB
+        pass
+    try:
+        # events are only written when a product's price differs from its previous event
+        cur = conn.execute('SELECT DISTINCT ts FROM price_events WHERE market_id = ? AND ts >= ?', (market_id, since_ts))
+        times.update(r[0] for r in cur.fetchall() if r[0] is not None)
+    except sqlite3.OperationalError:
+        pass
+    return sorted(times)
+
+
+def slot_of(dt):
+    return (dt.hour * 60 + dt.minute) // SLOT_MIN
+
+
+def learn_window(conn, market_id, now=None, days=LEARN_DAYS):
+    """Set of 30-minute slots (0..47, local time) the market publishes in, or None if unknown."""
+    now = now or time.time()
+    times = update_times(conn, market_id, int(now - days * 86400))
+    if len(times) < MIN_OBSERVATIONS:
+        return None
+    counts = [0] * SLOTS_PER_DAY
+    for ts in times:
+        counts[slot_of(datetime.fromtimestamp(ts))] += 1
+    hot = {i for i, c in enumerate(counts) if c / len(times) >= MIN_SLOT_SHARE}
+    # widen by one slot on each side: publish times drift a little day to day
+    return {(i + d) % SLOTS_PER_DAY for i in hot for d in (-1, 0, 1)}
+
+
+def in_window(window, dt):
+    return window is None or slot_of(dt) in window
+
+
+def next_window_start(window, dt):
+    """Start of the next slot in the window after dt (None if there is no window)."""
+    if not window:
+        return None
+    start = dt.replace(minute=(dt.minute // SLOT_MIN) * SLOT_MIN, second=0, microsecond=0)
+    for i in range(1, SLOTS_PER_DAY + 1):
+        candidate = start + timedelta(minutes=SLOT_MIN * i)
+        if slot_of(candidate) in window:
+            return candidate
+    return None
+
+
+class MarketSchedule:
+    """Next run time and no-change streak of one market."""
+
+    def __init__(self, market_id, window=None):
+        self.market_id = market_id
+        self.window = window
+        self.misses = 0
+        self.next_run = datetime.now()
+
+    def interval(self, now):
+        if in_window(self.window, now):
+            return timedelta(minutes=WINDOW_INTERVAL_MIN if self.window is not None else BASE_INTERVAL_MIN)
+        return timedelta(minutes=min(BASE_INTERVAL_MIN * 2 ** self.misses, MAX_INTERVAL_MIN))
+
+    def record(self, changed, now=None):
+        """Plan the next run after a poll that did (or did not) change data."""
+        now = now or datetime.now()
+        self.misses = 0 if changed else self.misses + 1
+        next_run = now + self.interval(now)
+        opens = next_window_start(self.window, now)
+        if not in_window(self.window, now) and opens is not None and opens < next_run:
+            next_run = opens
+        self.next_run = next_run
+        return next_run
+
+
+def changed(info):
+    """Whether an ingest_excel() result changed any row."""
+    return isinstance(info, dict) and (info.get('inserted', 0) + info.get('updated', 0) + info.get('deleted', 0)) > 0
+
+
+def run(markets, refresh, connect, on_tick=None, tick_s=10):
+    """
+    Scheduler loop. `markets` are market ids, `refresh(market_id)` polls one market and returns
+    the ingest info dict (called from worker threads, one per market), `connect()` opens the DB
+    used to learn windows, `on_tick()` runs other scheduled jobs (daily backup) from the loop.
+    """
+    schedules = {m: MarketSchedule(m) for m in markets}
+    running = {}
+    learned_at = 0
+    with ThreadPoolExecutor(max_workers=len(schedules)) as pool:
+        while True:
+            if time.time() - learned_at > RELEARN_HOURS * 3600:
+                conn = connect()
+                for s in schedules.values():
+                    s.window = learn_window(conn, s.market_id)
+                    slots = sorted(s.window) if s.window is not None else None
+                    print(f"[adaptive] {s.market_id}: window slots {slots}")
+                conn.close()
+                learned_at = time.time()
+            for market_id, future in list(running.items()):
+                if not future.done():
+                    continue
+                del running[market_id]
+                try:
+                    info = future.result()
+                except Exception as e:
+                    print(f"[adaptive] {market_id}: refresh failed: {e}")
+                    info = None
+                s = schedules[market_id]
+                next_run = s.record(changed(info))
+                print(f"[adaptive] {market_id}: changed={changed(info)} misses={s.misses} next run {next_run:%H:%M}")
+            now = datetime.now()
+            for s in schedules.values():
+                if s.market_id not in running and now >= s.next_run:
+                    running[s.market_id] = pool.submit(refresh, s.market_id)
+            if on_tick is not None:
+                on_tick()
+            time.sleep(tick_s)
@@ -1,16 +1,68 @@
-from flask import Flask, request, jsonify, abort
+from flask import Flask, request, jsonify, abort, g, Response, send_file, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import sqlite3
 from pathlib import Path
+import csv
+import io
 from math import radians, cos, sin, asin, sqrt
+import gzip
+import hashlib
 import json
+import re
+import threading
+import time
+import zlib
+from contextlib import nullcontext
+from datetime import datetime
+import change_log
+import compact_schema
+import live_updates
+import lkg_store
+import offline_bundle
+import pagination
+import metrics
+import profiling
+import price_history
+import product_search
+import rollups
+import static_publish
 
 BASE = Path(__file__).parent
 DB_PATH = BASE / 'data' / 'hal_prices.sqlite'
+# used while hal_prices.sqlite does not exist (same fallback as db_updater)
+FALLBACK_DB_PATH = BASE / 'data' / 'hal_prices_three.sqlite'
 MARKET_COORDS_FILE = BASE / 'backend' / 'market_coords.json'
 
+# JSON responses (and on-demand offline bundles) at least this large are gzip-compressed for clients that accept it
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_MIMETYPES = ('application/json', offline_bundle.MIMETYPE)
+# rows fetched per query by /api/export; the read lock is released between chunks
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def span(stage):
+    # timed section of a profiled request (see profiling.py); no-op otherwise
+    prof = getattr(g, 'profile', None)
+    return prof.span(stage) if prof is not None else nullcontext()
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    def response(self, *args, **kwargs):
+        with span('serialize'):
+            return super().response(*args, **kwargs)
+
+
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 CORS(app)
+SAMPLER = profiling.StackSampler()
+
+# in-process request metrics, exposed on /metrics
+REQUEST_LATENCY = metrics.Histogram('hal_http_request_duration_seconds', 'API request latency by route.',
+                                    ('route', 'method', 'status'))
+REQUESTS = metrics.Counter('hal_http_requests_total', 'API requests by route.', ('route', 'method', 'status'))
 
 # fallback coords if file not present
 DEFAULT_MARKETS = [
@@ -20,6 +72,19 @@ DEFAULT_MARKETS = [
 ]
 
 
+def db_path():
+    """
+    DB file for a new connection, resolved on every call: the main DB, else the run_three DB.
+    Both are replaced by rename (shadow_db.py), so the next connection opens the new file and
+    connections that are already open keep reading the old one until they close.
+    """
+    return DB_PATH if DB_PATH.exists() else FALLBACK_DB_PATH
+
+
+# one DB watcher thread per process feeding every /api/stream client (see live_updates.py)
+LIVE = live_updates.Broadcaster(db_path)
+
+
 def load_markets():
     if MARKET_COORDS_FILE.exists():
         try:
@@ -42,24 +107,255 @@ def haversine(lat1, lon1, lat2, lon2):
     return km
 
 
+def parse_ts(value, default=None):
+    """Epoch seconds or ISO date/datetime (e.g. 2025-11-14T14:00) -> epoch seconds."""
+    if value is None or value == '':
+        return default
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+def data_version(conn):
+    # data version for /api/prices/changes; None for DBs without a change log
+    try:
+        return change_log.current_version(conn)
+    except sqlite3.OperationalError:
+        return None
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    if profiling.enabled_for(request.headers, request.remote_addr):
+        g.profile = profiling.Timings()
+        SAMPLER.add(threading.get_ident())
+
+
+@app.after_request
+def record_latency(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        # label by the route pattern, not the path, so /api/market/<market_id>/latest is one series
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        labels = dict(route=route, method=request.method, status=response.status_code)
+        REQUEST_LATENCY.observe(time.perf_counter() - started, **labels)
+        REQUESTS.inc(**labels)
+    return response
+
+
+@app.after_request
+def add_server_timing(response):
+    prof = getattr(g, 'profile', None)
+    if prof is not None:
+        response.headers['Server-Timing'] = prof.server_timing()
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    # registered last, so it runs first among the after_request hooks and is timed as 'compress'
+    if (response.direct_passthrough or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return response
+    with span('compress'):
+        data = response.get_data()
+        if len(data) >= COMPRESS_MIN_BYTES:
+            response.set_data(gzip.compress(data, compresslevel=5))
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Content-Length'] = str(len(response.get_data()))
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.teardown_request
+def stop_sampling(exc):
+    if getattr(g, 'profile', None) is not None:
+        SAMPLER.remove(threading.get_ident())
+
+
+@app.route('/debug/profile')
+def debug_profile():
+    # aggregated collapsed stacks of profiled requests (flamegraph.pl / speedscope input); ?reset=1 clears them
+    if not profiling.enabled() or not profiling.authorized(request.headers, request.remote_addr):
+        abort(404)
+    body = SAMPLER.dump()
+    if request.args.get('reset') == '1':
+        SAMPLER.reset()
+    return Response(body, mimetype='text/plain')
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus text format: request latency of this process + ingest stage timings stored by db_updater
+    parts = [metrics.render(REQUEST_LATENCY, REQUESTS)]
+    if db_path().exists():
+        conn = sqlite3.connect(db_path())
+        try:
+            parts.append(metrics.render(*metrics.ingest_metrics(conn)))
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
+    return Response(''.join(parts), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/markets')
 def api_markets():
     markets = load_markets()
     return jsonify({'markets': markets})
 
 
+def last_good(market_id):
+    """Stale-but-valid response from the scrapers' last-known-good store, or None."""
+    try:
+        loaded = lkg_store.records(market_id)
+    except (OSError, ValueError):
+        # unreadable file, or a market_id that is not a plain name (lkg_store.path_for)
+        return None
+    if loaded is None:
+        return None
+    rows, meta = loaded
+    return {'market_id': market_id, 'data': rows, 'stale': True, 'saved_at': meta['saved_at']}
+
+
+def published(doc, mimetype='application/json'):
+    """The pre-rendered file of a document (static_publish.py) if it is current, else None."""
+    found = static_publish.lookup(doc, db_path(), request.headers.get('Accept-Encoding', ''))
+    if found is None:
+        return None
+    path, encoding, sha256 = found
+    # one ETag per encoding: the bytes differ
+    response = send_file(path, mimetype=mimetype, etag=f"{sha256[:32]}-{encoding or 'identity'}",
+                         max_age=0, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/published/<path:name>')
+def published_file(name):
+    # the publish directory itself; hashed names never change, the manifest does
+    max_age = 0 if name == static_publish.MANIFEST else 31536000
+    return send_from_directory(static_publish.PUBLISH_DIR, name, max_age=max_age)
+
+
+@app.route('/api/latest')
+def api_latest_all():
+    # latest rows of every market in one document
+    response = published(static_publish.ALL_MARKETS)
+    if response is not None:
+        return response
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    conn = sqlite3.connect(db_path())
+    try:
+        with span('query'):
+            market_ids = [r[0] for r in conn.execute('SELECT DISTINCT market_id FROM prices WHERE market_id IS NOT NULL')]
+            markets = []
+            for m in sorted(market_ids):
+                data, next_cursor = static_publish.latest_page(conn, m)
+                markets.append({'market_id': m, 'data': data, 'next_cursor': next_cursor})
+            version = data_version(conn)
+    finally:
+        conn.close()
+    return jsonify({'markets': markets, 'version': version})
+
+
+def nearby_markets(latf, lonf, radius_km):
+    """Markets within radius_km, nearest first; the nearest one if none is."""
+    distances = sorted(((haversine(latf, lonf, float(m.get('lat', 0)), float(m.get('lon', 0))), m)
+                        for m in load_markets()), key=lambda x: x[0])
+    nearby = [m for d, m in distances if d <= radius_km]
+    return nearby or [m for _, m in distances[:1]]
+
+
+@app.route('/api/bundle')
+def api_bundle():
+    # offline SQLite bundle with the latest snapshot of all markets, or of ?markets=a,b / ?lat&lon[&radius_km]
+    market_ids = [m for m in request.args.get('markets', '').split(',') if m]
+    if request.args.get('lat') and request.args.get('lon'):
+        try:
+            nearby = nearby_markets(float(request.args['lat']), float(request.args['lon']),
+                                    float(request.args.get('radius_km', '50')))
+        except ValueError:
+            return jsonify({'error': 'invalid lat/lon/radius_km'}), 400
+        market_ids = [m['id'] for m in nearby]
+    if not market_ids:
+        response = published(static_publish.BUNDLE, offline_bundle.MIMETYPE)
+        if response is not None:
+            return response
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    conn = sqlite3.connect(db_path())
+    try:
+        with span('query'):
+            body = offline_bundle.build(conn, market_ids or None)
+    finally:
+        conn.close()
+    response = Response(body, mimetype=offline_bundle.MIMETYPE)
+    response.set_etag(hashlib.sha256(body).hexdigest()[:32])
+    response.headers['Content-Disposition'] = 'attachment; filename=hal_bundle.sqlite'
+    return response.make_conditional(request)
+
+
+def page_args(default_limit):
+    """(fields, limit, cursor) from ?fields=a,b&limit=n&cursor=token (see pagination.py)."""
+    return (pagination.parse_fields(request.args.get('fields')),
+            pagination.parse_limit(request.args.get('limit'), default_limit),
+            request.args.get('cursor'))
+
+
+def last_good_page(market_id, fields):
+    fallback = last_good(market_id)
+    if fallback is not None:
+        fallback['data'] = pagination.project(fallback['data'], fields)
+    return fallback
+
+
 @app.route('/api/market/<market_id>/latest')
 def api_market_latest(market_id):
-    if not DB_PATH.exists():
+    # newest rows first; ?limit, ?cursor (next_cursor of the previous page) and ?fields=a,b
+    try:
+        fields, limit, cursor = page_args(static_publish.LATEST_LIMIT)
+    except pagination.PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    default_page = not (request.args.get('fields') or request.args.get('limit') or cursor)
+    if default_page:
+        response = published(f'market/{market_id}')
+        if response is not None:
+            return response
+    if not db_path().exists():
+        fallback = last_good_page(market_id, fields)
+        if fallback is not None:
+            return jsonify(fallback)
         return jsonify({'error': 'DB not found'}), 500
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM prices WHERE market_id=? ORDER BY date_scraped DESC LIMIT 100', (market_id,))
-    rows = cur.fetchall()
-    conn.close()
-    data = [dict(r) for r in rows]
-    return jsonify({'market_id': market_id, 'data': data})
+    conn = sqlite3.connect(db_path())
+    try:
+        with span('query'):
+            data, next_cursor = pagination.page(conn, market_id, limit, fields, cursor)
+            version = data_version(conn)
+    except pagination.PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    if not data and not cursor:
+        fallback = last_good_page(market_id, fields)
+        if fallback is not None:
+            return jsonify(fallback)
+    return jsonify({'market_id': market_id, 'data': data, 'version': version, 'next_cursor': next_cursor})
+
+
+@app.route('/api/market/<market_id>/lastgood')
+def api_market_lastgood(market_id):
+    # last table the scraper parsed successfully, served without touching the DB or the site
+    fallback = last_good(market_id)
+    if fallback is None:
+        return jsonify({'error': 'no last-good data for market'}), 404
+    return jsonify(fallback)
 
 
 @app.route('/api/prices')
@@ -70,15 +366,20 @@ def api_prices():
     lon = request.args.get('lon')
     radius_km = float(request.args.get('radius_km', '50'))
 
-    if not DB_PATH.exists():
-        return jsonify({'error': 'DB not found'}), 500
-
-    markets = load_markets()
-
-    # if market_id provided, return that market latest
+    # if market_id provided, return that market latest (falls back to the last-good store)
     if market_id:
         return api_market_latest(market_id)
 
+    try:
+        fields, limit, _ = page_args(200)
+    except pagination.PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+
+    with span('market-load'):
+        markets = load_markets()
+
     if lat and lon:
         try:
             latf = float(lat)
@@ -87,29 +388,337 @@ def api_prices():
             return jsonify({'error': 'invalid lat/lon'}), 400
         # find nearest markets within radius
         distances = []
-        for m in markets:
-            d = haversine(latf, lonf, float(m.get('lat', 0)), float(m.get('lon', 0)))
-            distances.append((d, m))
-        distances.sort(key=lambda x: x[0])
+        with span('distance'):
+            for m in markets:
+                d = haversine(latf, lonf, float(m.get('lat', 0)), float(m.get('lon', 0)))
+                distances.append((d, m))
+            distances.sort(key=lambda x: x[0])
         nearby = [m for d, m in distances if d <= radius_km]
         if not nearby:
             # if none in radius return nearest (first)
             nearby = [distances[0][1]] if distances else []
-        # collect latest data for each nearby market
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
+        # collect latest data for each nearby market; next_cursor continues on /api/market/<id>/latest
+        conn = sqlite3.connect(db_path())
         result = []
-        for m in nearby:
-            cur.execute('SELECT * FROM prices WHERE market_id=? ORDER BY date_scraped DESC LIMIT 200', (m['id'],))
-            rows = [dict(r) for r in cur.fetchall()]
-            result.append({'market': m, 'data': rows})
-        conn.close()
-        return jsonify({'nearby': result})
+        try:
+            with span('query'):
+                for m in nearby:
+                    rows, next_cursor = pagination.page(conn, m['id'], limit, fields)
+                    result.append({'market': m, 'data': rows, 'next_cursor': next_cursor})
+                version = data_version(conn)
+        except pagination.PaginationError as e:
+            return jsonify({'error': str(e)}), 400
+        finally:
+            conn.close()
+        return jsonify({'nearby': result, 'version': version})
 
     return jsonify({'error': 'provide market_id or lat & lon'}), 400
 
 
+@app.route('/api/stream')
+def api_stream():
+    # Server-Sent Events: changed rows of the subscribed markets (?markets=a,b; none = all) as they are committed.
+    # Resumes after ?since=<version> or the Last-Event-ID header sent by reconnecting EventSource clients.
+    market_ids = [m for m in request.args.get('markets', '').split(',') if m]
+    since = request.args.get('since') or request.headers.get('Last-Event-ID')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({'error': 'since must be an integer version'}), 400
+    sub = LIVE.subscribe(market_ids)
+    if sub is None:
+        return jsonify({'error': 'too many subscribers, poll /api/prices/changes instead'}), 503
+
+    def catch_up(version):
+        if not db_path().exists():
+            return None
+        conn = sqlite3.connect(db_path())
+        try:
+            return change_log.changes_since(conn, version, market_ids)
+        except sqlite3.OperationalError:
+            return None
+        finally:
+            conn.close()
+
+    response = Response(live_updates.stream(LIVE, sub, since, catch_up), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # keep reverse proxies (nginx) from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def export_chunks(path, market_ids, start, end):
+    """
+    (columns, rows) chunks of a market/date range in (market_id, date_scraped, product, id) order.
+    Keyset paginated: every chunk is its own short query, so a long export never holds the shared
+    lock db_updater has to wait for, and memory stays at one chunk. An empty range yields one
+    (columns, []) chunk, so a CSV export still has its header row.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        if not market_ids:
+            market_ids = [r[0] for r in conn.execute('SELECT DISTINCT market_id FROM prices WHERE market_id IS NOT NULL ORDER BY 1')]
+        columns = compact_schema.price_columns(conn)
+        # on a compact DB the range and the keyset are on the clustered (day, tod), not the computed date_scraped
+        date_cols = compact_schema.date_columns(conn)
+        key_cols = (*date_cols, 'product', 'id')
+        if date_cols == compact_schema.KEY_COLUMNS:
+            # '0000-00-00' (no lower bound) is not a date strptime accepts
+            lo, hi = compact_schema.date_key(max(start, '0001-01-01'))[0], compact_schema.date_key(end)[0] + 1
+        else:
+            lo, hi = start, end + '~'
+        lead = key_cols[0]
+        empty = True
+        for market_id in market_ids:
+            after = None
+            while True:
+                sql = f'''
+                    SELECT {', '.join(columns)} FROM prices
+                    WHERE market_id = ? AND {lead} >= ? AND {lead} < ? AND product IS NOT NULL
+                '''
+                params = [market_id, lo, hi]
+                if after is not None:
+                    sql += f' AND {lead} >= ? AND ({", ".join(key_cols)}) > ({", ".join("?" * len(after))})'
+                    params.extend((after[0], *after))
+                sql += ' ORDER BY ' + ', '.join(key_cols) + ' LIMIT ?'
+                rows = conn.execute(sql, (*params, EXPORT_CHUNK_ROWS)).fetchall()
+                if not rows:
+                    break
+                empty = False
+                yield columns, rows
+                last = dict(zip(columns, rows[-1]))
+                after = (*compact_schema.date_values(date_cols, last['date_scraped']), last['product'], last['id'])
+                if len(rows) < EXPORT_CHUNK_ROWS:
+                    break
+        if empty:
+            yield columns, []
+    finally:
+        conn.close()
+
+
+def export_stream(chunks, fmt, compress):
+    encoder = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip container
+    header_done = False
+    for columns, rows in chunks:
+        buf = io.StringIO()
+        if fmt == 'csv':
+            writer = csv.writer(buf, lineterminator='\n')
+            if not header_done:
+                writer.writerow(columns)
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                buf.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                buf.write('\n')
+        header_done = True
+        data = buf.getvalue().encode('utf-8')
+        if encoder is None:
+            yield data
+        else:
+            out = encoder.compress(data)
+            if out:
+                yield out
+    if encoder is not None:
+        yield encoder.flush()
+
+
+@app.route('/api/export')
+def api_export():
+    # bulk history download: ?market_id=a[,b]&from=YYYY-MM-DD&to=YYYY-MM-DD&format=ndjson|csv, streamed
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'format must be one of {list(EXPORT_FORMATS)}'}), 400
+    start = request.args.get('from', '0000-00-00')
+    end = request.args.get('to', '9999-12-31')
+    try:
+        for value in (start, end):
+            if value not in ('0000-00-00', '9999-12-31'):
+                datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'from/to must be YYYY-MM-DD'}), 400
+    market_ids = [m for m in request.args.get('market_id', '').split(',') if m]
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+    body = export_stream(export_chunks(db_path(), market_ids, start, end), fmt, compress)
+    response = Response(body, mimetype=EXPORT_FORMATS[fmt])
+    # market ids come from the query string: keep the file name to safe characters, quoted
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', '_'.join(['hal_export', '-'.join(market_ids) or 'all', start, end]))
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/api/prices/changes')
+def api_prices_changes():
+    # delta sync: rows inserted/updated/removed after data version `since`
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'error': 'provide integer since (0 for everything)'}), 400
+    market_ids = [m for m in request.args.get('market_id', '').split(',') if m]
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    conn = sqlite3.connect(db_path())
+    try:
+        result = change_log.changes_since(conn, since, market_ids)
+    except sqlite3.OperationalError:
+        # DB without change log: clients have to use the full endpoints
+        result = {'version': None, 'full_resync': True}
+    finally:
+        conn.close()
+    return jsonify(result)
+
+
+@app.route('/api/search')
+def api_search():
+    # product search across markets (prefix match, Turkish-folded), nearest market first on ties
+    q = request.args.get('q', '')
+    lat = request.args.get('lat')
+    lon = request.args.get('lon')
+    try:
+        # clamped to 1..MAX_LIMIT, a negative LIMIT would return every match
+        limit = max(1, min(int(request.args.get('limit', str(product_search.DEFAULT_LIMIT))), product_search.MAX_LIMIT))
+        latf = float(lat) if lat else None
+        lonf = float(lon) if lon else None
+    except ValueError:
+        return jsonify({'error': 'invalid limit or lat/lon'}), 400
+    if not product_search.match_query(q):
+        return jsonify({'error': 'provide q'}), 400
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    with span('market-load'):
+        markets = {m['id']: m for m in load_markets()}
+    conn = sqlite3.connect(db_path())
+    conn.row_factory = sqlite3.Row
+    try:
+        with span('query'):
+            hits = product_search.search(conn, q, limit)
+    except sqlite3.OperationalError:
+        conn.close()
+        return jsonify({'error': 'search index not available'}), 404
+    results = []
+    columns = ', '.join(compact_schema.price_columns(conn))
+    for market_id, product, rank in hits:
+        with span('query'):
+            row = conn.execute(f'SELECT {columns} FROM prices WHERE market_id=? AND product=? ORDER BY date_scraped DESC LIMIT 1', (market_id, product)).fetchone()
+        m = markets.get(market_id)
+        distance = None
+        if m and latf is not None and lonf is not None:
+            with span('distance'):
+                distance = haversine(latf, lonf, float(m.get('lat', 0)), float(m.get('lon', 0)))
+        results.append({'market': m or {'id': market_id}, 'product': product, 'rank': rank,
+                        'distance_km': distance, 'latest': dict(row) if row else None})
+    conn.close()
+    results.sort(key=lambda r: (round(r['rank'], 6), r['distance_km'] if r['distance_km'] is not None else float('inf')))
+    return jsonify({'q': q, 'results': results})
+
+
+@app.route('/api/products/<int:product_id>/prices')
+def api_product_prices(product_id):
+    # latest price of one canonical product in every market (index on prices.product_id)
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    conn = sqlite3.connect(db_path())
+    conn.row_factory = sqlite3.Row
+    try:
+        product = conn.execute('SELECT id, canonical_name FROM products WHERE id=?', (product_id,)).fetchone()
+        columns = ', '.join(compact_schema.price_columns(conn))
+        rows = conn.execute(f'SELECT {columns} FROM prices WHERE product_id=? ORDER BY date_scraped DESC LIMIT 1000', (product_id,)).fetchall()
+    except sqlite3.OperationalError:
+        return jsonify({'error': 'product catalog not available'}), 404
+    finally:
+        conn.close()
+    if product is None:
+        return jsonify({'error': 'unknown product'}), 404
+    latest = {}
+    for r in rows:
+        latest.setdefault(r['market_id'], dict(r))
+    return jsonify({'product': dict(product), 'markets': list(latest.values())})
+
+
+@app.route('/api/stats/products')
+def api_stats_products():
+    # per-product min/max/mean/median/spread across markets for one day (default latest)
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    conn = sqlite3.connect(db_path())
+    try:
+        day, stats = rollups.product_stats(conn, request.args.get('day'))
+    except sqlite3.OperationalError:
+        return jsonify({'error': 'rollups not available'}), 404
+    finally:
+        conn.close()
+    return jsonify({'day': day, 'products': stats})
+
+
+@app.route('/api/stats/product')
+def api_stats_product():
+    # daily or weekly cross-market statistics of one product over a date range
+    name = request.args.get('name')
+    period = request.args.get('period', 'daily')
+    if not name:
+        return jsonify({'error': 'provide name'}), 400
+    if period not in rollups.PERIODS:
+        return jsonify({'error': f'period must be one of {list(rollups.PERIODS)}'}), 400
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    conn = sqlite3.connect(db_path())
+    try:
+        key, series = rollups.product_series(conn, name, request.args.get('from'), request.args.get('to'), period)
+    except sqlite3.OperationalError:
+        return jsonify({'error': 'rollups not available'}), 404
+    finally:
+        conn.close()
+    return jsonify({'product_key': key, 'period': period, 'series': series})
+
+
+@app.route('/api/history/<market_id>/at')
+def api_history_at(market_id):
+    # price of every product of a market at time t (default: now)
+    try:
+        ts = parse_ts(request.args.get('t'), default=int(time.time()))
+    except ValueError:
+        return jsonify({'error': 'invalid t'}), 400
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    conn = sqlite3.connect(db_path())
+    try:
+        data = price_history.price_at(conn, market_id, ts)
+    except sqlite3.OperationalError:
+        return jsonify({'error': 'price history not available'}), 404
+    finally:
+        conn.close()
+    return jsonify({'market_id': market_id, 't': ts, 'data': data})
+
+
+@app.route('/api/history/changes')
+def api_history_changes():
+    # price change events after `since` (optionally for one market), oldest first
+    try:
+        since = parse_ts(request.args.get('since'))
+        limit = int(request.args.get('limit', '1000'))
+    except ValueError:
+        return jsonify({'error': 'invalid since/limit'}), 400
+    if since is None:
+        return jsonify({'error': 'provide since'}), 400
+    if not 1 <= limit <= price_history.MAX_CHANGES_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {price_history.MAX_CHANGES_LIMIT}'}), 400
+    if not db_path().exists():
+        return jsonify({'error': 'DB not found'}), 500
+    conn = sqlite3.connect(db_path())
+    try:
+        changes = price_history.changes_since(conn, since, request.args.get('market_id'), limit)
+    except sqlite3.OperationalError:
+        return jsonify({'error': 'price history not available'}), 404
+    finally:
+        conn.close()
+    # clients page by passing the last `ts` back as `since`
+    return jsonify({'since': since, 'changes': changes, 'last_ts': changes[-1]['ts'] if changes else since})
+
+
 if __name__ == '__main__':
     print('Starting API server on http://0.0.0.0:5000')
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Columnar Price Archive (Parquet)
+- Partitioned as archive/date=YYYY-MM-DD/market_id=<id>/part-0.parquet (hive layout, zstd)
+- Each partition is written to a temp file and renamed, so readers never see half-written files
+- `scan()` reads months of history through pyarrow.dataset: date/market filters prune whole
+  partitions and column filters are pushed down to the Parquet row groups
+
+Usage:
+- Archive new days and the latest day of each market: python archive.py
+- Rewrite every (market, day) in the DB: python archive.py --all
+- Scan: python archive.py --scan 2025-01-01 2025-03-31 [market_id]
+"""
+import functools
+import operator
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # archive is optional, the updater keeps working without pyarrow
+    pa = ds = pq = None
+
+BASE = Path(__file__).parent
+ARCHIVE_DIR = BASE / 'archive'
+PART_NAME = 'part-0.parquet'
+
+COLUMNS = ['market_name', 'product', 'product_id', 'category', 'price_min', 'price_max', 'unit',
+           'date_scraped', 'source_file', 'inserted_at']
+PARTITIONING_SCHEMA = [('date', 'string'), ('market_id', 'string')]
+
+
+def available():
+    return pa is not None
+
+
+def _file_schema():
+    return pa.schema([
+        ('market_name', pa.string()), ('product', pa.string()), ('product_id', pa.int64()),
+        ('category', pa.string()), ('price_min', pa.float64()), ('price_max', pa.float64()),
+        ('unit', pa.string()), ('date_scraped', pa.string()), ('source_file', pa.string()),
+        ('inserted_at', pa.int64()),
+    ])
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([(name, getattr(pa, t)()) for name, t in PARTITIONING_SCHEMA]), flavor='hive')
+
+
+def partition_path(day, market_id, archive_dir=None):
+    return Path(archive_dir or ARCHIVE_DIR) / f'date={day}' / f'market_id={market_id}' / PART_NAME
+
+
+def write_partition(conn, market_id, day, archive_dir=None):
+    """Write all rows of one market/day (every snapshot of that day). Returns the row count."""
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(prices)').fetchall()]
+    select = ', '.join(c if c in cols else f'NULL AS {c}' for c in COLUMNS)
+    cur = conn.execute(f'''
+        SELECT {select} FROM prices
+        WHERE market_id = ? AND date_scraped >= ? AND date_scraped < ?
+        ORDER BY date_scraped, product
+    ''', (market_id, day, day + '~'))
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+    table = pa.Table.from_pylist([dict(zip(COLUMNS, r)) for r in rows], schema=_file_schema())
+    out = partition_path(day, market_id, archive_dir)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f'.{out.name}.{os.getpid()}.tmp')
+    pq.write_table(table, tmp, compression='zstd')
+    os.replace(tmp, out)
+    return len(rows)
+
+
+def archive(conn, days=None, rewrite=False, archive_dir=None):
+    """
+    Archive (market, day) partitions. `days` limits the run to those days; otherwise every day
+    that has no partition yet plus the latest day of each market (it may still change), or
+    every day with rewrite=True. Returns [(market_id, day, rows)].
+    """
+    pairs = conn.execute('SELECT DISTINCT market_id, substr(date_scraped, 1, 10) FROM prices WHERE date_scraped IS NOT NULL').fetchall()
+    latest = dict(conn.execute('SELECT market_id, MAX(substr(date_scraped, 1, 10)) FROM prices GROUP BY market_id').fetchall())
+    written = []
+    for market_id, day in sorted(pairs):
+        if days is not None:
+            if day not in days:
+                continue
+        elif not rewrite and partition_path(day, market_id, archive_dir).exists() and latest.get(market_id) != day:
+            continue
+        written.append((market_id, day, write_partition(conn, market_id, day, archive_dir)))
+    return written
+
+
+def scan(start=None, end=None, market_ids=None, columns=None, where=None, archive_dir=None):
+    """
+    Read archived rows as a pyarrow Table.
+    start/end (YYYY-MM-DD) and market_ids prune partitions; `where` is an extra pyarrow
+    expression, e.g. ds.field('price_max') > 50, evaluated with row-group statistics.
+    """
+    archive_dir = Path(archive_dir or ARCHIVE_DIR)
+    if not archive_dir.exists():
+        return pa.table({})
+    dataset = ds.dataset(str(archive_dir), format='parquet', partitioning=_partitioning())
+    parts = []
+    if start:
+        parts.append(ds.field('date') >= start)
+    if end:
+        parts.append(ds.field('date') <= end)
+    if market_ids:
+        parts.append(ds.field('market_id').isin(list(market_ids)))
+    if where is not None:
+        parts.append(where)
+    expr = functools.reduce(operator.and_, parts) if parts else None
+    return dataset.to_table(columns=columns, filter=expr)
+
+
+if __name__ == '__main__':
+    if not available():
+        print('pyarrow is not installed: pip install pyarrow')
+        sys.exit(1)
+    if '--scan' in sys.argv:
+        i = sys.argv.index('--scan')
+        args = sys.argv[i + 1:]
+        table = scan(args[0] if args else None, args[1] if len(args) > 1 else None, args[2:] or None)
+        print(f"{table.num_rows} rows")
+        if table.num_rows:
+            print(table.to_pandas().groupby(['date', 'market_id']).size())
+        sys.exit(0)
+    import db_updater
+    conn = sqlite3.connect(db_updater.DB_PATH)
+    written = archive(conn, rewrite='--all' in sys.argv)
+    conn.close()
+    print(f"Archived {len(written)} partitions, {sum(w[2] for w in written)} rows -> {ARCHIVE_DIR}")
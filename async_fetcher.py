@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Async Fetch Pipeline
+- Fetches many market pages concurrently with asyncio + aiohttp
+- Limits parallel requests per host so a single site is never flooded
+- Retries network errors, truncated bodies and HTTP 5xx with non-blocking exponential backoff (asyncio.sleep);
+  HTTP 4xx fails at once, an error page is never returned as a fetched page
+- Every request has its own timeout, so N pages cost ~max(timeout), not sum(timeout)
+- Helpers for the İzmir sebze/meyve pages and `?date=` ranges for backfills
+
+Usage:
+- Fetch today's pages of all markets: python async_fetcher.py
+- Fetch İzmir pages for a date range: python async_fetcher.py --izmir 2025-01-01 2025-01-31
+"""
+import asyncio
+import sys
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from urllib.parse import urlsplit
+
+import aiohttp
+
+IZMIR_BASE_URL = "https://eislem.izmir.bel.tr/tr/HalFiyatlari/20"
+# tip query parameter of the İzmir endpoint
+IZMIR_TIPLER = {1: 'Sebze', 2: 'Meyve'}
+MARKET_URLS = {
+    'gazipasa_market': "https://gazipasa.bel.tr/gunluk-hal-fiyatlari",
+    'kumluca_market': "https://www.batiakdeniztv.com/kumluca-hal-fiyatlari/",
+}
+
+# max parallel requests against the same host
+PER_HOST_LIMIT = 4
+# per-request timeout (seconds)
+REQUEST_TIMEOUT_S = 30
+MAX_RETRIES = 3
+BACKOFF_MIN_S = 2
+BACKOFF_MAX_S = 10
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+FetchResult = namedtuple('FetchResult', ['key', 'url', 'status', 'text', 'error', 'attempts'])
+
+# same network errors the scrapers retry on, plus bodies cut off mid-transfer
+RETRY_EXCEPTIONS = (aiohttp.ClientConnectionError, aiohttp.ServerTimeoutError, aiohttp.ClientPayloadError,
+                    asyncio.TimeoutError, OSError)
+
+
+def izmir_url(day, tip):
+    if isinstance(day, (date, datetime)):
+        day = day.strftime('%Y-%m-%d')
+    return f"{IZMIR_BASE_URL}?date={day}&tip={tip}&aranacak="
+
+
+def izmir_urls(days):
+    """Return {(YYYY-MM-DD, 'Sebze'|'Meyve'): url} for every day in `days`."""
+    urls = {}
+    for d in days:
+        day = d.strftime('%Y-%m-%d') if isinstance(d, (date, datetime)) else d
+        for tip, url_type in IZMIR_TIPLER.items():
+            urls[(day, url_type)] = izmir_url(day, tip)
+    return urls
+
+
+def date_range(start, end):
+    """Inclusive list of dates between two YYYY-MM-DD strings (or dates)."""
+    if isinstance(start, str):
+        start = datetime.strptime(start, '%Y-%m-%d').date()
+    if isinstance(end, str):
+        end = datetime.strptime(end, '%Y-%m-%d').date()
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def backoff_delay(attempt):
+    """Exponential backoff: 2s, 4s, 8s ... capped at BACKOFF_MAX_S."""
+    return min(BACKOFF_MAX_S, BACKOFF_MIN_S * (2 ** (attempt - 1)))
+
+
+async def _fetch_one(session, host_limits, key, url, max_retries):
+    sem = host_limits[urlsplit(url).netloc]
+    error = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            # hold the host slot only while the request is in flight, not while backing off
+            async with sem:
+                async with session.get(url, headers=HEADERS) as resp:
+                    resp.raise_for_status()
+                    text = await resp.text(errors='replace')
+                    return FetchResult(key, url, resp.status, text, None, attempt)
+        except aiohttp.ClientResponseError as e:
+            error = f"HTTP {e.status}"
+            print(f"Fetch failed ({attempt}/{max_retries}) {url}: {error}")
+            if e.status < 500:
+                # 4xx will not change on a retry
+                return FetchResult(key, url, e.status, None, error, attempt)
+            if attempt < max_retries:
+                await asyncio.sleep(backoff_delay(attempt))
+        except RETRY_EXCEPTIONS as e:
+            error = str(e) or type(e).__name__
+            print(f"Fetch failed ({attempt}/{max_retries}) {url}: {error}")
+            if attempt < max_retries:
+                await asyncio.sleep(backoff_delay(attempt))
+        except Exception as e:
+            # non-network errors are not retried
+            return FetchResult(key, url, None, None, str(e), attempt)
+    return FetchResult(key, url, None, None, error, max_retries)
+
+
+async def fetch_all(urls, per_host_limit=PER_HOST_LIMIT, timeout_s=REQUEST_TIMEOUT_S, max_retries=MAX_RETRIES):
+    """Fetch {key: url} concurrently and return {key: FetchResult}."""
+    host_limits = {}
+    for url in urls.values():
+        host_limits.setdefault(urlsplit(url).netloc, asyncio.Semaphore(per_host_limit))
+    timeout = aiohttp.ClientTimeout(total=timeout_s)
+    connector = aiohttp.TCPConnector(limit_per_host=per_host_limit, ssl=False)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        tasks = [_fetch_one(session, host_limits, key, url, max_retries) for key, url in urls.items()]
+        results = await asyncio.gather(*tasks)
+    return {r.key: r for r in results}
+
+
+def fetch_all_sync(urls, **kwargs):
+    """Blocking wrapper for the (synchronous) scraper scripts."""
+    return asyncio.run(fetch_all(urls, **kwargs))
+
+
+def all_market_urls(day=None):
+    """Entry pages of every market (İzmir sebze + meyve, Gazipaşa listing, Kumluca)."""
+    day = day or datetime.now().strftime('%Y-%m-%d')
+    urls = dict(MARKET_URLS)
+    for (d, url_type), url in izmir_urls([day]).items():
+        urls[f"izmir_market:{url_type}"] = url
+    return urls
+
+
+def _print_summary(results, started):
+    ok = sum(1 for r in results.values() if r.text is not None)
+    for key, r in results.items():
+        state = f"HTTP {r.status}, {len(r.text)} chars" if r.text is not None else f"FAILED: {r.error}"
+        print(f"{key}: {state} (attempts={r.attempts})")
+    print(f"{ok}/{len(results)} pages fetched in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    started = time.monotonic()
+    if '--izmir' in sys.argv:
+        i = sys.argv.index('--izmir')
+        start, end = sys.argv[i + 1], sys.argv[i + 2]
+        results = fetch_all_sync(izmir_urls(date_range(start, end)))
+    else:
+        results = fetch_all_sync(all_market_urls())
+    _print_summary(results, started)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+API Load Test
+- Generates a synthetic DB (N markets x M products x D days, fixed seed) plus a matching market coords file
+- Serves api_server from it in-process (threaded werkzeug server), or targets a running server with --url
+- Hits /api/markets, /api/market/<id>/latest and /api/prices?lat&lon at each concurrency level
+- Reports p50/p95/p99 latency (ms), requests/second and errors per endpoint and level;
+  --json writes the same numbers to a file so two runs can be compared for regressions
+
+Usage:
+- Default run (3 x 200 x 30, concurrency 1,4,16): python bench_api.py
+- Bigger data and more clients: python bench_api.py --markets 50 --products 500 --days 90 --concurrency 1,8,32,64
+- Against a running server (DB not generated): python bench_api.py --url http://127.0.0.1:5000
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+
+import db_updater
+import product_catalog
+
+ENDPOINTS = ('markets', 'latest', 'prices_nearby')
+START_DAY = datetime(2025, 1, 1)
+# rough bounding box of Turkey for synthetic market coordinates
+LAT_RANGE = (36.0, 42.0)
+LON_RANGE = (26.0, 44.0)
+UNITS = ('KG', 'ADET', 'BAĞ')
+
+
+def generate_db(db_path, markets=3, products=200, days=30, seed=1):
+    """Create a synthetic DB with the real schema. Returns the market list for the coords file."""
+    rnd = random.Random(seed)
+    db_path = Path(db_path)
+    if db_path.exists():
+        db_path.unlink()
+    db_updater.ensure_db(db_path)
+    conn = sqlite3.connect(db_path)
+    names = [f'ÜRÜN {i:04d}' for i in range(products)]
+    ids = {name: product_catalog.resolve(conn, name) for name in names}
+    market_list = []
+    inserted_at = int(time.time())
+    for m in range(markets):
+        market_id = f'bench_market_{m:03d}'
+        market_list.append({'id': market_id, 'name': f'Bench {m}',
+                            'lat': round(rnd.uniform(*LAT_RANGE), 4), 'lon': round(rnd.uniform(*LON_RANGE), 4)})
+        rows = []
+        for d in range(days):
+            day = (START_DAY + timedelta(days=d)).strftime('%Y-%m-%d')
+            for name in names:
+                low = round(rnd.uniform(5, 120), 2)
+                rows.append((market_id, f'Bench {m}', name, 'Sebze', low, round(low * rnd.uniform(1, 1.5), 2),
+                             rnd.choice(UNITS), day, 'bench_api', inserted_at, ids[name]))
+        conn.executemany(db_updater.PRICE_INSERT_SQL, rows)
+        conn.commit()
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    return market_list
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def endpoint_urls(base_url, market_list, rnd):
+    """One request path per endpoint; market ids and positions vary per call."""
+    m = rnd.choice(market_list)
+    return {
+        'markets': f'{base_url}/api/markets',
+        'latest': f"{base_url}/api/market/{m['id']}/latest",
+        'prices_nearby': f"{base_url}/api/prices?lat={m['lat'] + rnd.uniform(-0.3, 0.3):.4f}"
+                         f"&lon={m['lon'] + rnd.uniform(-0.3, 0.3):.4f}&radius_km=50",
+    }
+
+
+def run_level(base_url, endpoint, market_list, concurrency, total, seed=1):
+    """Send `total` requests to one endpoint from `concurrency` clients. Returns the stats dict."""
+    per_worker = max(1, total // concurrency)
+
+    def worker(i):
+        rnd = random.Random(seed * 1000 + i)
+        session = requests.Session()
+        latencies, errors = [], 0
+        for _ in range(per_worker):
+            url = endpoint_urls(base_url, market_list, rnd)[endpoint]
+            t = time.perf_counter()
+            try:
+                r = session.get(url, timeout=30)
+                r.content
+                ok = r.status_code == 200
+            except requests.RequestException:
+                ok = False
+            latencies.append(time.perf_counter() - t)
+            errors += 0 if ok else 1
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(x for lat, _ in results for x in lat)
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': sum(e for _, e in results),
+        'rps': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def start_server(db_path, coords_file):
+    """Serve api_server from the synthetic DB on a free local port. Returns (base_url, server)."""
+    from werkzeug.serving import make_server
+    import api_server
+    api_server.DB_PATH = Path(db_path)
+    api_server.MARKET_COORDS_FILE = Path(coords_file)
+    # per-request access log lines would dominate the run time
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, api_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def print_table(results):
+    print(f"{'endpoint':<15}{'conc':>6}{'reqs':>7}{'err':>5}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['endpoint']:<15}{r['concurrency']:>6}{r['requests']:>7}{r['errors']:>5}{r['rps']:>10.1f}"
+              f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the hal prices API')
+    parser.add_argument('--markets', type=int, default=3)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--concurrency', default='1,4,16', help='comma separated client counts')
+    parser.add_argument('--requests', type=int, default=400, help='requests per endpoint and level')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--url', help='benchmark a running server instead (uses its /api/markets)')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--keep-db', action='store_true', help='keep the generated DB directory')
+    args = parser.parse_args()
+    levels = [int(c) for c in args.concurrency.split(',') if c]
+
+    workdir = server = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+        market_list = requests.get(f'{base_url}/api/markets', timeout=30).json()['markets']
+    else:
+        workdir = Path(tempfile.mkdtemp(prefix='bench_api_'))
+        started = time.perf_counter()
+        market_list = generate_db(workdir / 'bench.sqlite', args.markets, args.products, args.days, args.seed)
+        coords_file = workdir / 'market_coords.json'
+        coords_file.write_text(json.dumps({'markets': market_list}), encoding='utf-8')
+        print(f"Generated {args.markets} x {args.products} x {args.days} = "
+              f"{args.markets * args.products * args.days} rows in {time.perf_counter() - started:.1f}s ({workdir})")
+        base_url, server = start_server(workdir / 'bench.sqlite', coords_file)
+
+    results = []
+    try:
+        for endpoint in ENDPOINTS:
+            # warm up connections and SQLite's page cache before measuring
+            run_level(base_url, endpoint, market_list, 1, 5, args.seed)
+            for concurrency in levels:
+                results.append(run_level(base_url, endpoint, market_list, concurrency, args.requests, args.seed))
+    finally:
+        if server is not None:
+            server.shutdown()
+        if workdir is not None and not args.keep_db:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
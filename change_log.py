@@ -0,0 +1,97 @@
+"""
+Change Log / Data Version
+- Every row the updater inserts, updates or removes gets an entry in `change_log`
+- `version` (AUTOINCREMENT) is the monotonic data version clients sync against
+- Old entries are pruned; clients older than the oldest kept entry must do a full resync
+- A DB that already had prices when the log was created reserves version 1 for those unlogged rows, so a
+  client at version 0 gets a full resync instead of a delta that only covers the logged changes
+"""
+import time
+
+SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS change_log (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    market_id TEXT NOT NULL,
+    product TEXT NOT NULL,
+    date_scraped TEXT NOT NULL,
+    op TEXT NOT NULL,
+    changed_at INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_change_log_market ON change_log(market_id, version);
+'''
+
+OP_UPSERT = 'upsert'
+OP_DELETE = 'delete'
+# entries kept after pruning
+KEEP_ENTRIES = 200000
+# above this many changed rows a full download is cheaper than a delta
+MAX_DELTA_ROWS = 5000
+
+PRICE_COLUMNS = ['id', 'market_id', 'market_name', 'product', 'category', 'price_min', 'price_max',
+                 'unit', 'date_scraped', 'source_file', 'inserted_at']
+
+
+def ensure_schema(conn):
+    """Create the log; on a DB with existing prices reserve version 1 for them. Does not commit."""
+    new = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'change_log'").fetchone() is None
+    conn.executescript(SCHEMA_SQL)
+    if new and conn.execute('SELECT 1 FROM prices LIMIT 1').fetchone():
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', 1)")
+
+
+def log_changes(conn, market_id, keys, op, ts=None):
+    """Append (product, date_scraped) keys of one market. Does not commit. Returns the new version."""
+    ts = int(ts if ts is not None else time.time())
+    conn.executemany('INSERT INTO change_log (market_id, product, date_scraped, op, changed_at) VALUES (?, ?, ?, ?, ?)',
+                     [(market_id, prod, date, op, ts) for prod, date in keys])
+    return current_version(conn)
+
+
+def current_version(conn):
+    """Latest data version (0 if nothing was ever logged). Survives pruning."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def oldest_version(conn):
+    row = conn.execute('SELECT MIN(version) FROM change_log').fetchone()
+    return row[0]
+
+
+def prune(conn, keep=KEEP_ENTRIES):
+    conn.execute('DELETE FROM change_log WHERE version <= ?', (current_version(conn) - keep,))
+
+
+def changes_since(conn, since, market_ids=None):
+    """
+    Rows changed after version `since`, collapsed to the final state per row:
+    {'version', 'full_resync', 'upserts': [price rows], 'deletes': [{market_id, product, date_scraped}]}
+    """
+    version = current_version(conn)
+    oldest = oldest_version(conn)
+    # since is from another DB (rebuilt) or entries after it were pruned
+    if since > version or (since < version and (oldest is None or oldest > since + 1)):
+        return {'version': version, 'full_resync': True}
+
+    sql = '''
+        SELECT market_id, product, date_scraped, op, MAX(version) FROM change_log
+        WHERE version > ?
+    '''
+    params = [since]
+    if market_ids:
+        sql += ' AND market_id IN (%s)' % ','.join('?' * len(market_ids))
+        params.extend(market_ids)
+    sql += ' GROUP BY market_id, product, date_scraped'
+    changed = conn.execute(sql, params).fetchall()
+    if len(changed) > MAX_DELTA_ROWS:
+        return {'version': version, 'full_resync': True}
+
+    upserts, deletes = [], []
+    select_sql = 'SELECT %s FROM prices WHERE market_id=? AND product=? AND date_scraped=?' % ', '.join(PRICE_COLUMNS)
+    for market_id, product, date_scraped, op, _ in changed:
+        row = conn.execute(select_sql, (market_id, product, date_scraped)).fetchone() if op == OP_UPSERT else None
+        if row is None:
+            deletes.append({'market_id': market_id, 'product': product, 'date_scraped': date_scraped})
+        else:
+            upserts.append(dict(zip(PRICE_COLUMNS, row)))
+    return {'version': version, 'full_resync': False, 'upserts': upserts, 'deletes': deletes}
@@ -0,0 +1,249 @@
+"""
+Compact Storage Layout (opt-in migration)
+- Dimension tables for the repeated TEXT columns: dim_market (market_id + market_name), dim_category,
+  dim_unit, dim_source
+- `price_facts` WITHOUT ROWID, clustered on (market, day, product, tod): a market's days are stored
+  next to each other and the row is the primary key b-tree, there is no separate UNIQUE index
+- date_scraped is split into `day` (days since 1970-01-01) and `tod` (seconds of the day, -1 for
+  date-only values), so 'YYYY-MM-DD' and 'YYYY-MM-DD HH:MM:SS' both round-trip exactly
+- `prices` becomes a view with the old columns plus INSTEAD OF triggers, so every existing
+  SELECT / INSERT / UPDATE / DELETE keeps working unchanged
+- Lookups by (market_id, product) and by id are indexed. date_scraped is computed in the view, so filters
+  on it scan the market's whole history: the view also exposes `day` / `tod`, and the hot paths
+  (pagination, apply_changes, offline bundle, export) filter and order on date_columns() instead
+- compact DBs migrated before `day` / `tod` were exposed get the new view from upgrade_view() (ensure_db)
+- analyze() drops the statistics of the tiny dim_* tables: with them the planner scans dim_market instead of
+  the unique market_id lookup and loses price_facts' order (a full sort of the market's history)
+"""
+from datetime import datetime
+
+SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS dim_market (
+    id INTEGER PRIMARY KEY,
+    market_id TEXT NOT NULL UNIQUE,
+    market_name TEXT
+);
+CREATE TABLE IF NOT EXISTS dim_category (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS dim_unit (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS dim_source (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS price_facts (
+    market INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    product TEXT NOT NULL,
+    tod INTEGER NOT NULL DEFAULT -1,
+    id INTEGER NOT NULL,
+    product_id INTEGER,
+    category INTEGER,
+    unit INTEGER,
+    source INTEGER,
+    price_min REAL,
+    price_max REAL,
+    inserted_at INTEGER,
+    PRIMARY KEY (market, day, product, tod)
+) WITHOUT ROWID;
+'''
+
+FACT_INDEXES_SQL = '''
+CREATE UNIQUE INDEX IF NOT EXISTS idx_price_facts_id ON price_facts(id);
+CREATE INDEX IF NOT EXISTS idx_price_facts_market_product ON price_facts(market, product, day);
+CREATE INDEX IF NOT EXISTS idx_price_facts_product_id ON price_facts(product_id, day);
+'''
+
+# SQL expressions converting a date_scraped value (X) to day / tod and back
+DAY_EXPR = "CAST(julianday(substr({x}, 1, 10)) - 2440587.5 AS INTEGER)"
+TOD_EXPR = "CASE WHEN length({x}) > 10 THEN CAST(strftime('%s', '1970-01-01 ' || substr({x}, 12)) AS INTEGER) ELSE -1 END"
+DATE_EXPR = "date({day} * 86400, 'unixepoch') || CASE WHEN {tod} >= 0 THEN ' ' || time({tod}, 'unixepoch') ELSE '' END"
+
+VIEW_SQL = f'''
+CREATE VIEW prices AS
+SELECT f.id AS id, m.market_id AS market_id, m.market_name AS market_name, f.product AS product,
+       c.name AS category, f.price_min AS price_min, f.price_max AS price_max, u.name AS unit,
+       {DATE_EXPR.format(day='f.day', tod='f.tod')} AS date_scraped,
+       s.name AS source_file, f.inserted_at AS inserted_at, f.product_id AS product_id,
+       f.day AS day, f.tod AS tod
+FROM price_facts f
+JOIN dim_market m ON m.id = f.market
+LEFT JOIN dim_category c ON c.id = f.category
+LEFT JOIN dim_unit u ON u.id = f.unit
+LEFT JOIN dim_source s ON s.id = f.source;
+'''
+
+_DIMS_FROM_NEW = '''
+    INSERT OR IGNORE INTO dim_market (market_id, market_name) VALUES (NEW.market_id, NEW.market_name);
+    UPDATE dim_market SET market_name = NEW.market_name
+        WHERE market_id = NEW.market_id AND NEW.market_name IS NOT NULL AND market_name IS NOT NEW.market_name;
+    INSERT OR IGNORE INTO dim_category (name) SELECT NEW.category WHERE NEW.category IS NOT NULL;
+    INSERT OR IGNORE INTO dim_unit (name) SELECT NEW.unit WHERE NEW.unit IS NOT NULL;
+    INSERT OR IGNORE INTO dim_source (name) SELECT NEW.source_file WHERE NEW.source_file IS NOT NULL;
+'''
+
+TRIGGERS_SQL = f'''
+CREATE TRIGGER prices_insert INSTEAD OF INSERT ON prices
+BEGIN
+    {_DIMS_FROM_NEW}
+    INSERT INTO price_facts (market, day, product, tod, id, product_id, category, unit, source,
+                             price_min, price_max, inserted_at)
+    VALUES ((SELECT id FROM dim_market WHERE market_id = NEW.market_id),
+            {DAY_EXPR.format(x='NEW.date_scraped')},
+            COALESCE(NEW.product, ''),
+            {TOD_EXPR.format(x='NEW.date_scraped')},
+            COALESCE(NEW.id, (SELECT COALESCE(MAX(id), 0) + 1 FROM price_facts)),
+            NEW.product_id,
+            (SELECT id FROM dim_category WHERE name = NEW.category),
+            (SELECT id FROM dim_unit WHERE name = NEW.unit),
+            (SELECT id FROM dim_source WHERE name = NEW.source_file),
+            NEW.price_min, NEW.price_max, NEW.inserted_at);
+END;
+CREATE TRIGGER prices_update INSTEAD OF UPDATE ON prices
+BEGIN
+    {_DIMS_FROM_NEW}
+    UPDATE price_facts SET
+        market = (SELECT id FROM dim_market WHERE market_id = NEW.market_id),
+        day = {DAY_EXPR.format(x='NEW.date_scraped')},
+        product = COALESCE(NEW.product, ''),
+        tod = {TOD_EXPR.format(x='NEW.date_scraped')},
+        product_id = NEW.product_id,
+        category = (SELECT id FROM dim_category WHERE name = NEW.category),
+        unit = (SELECT id FROM dim_unit WHERE name = NEW.unit),
+        source = (SELECT id FROM dim_source WHERE name = NEW.source_file),
+        price_min = NEW.price_min,
+        price_max = NEW.price_max,
+        inserted_at = NEW.inserted_at
+    WHERE id = OLD.id;
+END;
+CREATE TRIGGER prices_delete INSTEAD OF DELETE ON prices
+BEGIN
+    DELETE FROM price_facts WHERE id = OLD.id;
+END;
+'''
+
+# view columns that are not part of the old prices table
+KEY_COLUMNS = ('day', 'tod')
+EPOCH = datetime(1970, 1, 1)
+
+# the only date_scraped shapes the conversion round-trips exactly
+DATE_GLOBS = ('[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]',
+              '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]')
+
+
+def is_compact(conn):
+    """True if `prices` is the compatibility view over price_facts."""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'prices'").fetchone()
+    return row is not None and row[0] == 'view'
+
+
+def date_key(date_scraped):
+    """(day, tod) stored for a date_scraped value; DAY_EXPR / TOD_EXPR in Python."""
+    day = (datetime.strptime(date_scraped[:10], '%Y-%m-%d') - EPOCH).days
+    if len(date_scraped) <= 10:
+        return day, -1
+    t = datetime.strptime(date_scraped[11:19], '%H:%M:%S')
+    return day, t.hour * 3600 + t.minute * 60 + t.second
+
+
+def date_columns(conn):
+    """Columns to filter and order on in place of date_scraped: the clustered (day, tod) on a compact DB."""
+    return KEY_COLUMNS if is_compact(conn) else ('date_scraped',)
+
+
+def date_values(columns, date_scraped):
+    """Parameters for `columns` (from date_columns) matching one date_scraped value."""
+    return date_key(date_scraped) if columns == KEY_COLUMNS else (date_scraped,)
+
+
+def price_columns(conn):
+    """Columns of `prices` as in the normal layout (without the view's day / tod)."""
+    return [r[1] for r in conn.execute('PRAGMA table_info(prices)').fetchall() if r[1] not in KEY_COLUMNS]
+
+
+def _drop_dim_stats(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        conn.execute("DELETE FROM sqlite_stat1 WHERE tbl LIKE 'dim\\_%' ESCAPE '\\'")
+        # reload the statistics for this connection
+        conn.execute('ANALYZE sqlite_schema')
+
+
+def analyze(conn):
+    """ANALYZE, without statistics for the dimension tables on a compact DB. Does not commit."""
+    conn.execute('ANALYZE')
+    if is_compact(conn):
+        _drop_dim_stats(conn)
+
+
+def _create_view(conn):
+    conn.execute(VIEW_SQL)
+    for sql in TRIGGERS_SQL.split('END;'):
+        if sql.strip():
+            conn.execute(sql + 'END;')
+
+
+def upgrade_view(conn):
+    """Recreate the view (and its triggers) if it predates the day / tod columns. Does not commit."""
+    if not is_compact(conn):
+        return False
+    if 'day' in [r[1] for r in conn.execute('PRAGMA table_info(prices)').fetchall()]:
+        return False
+    conn.execute('DROP VIEW prices')
+    _create_view(conn)
+    _drop_dim_stats(conn)
+    return True
+
+
+def migrate(conn):
+    """
+    Move `prices` into the compact layout in one transaction. Commits.
+    Returns {'rows', 'migrated', 'duplicates'}; raises ValueError on date_scraped values that
+    would not round-trip. Does nothing if the DB is already compact.
+    """
+    if is_compact(conn):
+        return None
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(prices)').fetchall()]
+    if not cols:
+        raise ValueError('no prices table to migrate')
+    odd = conn.execute(f'''
+        SELECT date_scraped FROM prices
+        WHERE date_scraped IS NULL OR ({' AND '.join('date_scraped NOT GLOB ?' for _ in DATE_GLOBS)}) LIMIT 5
+    ''', DATE_GLOBS).fetchall()
+    if odd:
+        raise ValueError(f'date_scraped values the compact layout cannot store: {[r[0] for r in odd]}')
+    product_id = 'p.product_id' if 'product_id' in cols else 'NULL'
+    total = conn.execute('SELECT COUNT(*) FROM prices').fetchone()[0]
+    conn.commit()
+    try:
+        conn.execute('BEGIN')
+        for sql in SCHEMA_SQL.split(';'):
+            if sql.strip():
+                conn.execute(sql)
+        conn.execute('''
+            INSERT OR IGNORE INTO dim_market (market_id, market_name)
+            SELECT market_id, MAX(market_name) FROM prices WHERE market_id IS NOT NULL GROUP BY market_id
+        ''')
+        for table, col in (('dim_category', 'category'), ('dim_unit', 'unit'), ('dim_source', 'source_file')):
+            conn.execute(f'INSERT OR IGNORE INTO {table} (name) SELECT DISTINCT {col} FROM prices WHERE {col} IS NOT NULL')
+        # inserted in primary key order, so the clustered b-tree is filled sequentially
+        cur = conn.execute(f'''
+            INSERT OR IGNORE INTO price_facts (market, day, product, tod, id, product_id, category, unit, source,
+                                               price_min, price_max, inserted_at)
+            SELECT m.id, {DAY_EXPR.format(x='p.date_scraped')}, COALESCE(p.product, ''),
+                   {TOD_EXPR.format(x='p.date_scraped')}, p.id, {product_id},
+                   c.id, u.id, s.id, p.price_min, p.price_max, p.inserted_at
+            FROM prices p
+            JOIN dim_market m ON m.market_id = p.market_id
+            LEFT JOIN dim_category c ON c.name = p.category
+            LEFT JOIN dim_unit u ON u.name = p.unit
+            LEFT JOIN dim_source s ON s.name = p.source_file
+            ORDER BY 1, 2, 3, 4
+        ''')
+        migrated = cur.rowcount
+        conn.execute('DROP TABLE prices')
+        for sql in FACT_INDEXES_SQL.split(';'):
+            if sql.strip():
+                conn.execute(sql)
+        _create_view(conn)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    analyze(conn)
+    conn.commit()
+    return {'rows': total, 'migrated': migrated, 'duplicates': total - migrated}
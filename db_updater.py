@@ -3,21 +3,67 @@
 DB Updater and Daily Backup
 - Runs configured scraper scripts periodically to refresh DB
 - Ensures a UNIQUE constraint on (market_id, product, date_scraped)
-- Daily at 04:00 creates `backups/YYYY-MM-DD/` and saves latest per-market Excel files named `marketid_YYYY-MM-DD.xlsx`
+- Writes only rows whose values changed (per-market row hashing) and keeps a per-market version in `market_state`
+- Appends intraday price changes to `price_events` (see price_history.py)
+- Logs every inserted/updated/removed row with a monotonic data version for delta sync (see change_log.py)
+- Keeps daily/weekly price rollups up to date for the statistics API (see rollups.py)
+- Keeps the FTS5 product search index in sync (see product_search.py)
+- Stores per-market stage timings (scraper stages, script, db_write) and rows changed per run (see metrics.py)
+- Resolves every product name to a canonical product id stored in `prices.product_id` (see product_catalog.py)
+- Several updater processes or hosts can share the work: each market refresh (scraper run + ingest) is done
+  under a lease in `data/leases.sqlite` (HAL_LEASE_DB for a shared location); a market leased by another
+  node is skipped, a node that dies loses its leases after LEASE_TTL_S (see leases.py)
+- Optional compact layout: dimension tables + a WITHOUT ROWID fact table behind a `prices` view
+  (see compact_schema.py)
+- Nightly at 03:30 applies the retention tiers (all snapshots -> last snapshot per day -> rollups only)
+  in small batches, then incremental VACUUM and ANALYZE (see retention.py)
+- After every refresh renders the latest prices per market and for all markets as content-hashed static
+  JSON (+ gzip/brotli) under `data/publish/` for api_server or any static file server (see static_publish.py),
+  plus the offline SQLite bundle for the mobile apps (see offline_bundle.py)
+- Daily at 16:00 takes a verified, gzip-compressed online snapshot of the whole DB under `backups/db/`
+  (SQLite backup API in page batches, rotated; see snapshot.py)
+- Daily at 16:00 archives new (market, day) partitions to Parquet under `archive/` (see archive.py);
+  with `--excel` (or BACKUP_EXCEL) also saves latest per-market Excel files `backups/YYYY-MM-DD/marketid_YYYY-MM-DD.xlsx`
 
 Usage:
 - Run once: python db_updater.py --once
 - Run as scheduler: python db_updater.py
-- For immediate backup: python db_updater.py --backup-now
+- Run with the adaptive per-market scheduler (learned publish windows, backoff): python db_updater.py --adaptive
+- Ingest whenever a standalone scraper publishes its Excel file (no scraper runs, inotify or polling):
+  python db_updater.py --watch
+- For immediate backup: python db_updater.py --backup-now [--excel]
+- Only the DB snapshot: python db_updater.py --snapshot-now
+- Re-render the static JSON snapshots: python db_updater.py --publish-now
+- Rebuild price rollups from all history: python db_updater.py --rebuild-rollups
+- Rebuild the product search index: python db_updater.py --rebuild-search
+- Run the retention / compaction job now: python db_updater.py --maintenance
+  (add --convert-vacuum once to switch an existing DB to auto_vacuum=INCREMENTAL, rewrites the file)
+- Move the DB to the compact layout (takes a snapshot first): python db_updater.py --migrate-compact
 """
+import hashlib
 import sqlite3
 import subprocess
 import sys
+import threading
 from pathlib import Path
 import time
 import pandas as pd
 import os
 import schedule
+import adaptive_scheduler
+import archive
+import ingest_watcher
+import leases
+import change_log
+import compact_schema
+import metrics
+import price_history
+import product_catalog
+import product_search
+import retention
+import rollups
+import snapshot
+import static_publish
 from datetime import datetime
 
 BASE = Path(__file__).parent
@@ -31,8 +77,15 @@ SCRIPTS = [
     (BASE / 'veri çekme izmir.py', 'izmir_hal_fiyatlari.xlsx', 'izmir_market'),
 ]
 BACKUP_DIR = BASE / 'backups'
+# daily backup goes to the Parquet archive (archive.py); set True to also write the per-market Excel files
+BACKUP_EXCEL = False
 # How often to refresh (minutes)
 REFRESH_INTERVAL_MIN = 10
+# nightly retention / compaction job (tiers are configured in retention.py)
+MAINTENANCE_AT = "03:30"
+# rows missing from a batch are only removed if the scraper reported a complete scrape; without a report
+# (--watch ingests) only if the batch has at least this share of the stored rows
+MIN_BATCH_RATIO = 0.9
 
 CREATE_TABLE_SQL = '''
 CREATE TABLE IF NOT EXISTS prices (
@@ -51,20 +104,74 @@ CREATE TABLE IF NOT EXISTS prices (
 );
 '''
 
+# per-market change detection state: hash of the last written batch and a version bumped on every real change
+MARKET_STATE_SQL = '''
+CREATE TABLE IF NOT EXISTS market_state (
+    market_id TEXT PRIMARY KEY,
+    batch_hash TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    changed_at INTEGER,
+    checked_at INTEGER
+);
+'''
+
+# lookup index for DBs created without the UNIQUE constraint (e.g. hal_prices_three.sqlite)
+PRICES_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_prices_market_product_date ON prices(market_id, product, date_scraped)'
+# per-market date range scans (rollups, latest rows)
+PRICES_DATE_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_prices_market_date_product ON prices(market_id, date_scraped, product)'
+
+PRICE_INSERT_SQL = '''
+INSERT INTO prices (market_id, market_name, product, category, price_min, price_max, unit, date_scraped, source_file, inserted_at, product_id)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+PRICE_UPDATE_SQL = '''
+UPDATE prices SET
+    market_name = ?,
+    category = ?,
+    price_min = ?,
+    price_max = ?,
+    unit = ?,
+    source_file = ?,
+    inserted_at = ?
+WHERE market_id = ? AND product = ? AND date_scraped = ?
+'''
+
 EXPECTED_COLS = ['Ürün Adı', 'Kategori', 'En Düşük Fiyat (TL)', 'En Yüksek Fiyat (TL)', 'Birim']
 
 
-def ensure_db():
-    DB_PATH.parent.mkdir(exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+def ensure_db(db_path=None):
+    db_path = Path(db_path or DB_PATH)
+    db_path.parent.mkdir(exist_ok=True)
+    new_db = not db_path.exists()
+    conn = sqlite3.connect(db_path)
+    if new_db:
+        # lets retention.py hand freed pages back without a full VACUUM; only settable before the first table
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
     conn.execute(CREATE_TABLE_SQL)
+    conn.execute(MARKET_STATE_SQL)
+    # a compact DB's `prices` is a view; its lookups are indexed on price_facts
+    if not compact_schema.is_compact(conn):
+        conn.execute(PRICES_INDEX_SQL)
+        conn.execute(PRICES_DATE_INDEX_SQL)
+    else:
+        compact_schema.upgrade_view(conn)
+    product_catalog.ensure_schema(conn)
+    price_history.ensure_schema(conn)
+    change_log.ensure_schema(conn)
+    rollups.ensure_schema(conn)
+    product_search.ensure_schema(conn)
+    metrics.ensure_schema(conn)
     conn.commit()
     conn.close()
 
 
 def run_script_once(script_path: Path):
+    # the scraper claims the same market lease; with our owner id it re-enters ours instead of skipping
+    env = dict(os.environ, **{leases.OWNER_ENV: leases.owner_id()})
     try:
-        proc = subprocess.run([sys.executable, str(script_path), '--once'], capture_output=True, text=True, timeout=240)
+        proc = subprocess.run([sys.executable, str(script_path), '--once'], capture_output=True, text=True, timeout=240,
+                              env=env)
         return proc.returncode, proc.stdout + "\n" + proc.stderr
     except Exception as e:
         return -1, str(e)
@@ -96,31 +203,202 @@ def normalize_df(df: pd.DataFrame):
     return df[EXPECTED_COLS]
 
 
-def upsert_rows(conn, rows):
-        cur = conn.cursor()
-        # For portability, do a per-row upsert: try UPDATE, if no rows updated then INSERT
-        update_sql = '''
-        UPDATE prices SET
-            market_name = ?,
-            category = ?,
-            price_min = ?,
-            price_max = ?,
-            unit = ?,
-            source_file = ?,
-            inserted_at = ?
-        WHERE market_id = ? AND product = ? AND date_scraped = ?
-        '''
-        insert_sql = '''
-        INSERT INTO prices (market_id, market_name, product, category, price_min, price_max, unit, date_scraped, source_file, inserted_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        '''
-        for r in rows:
-                # r: (market_id, market_name, prod, cat, pmin, pmax, unit, scraped_date, source_file, inserted_at)
-                market_id, market_name, prod, cat, pmin, pmax, unit, scraped_date, source_file, inserted_at = r
-                cur.execute(update_sql, (market_name, cat, pmin, pmax, unit, source_file, inserted_at, market_id, prod, scraped_date))
-                if cur.rowcount == 0:
-                        cur.execute(insert_sql, (market_id, market_name, prod, cat, pmin, pmax, unit, scraped_date, source_file, inserted_at))
+def to_float(v):
+    if v is None: return None
+    s = str(v).replace('₺','').replace(',','.')
+    try:
+        return float(s)
+    except:
+        return None
+
+
+def df_to_rows(df: pd.DataFrame, market_id, scraped_date, source_file):
+    """Convert a normalized DataFrame into `prices` row tuples."""
+    rows = []
+    market_name = market_id.replace('_', ' ').title()
+    inserted_at = int(time.time())
+    for _, r in df.iterrows():
+        pmin = to_float(r.get('En Düşük Fiyat (TL)'))
+        pmax = to_float(r.get('En Yüksek Fiyat (TL)'))
+        unit = r.get('Birim') if pd.notna(r.get('Birim')) else None
+        prod = r.get('Ürün Adı')
+        cat = r.get('Kategori') if pd.notna(r.get('Kategori')) else None
+        rows.append((market_id, market_name, prod, cat, pmin, pmax, unit, scraped_date, source_file, inserted_at))
+    return rows
+
+
+def row_hash(cat, pmin, pmax, unit):
+    """Hash of the values that matter for change detection (not source_file / inserted_at)."""
+    return hashlib.blake2b(repr((cat, pmin, pmax, unit)).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def batch_hash(rows):
+    h = hashlib.blake2b(digest_size=16)
+    for r in sorted(rows, key=lambda r: (str(r[7]), str(r[2]))):
+        h.update(repr((r[2], r[7], r[3], r[4], r[5], r[6])).encode('utf-8'))
+    return h.hexdigest()
+
+
+def apply_changes(conn, market_id, rows, complete=None):
+    """
+    Compare a market batch with the stored snapshot of the same dates and write only
+    inserted, changed or removed rows. Returns (inserted, updated, deleted, unchanged).
+    `complete` is the scraper's report of whether every page was fetched (None if unknown).
+    """
+    now = int(time.time())
+    # rows without a product name can never be matched again; last row wins for duplicates
+    by_key = {(r[2], r[7]): r for r in rows if r[2] is not None and not pd.isna(r[2])}
+    cur = conn.cursor()
+    state = cur.execute('SELECT batch_hash, version FROM market_state WHERE market_id=?', (market_id,)).fetchone()
+    new_hash = batch_hash(by_key.values())
+    if state and state[0] == new_hash:
+        # identical to the last batch: nothing to compare or write
+        cur.execute('UPDATE market_state SET checked_at=? WHERE market_id=?', (now, market_id))
         conn.commit()
+        return 0, 0, 0, len(by_key)
+
+    # on a compact DB match dates on the clustered (day, tod), date_scraped is computed in the view
+    date_cols = compact_schema.date_columns(conn)
+    date_where = ' AND '.join(f'{c}=?' for c in date_cols)
+    stored = {}
+    for scraped_date in {k[1] for k in by_key}:
+        cur.execute(f'SELECT product, category, price_min, price_max, unit FROM prices WHERE market_id=? AND {date_where}',
+                    (market_id, *compact_schema.date_values(date_cols, scraped_date)))
+        for prod, cat, pmin, pmax, unit in cur.fetchall():
+            stored[(prod, scraped_date)] = row_hash(cat, pmin, pmax, unit)
+
+    inserts, updates = [], []
+    for key, r in by_key.items():
+        old = stored.get(key)
+        if old is None:
+            inserts.append(r)
+        elif old != row_hash(r[3], r[4], r[5], r[6]):
+            updates.append(r)
+    if inserts:
+        # canonical product id resolved at ingest (cached per process, see product_catalog.py)
+        cur.executemany(PRICE_INSERT_SQL, [r + (product_catalog.resolve(conn, r[2]),) for r in inserts])
+    if updates:
+        cur.executemany(PRICE_UPDATE_SQL.replace('date_scraped = ?', date_where),
+                        [(r[1], r[3], r[4], r[5], r[6], r[8], r[9], r[0], r[2], *compact_schema.date_values(date_cols, r[7]))
+                         for r in updates])
+    # products that disappeared from the batch; after a partial scrape (e.g. one İzmir page
+    # failed, a sebze-only batch is still half of the stored rows) they are kept
+    deletes = [k for k in stored if k not in by_key]
+    if deletes and complete is False:
+        print(f"{market_id}: scraper reported missing pages, not removing {len(deletes)} rows")
+        deletes = []
+    elif deletes and complete is None and len(by_key) < len(stored) * MIN_BATCH_RATIO:
+        print(f"{market_id}: batch has {len(by_key)} of {len(stored)} stored rows, not removing {len(deletes)} rows")
+        deletes = []
+    if deletes:
+        cur.executemany(f'DELETE FROM prices WHERE market_id=? AND product=? AND {date_where}',
+                        [(market_id, p, *compact_schema.date_values(date_cols, d)) for p, d in deletes])
+    # intraday history: append-only events for products whose min/max actually moved
+    price_history.record_events(conn, market_id, [(r[2], r[4], r[5]) for r in inserts + updates], now)
+
+    version = state[1] if state else 0
+    changed_at = None
+    if inserts or updates or deletes:
+        # the per-market version is the global data version of its last change (see change_log.py)
+        change_log.log_changes(conn, market_id, [(r[2], r[7]) for r in inserts + updates], change_log.OP_UPSERT, now)
+        version = change_log.log_changes(conn, market_id, deletes, change_log.OP_DELETE, now)
+        changed_at = now
+    cur.execute('''
+        INSERT INTO market_state (market_id, batch_hash, version, changed_at, checked_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(market_id) DO UPDATE SET
+            batch_hash = excluded.batch_hash,
+            version = excluded.version,
+            changed_at = COALESCE(excluded.changed_at, market_state.changed_at),
+            checked_at = excluded.checked_at
+    ''', (market_id, new_hash, version, changed_at, now))
+    conn.commit()
+    return len(inserts), len(updates), len(deletes), len(by_key) - len(inserts) - len(updates)
+
+
+def ingest_excel(conn, market_id, excel_path: Path, complete=None):
+    """Read one scraper output and apply it to the DB. Returns (ok, info)."""
+    if not excel_path.exists():
+        print(f"Output missing for {market_id}: {excel_path}")
+        return False, 'no output'
+    df = read_excel_safe(excel_path)
+    if df is None:
+        return False, 'read error'
+    df = normalize_df(df)
+    scraped_date = datetime.now().strftime('%Y-%m-%d')
+    rows = df_to_rows(df, market_id, scraped_date, str(excel_path.name))
+    if not rows:
+        return False, 'no rows'
+    inserted, updated, deleted, unchanged = apply_changes(conn, market_id, rows, complete)
+    if inserted or updated or deleted:
+        rollups.update_rollups(conn, market_id, [scraped_date])
+    if inserted or deleted:
+        product_search.sync_market(conn, market_id)
+    conn.commit()
+    print(f"{market_id}: {inserted} inserted, {updated} updated, {deleted} deleted, {unchanged} unchanged")
+    return True, {'rows': len(rows), 'inserted': inserted, 'updated': updated, 'deleted': deleted}
+
+
+# serializes DB writes when markets are refreshed from several threads (adaptive scheduler)
+_ingest_lock = threading.Lock()
+
+
+def run_script_timed(script_path: Path):
+    print(f"Running {script_path.name} --once")
+    started = time.perf_counter()
+    rc, out = run_script_once(script_path)
+    print(out)
+    return out, time.perf_counter() - started
+
+
+def ingest_timed(conn, market_id, excel_path: Path, out, script_s):
+    """ingest_excel() and store the run with the scraper's stage timings plus script and db_write."""
+    stages = metrics.parse_stage_timings(out)
+    if script_s is not None:
+        stages['script'] = script_s
+    started = time.perf_counter()
+    ok, info = ingest_excel(conn, market_id, excel_path, metrics.parse_complete(out))
+    stages['db_write'] = time.perf_counter() - started
+    metrics.record_run(conn, market_id, stages, ok, info)
+    print(f"{market_id} timings: " + ', '.join(f"{k}={v:.3f}s" for k, v in stages.items()))
+    return ok, info
+
+
+def lease_skipped(market_id):
+    info = f"skipped, leased by {leases.current_owner(leases.market_lease(market_id))}"
+    print(f"[{datetime.now()}] {market_id}: {info}")
+    return info
+
+
+def refresh_market(market_id):
+    """Run one market's scraper and ingest its Excel output under the market's lease. Returns the ingest info."""
+    script_path = next(s[0] for s in SCRIPTS if s[2] == market_id)
+    with leases.held(leases.market_lease(market_id)) as lease:
+        if lease is None:
+            return lease_skipped(market_id)
+        out, script_s = run_script_timed(script_path)
+        # taken over while the scraper ran (we looked dead); the new holder ingests
+        if lease.lost:
+            return lease_skipped(market_id)
+        return ingest_market(market_id, out, script_s)
+
+
+def ingest_market(market_id, out='', script_s=None):
+    """Ingest one market's current Excel output (after its scraper ran, or when the watcher saw it published)."""
+    excel_name = next(s[1] for s in SCRIPTS if s[2] == market_id)
+    with _ingest_lock:
+        ensure_db()
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            ok, info = ingest_timed(conn, market_id, BASE / excel_name, out, script_s)
+            product_catalog.assign_missing_ids(conn)
+            change_log.prune(conn)
+            metrics.prune(conn)
+            conn.commit()
+            publish_static(conn)
+        finally:
+            conn.close()
+    print(f"[{datetime.now()}] {market_id}: {info}")
+    return info
 
 
 def refresh_from_scripts():
@@ -129,50 +407,96 @@ def refresh_from_scripts():
     conn = sqlite3.connect(DB_PATH)
     summary = []
     for script_path, excel_name, market_id in SCRIPTS:
-        print(f"Running {script_path.name} --once")
-        rc, out = run_script_once(script_path)
-        print(out)
-        excel_path = BASE / excel_name
-        if not excel_path.exists():
-            print(f"Output missing for {script_path.name}: {excel_path}")
-            summary.append((script_path.name, False, 'no output'))
-            continue
-        df = read_excel_safe(excel_path)
-        if df is None:
-            summary.append((script_path.name, False, 'read error'))
-            continue
-        df = normalize_df(df)
-        rows = []
-        scraped_date = datetime.now().strftime('%Y-%m-%d')
-        market_name = market_id.replace('_', ' ').title()
-        for _, r in df.iterrows():
-            def to_float(v):
-                if v is None: return None
-                s = str(v).replace('₺','').replace(',','.')
-                try:
-                    return float(s)
-                except:
-                    return None
-            pmin = to_float(r.get('En Düşük Fiyat (TL)'))
-            pmax = to_float(r.get('En Yüksek Fiyat (TL)'))
-            unit = r.get('Birim') if pd.notna(r.get('Birim')) else None
-            prod = r.get('Ürün Adı')
-            cat = r.get('Kategori') if pd.notna(r.get('Kategori')) else None
-            rows.append((market_id, market_name, prod, cat, pmin, pmax, unit, scraped_date, str(excel_path.name), int(time.time())))
-        if rows:
-            upsert_rows(conn, rows)
-            print(f"Upserted {len(rows)} rows for {market_id}")
-            summary.append((script_path.name, True, len(rows)))
-        else:
-            summary.append((script_path.name, False, 'no rows'))
+        with leases.held(leases.market_lease(market_id)) as lease:
+            if lease is None:
+                summary.append((script_path.name, False, lease_skipped(market_id)))
+                continue
+            out, script_s = run_script_timed(script_path)
+            if lease.lost:
+                summary.append((script_path.name, False, lease_skipped(market_id)))
+                continue
+            ok, info = ingest_timed(conn, market_id, BASE / excel_name, out, script_s)
+        summary.append((script_path.name, ok, info))
+    product_catalog.assign_missing_ids(conn)
+    change_log.prune(conn)
+    metrics.prune(conn)
+    conn.commit()
+    publish_static(conn)
     conn.close()
     print(f"[{datetime.now()}] Refresh finished. Summary: {summary}")
     return summary
 
 
-def backup_now():
+def publish_static(conn):
+    # after the last commit: the manifest records the DB mtime and is only served while it matches
+    try:
+        manifest = static_publish.publish(conn, DB_PATH)
+        print(f"Published {len(manifest['docs'])} static JSON documents (version {manifest['version']})")
+    except (sqlite3.Error, OSError) as e:
+        print(f"Static publish failed: {e}")
+
+
+def snapshot_now():
+    try:
+        path, pages, seconds = snapshot.snapshot(DB_PATH)
+        print(f"DB snapshot {path} ({pages} pages) in {seconds:.1f}s, integrity ok")
+    except (sqlite3.Error, OSError, RuntimeError) as e:
+        print(f"DB snapshot failed: {e}")
+
+
+def maintenance(convert_vacuum=False):
+    ensure_db()
+    # the adaptive scheduler ingests from worker threads; keep its writes out of the batches
+    with _ingest_lock:
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            if convert_vacuum:
+                retention.enable_incremental_vacuum(conn)
+            started = time.perf_counter()
+            summary = retention.run(conn)
+            print(f"[{datetime.now()}] Maintenance finished in {time.perf_counter() - started:.1f}s: {summary}")
+            publish_static(conn)
+        except sqlite3.Error as e:
+            print(f"Maintenance failed: {e}")
+        finally:
+            conn.close()
+
+
+def migrate_compact():
+    ensure_db()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if compact_schema.is_compact(conn):
+            print("DB already uses the compact layout")
+            return
+        path, pages, seconds = snapshot.snapshot(DB_PATH)
+        print(f"DB snapshot {path} ({pages} pages) in {seconds:.1f}s, integrity ok")
+        size_before = DB_PATH.stat().st_size
+        result = compact_schema.migrate(conn)
+        conn.execute('VACUUM')
+        print(f"Migrated {result['migrated']} of {result['rows']} rows ({result['duplicates']} duplicates dropped), "
+              f"{size_before // 1024} KB -> {DB_PATH.stat().st_size // 1024} KB")
+    finally:
+        conn.close()
+
+
+def backup_now(excel=BACKUP_EXCEL):
     ensure_db()
+    snapshot_now()
     conn = sqlite3.connect(DB_PATH)
+    if archive.available():
+        written = archive.archive(conn)
+        print(f"Archived {len(written)} market/day partitions ({sum(w[2] for w in written)} rows) -> {archive.ARCHIVE_DIR}")
+    else:
+        print("pyarrow not installed, falling back to the Excel export")
+        excel = True
+    if excel:
+        export_excel(conn)
+    conn.close()
+
+
+def export_excel(conn):
+    # optional per-market Excel export of the latest date (the old backup format)
     cur = conn.cursor()
     today = datetime.now().strftime('%Y-%m-%d')
     target_folder = BACKUP_DIR / today
@@ -195,7 +519,6 @@ def backup_now():
             print(f"Backed up {market_id} -> {out_path}")
         except Exception as e:
             print(f"Failed to write backup for {market_id}: {e}")
-    conn.close()
 
 
 def main_loop():
@@ -203,18 +526,75 @@ def main_loop():
     schedule.every(REFRESH_INTERVAL_MIN).minutes.do(refresh_from_scripts)
     # schedule daily backup at 16:00
     schedule.every().day.at("16:00").do(backup_now)
-    print(f"Scheduler started. Refresh every {REFRESH_INTERVAL_MIN} minutes, backup daily at 04:00. DB: {DB_PATH}")
+    schedule.every().day.at(MAINTENANCE_AT).do(maintenance)
+    print(f"Scheduler started. Refresh every {REFRESH_INTERVAL_MIN} minutes, backup daily at 16:00. DB: {DB_PATH}")
     # run an initial refresh
     refresh_from_scripts()
     while True:
         schedule.run_pending()
         time.sleep(10)
 
+
+def adaptive_loop():
+    # per-market polling driven by learned publish windows instead of a fixed interval
+    schedule.every().day.at("16:00").do(backup_now)
+    schedule.every().day.at(MAINTENANCE_AT).do(maintenance)
+    print(f"Adaptive scheduler started, backup daily at 16:00. DB: {DB_PATH}")
+    adaptive_scheduler.run([m for _, _, m in SCRIPTS], refresh_market,
+                           lambda: sqlite3.connect(DB_PATH), on_tick=schedule.run_pending)
+
+
+def watch_loop():
+    # ingest each scraper's output as soon as it is published; the scrapers run on their own schedule
+    schedule.every().day.at("16:00").do(backup_now)
+    schedule.every().day.at(MAINTENANCE_AT).do(maintenance)
+    watcher = ingest_watcher.Watcher({BASE / excel_name: market_id for _, excel_name, market_id in SCRIPTS},
+                                     ingest_market)
+    print(f"Ingest watcher started, backup daily at 16:00. DB: {DB_PATH}")
+    # pick up whatever was published while we were not running
+    for _, _, market_id in SCRIPTS:
+        ingest_market(market_id)
+    watcher.run(on_tick=schedule.run_pending)
+
+
 if __name__ == '__main__':
     if '--once' in sys.argv:
         refresh_from_scripts()
         sys.exit(0)
     if '--backup-now' in sys.argv:
-        backup_now()
+        backup_now(excel=BACKUP_EXCEL or '--excel' in sys.argv)
+        sys.exit(0)
+    if '--adaptive' in sys.argv:
+        ensure_db()
+        adaptive_loop()
+    if '--watch' in sys.argv:
+        ensure_db()
+        watch_loop()
+    if '--snapshot-now' in sys.argv:
+        snapshot_now()
+        sys.exit(0)
+    if '--publish-now' in sys.argv:
+        ensure_db()
+        conn = sqlite3.connect(DB_PATH)
+        publish_static(conn)
+        conn.close()
+        sys.exit(0)
+    if '--rebuild-rollups' in sys.argv:
+        ensure_db()
+        conn = sqlite3.connect(DB_PATH)
+        print(f"Rebuilt rollups for {rollups.rebuild(conn)} market/day pairs")
+        conn.close()
+        sys.exit(0)
+    if '--rebuild-search' in sys.argv:
+        ensure_db()
+        conn = sqlite3.connect(DB_PATH)
+        print(f"Rebuilt search index for {product_search.rebuild(conn)} markets")
+        conn.close()
+        sys.exit(0)
+    if '--maintenance' in sys.argv:
+        maintenance(convert_vacuum='--convert-vacuum' in sys.argv)
+        sys.exit(0)
+    if '--migrate-compact' in sys.argv:
+        migrate_compact()
         sys.exit(0)
     main_loop()
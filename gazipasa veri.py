@@ -19,6 +19,9 @@ import logging
 from logging.handlers import RotatingFileHandler
 from contextlib import ExitStack
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import leases
+import lkg_store
+import metrics
 
 # SSL/TLS sertifika uyarılarını (InsecureRequestWarning) kapat
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -35,20 +38,25 @@ logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 logger.addHandler(log_handler)
 
-# --- Cache Yönetimi ---
-def cache_son_veri(df, cache_file="son_basarili_veri.pkl"):
-    """Son başarılı veriyi pickle olarak sakla"""
+# --- Cache Yönetimi (lkg_store: data/lkg/gazipasa_market.arrow, pickle yerine) ---
+MARKET_ID = 'gazipasa_market'
+
+def cache_son_veri(df):
+    """Son başarılı veriyi ortak last-known-good deposuna (Arrow IPC) kaydet"""
     try:
-        df.to_pickle(cache_file)
-        logger.info("Son başarılı veri cache'lendi")
+        if lkg_store.save(MARKET_ID, df) is not None:
+            logger.info("Son başarılı veri cache'lendi")
     except Exception as e:
         logger.error(f"Cache kaydetme hatası: {e}")
 
-def son_cache_getir(cache_file="son_basarili_veri.pkl"):
+def son_cache_getir():
     """Son başarılı veriyi getir"""
     try:
-        if os.path.exists(cache_file):
-            return pd.read_pickle(cache_file)
+        sonuc = lkg_store.load(MARKET_ID)
+        if sonuc is not None:
+            df, kayit_zamani = sonuc
+            logger.info(f"Cache kaydı: {datetime.fromtimestamp(kayit_zamani).strftime('%Y-%m-%d %H:%M:%S')}")
+            return df
     except Exception as e:
         logger.error(f"Cache okuma hatası: {e}")
     return None
@@ -236,6 +244,8 @@ ssl._create_default_https_context = ssl._create_unverified_context
 URL_LISTING = "https://gazipasa.bel.tr/gunluk-hal-fiyatlari" 
 BASE_DOMAIN = "https://gazipasa.bel.tr" 
 EXCEL_DOSYASI = "gazipasa_hal_fiyatlari.xlsx"
+# Önce buraya yazılır, sonra os.replace ile tek adımda yayınlanır (db_updater yarım dosya okumasın)
+EXCEL_GECICI = ".gazipasa_hal_fiyatlari.tmp.xlsx"
 YEDekLER_KLASORU = "yedekler"
 
 is_running_lock = threading.Lock()
@@ -303,6 +313,11 @@ def verileri_cek_ve_kaydet():
             logger.warning("Önceki görev tamamlanmadı; bu döngü atlandı")
             return
         stack.callback(is_running_lock.release) # Görev bitince kilidi aç
+        # Başka süreç/sunucudaki güncelleyicilerle ortak kiralama (leases.py); db_updater'dan çalışınca onunkine girilir
+        if stack.enter_context(leases.held(leases.market_lease(MARKET_ID))) is None:
+            logger.warning("Pazar başka bir güncelleyicide işleniyor (kiralama); bu döngü atlandı")
+            return
+        zamanlayici = metrics.StageTimer() # Aşama süreleri (STAGE_TIMINGS satırı, db_updater okur)
         
         try:
             logger.info("Görev başladı, veriler çekiliyor...")
@@ -332,6 +347,7 @@ def verileri_cek_ve_kaydet():
                 
             # 2. Veriyi çek (retry mekanizması ile)
             response = fetch_data_with_retry(session, data_url)
+            zamanlayici.mark('fetch')
             # header=0 -> Log'lara göre bu, 'TOPTANCI HAL...' [kaynak: 3] başlığını bulan doğru parametre
             tablolar = pd.read_html(response.content, header=0)
             logger.info(f"{len(tablolar)} tablo bulundu")
@@ -371,6 +387,7 @@ def verileri_cek_ve_kaydet():
                 raise ValueError("Sütun eşleştirme başarısız")
             
             df_renamed = df_clean.rename(columns=rename_map)
+            zamanlayici.mark('parse')
             
             # !!!!!!!!! YENİ ADIM: "Grup" Sütununu Oluşturma (İsteğiniz) !!!!!!!!!
             
@@ -398,6 +415,7 @@ def verileri_cek_ve_kaydet():
 
             df_renamed['Grup'] = groups
             logger.info("Grup sütunu oluşturuldu.")
+            zamanlayici.mark('group')
 
             # 5. Tabloyu standartlaştır (Artık YENİDEN ADLANDIRILMIŞ tabloyu kullanır)
             fiyat_df = standardize_table(df_renamed) 
@@ -427,17 +445,22 @@ def verileri_cek_ve_kaydet():
             # 7. Kategorizasyon uygula
             fiyat_df['Kategori'] = fiyat_df['Ürün Adı'].apply(lambda urun: kategori_belirle(urun, kategori_df))
             fiyat_df = fiyat_df[STANDARD_COLS_ORDER] # Yeni sıralamayı uygula
+            zamanlayici.mark('categorize')
             
             logger.info(f"'Dernek' tablosu başarıyla işlendi. {len(fiyat_df)} temiz ürün bulundu.")
             
             # 7. Excel'e kaydet ve cache'le
-            with pd.ExcelWriter(EXCEL_DOSYASI, engine='openpyxl') as writer:
+            with pd.ExcelWriter(EXCEL_GECICI, engine='openpyxl') as writer:
                 fiyat_df.to_excel(writer, sheet_name='Hal_Fiyatlari', index=False)
                 workbook = writer.book
                 apply_styling_to_sheet(workbook['Hal_Fiyatlari'])
+            os.replace(EXCEL_GECICI, EXCEL_DOSYASI)
+            zamanlayici.mark('excel')
                 
             # Son başarılı veriyi cache'le
             cache_son_veri(fiyat_df)
+            zamanlayici.mark('lkg')
+            metrics.emit_stage_timings(MARKET_ID, zamanlayici.stages, rows=len(fiyat_df), complete=True)
             logger.info(f"Veriler başarıyla '{EXCEL_DOSYASI}' dosyasına kaydedildi")
             print(f"--- BİLGİ: [Gazipaşa] Kategorizasyon sonrası verilerin ilk 5 satırı:") # Konsola da basalım
             print(fiyat_df.head())
@@ -445,6 +468,7 @@ def verileri_cek_ve_kaydet():
             
         except Exception as e:
             logger.error(f"Ana işlem sırasında beklenmedik bir hata oluştu: {e}")
+            metrics.emit_stage_timings(MARKET_ID, zamanlayici.stages, error=str(e))
             if "No tables found" in str(e):
                 logger.info("Sitede 'No tables found' hatası alındı. Muhtemelen site güncelleniyor.")
             
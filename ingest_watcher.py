@@ -0,0 +1,99 @@
+"""
+Ingest Watcher
+- Reacts to the scrapers publishing their Excel output instead of rescanning on a timer: the market whose
+  file changed is ingested right away, the others are left alone
+- Linux with `inotify_simple` installed: one inotify watch on each output directory for IN_MOVED_TO
+  (temp file renamed over the output, how the scrapers publish) and IN_CLOSE_WRITE (writers that
+  still write in place); otherwise the files are polled with stat() every POLL_INTERVAL_S
+- A file is only handed over once its (mtime, size) stayed the same for SETTLE_S, so a writer that does not
+  rename is not read half-written; bursts of events for one file collapse into one ingest
+- Temp files (scrapers write `.<name>.tmp.xlsx`) are never reported
+- Standard library only apart from the optional inotify binding
+"""
+import os
+import time
+from pathlib import Path
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+POLL_INTERVAL_S = 2.0
+SETTLE_S = 1.0
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+class Watcher:
+    """Calls on_change(market_id) when the output file of a market was published."""
+
+    def __init__(self, outputs, on_change, use_inotify=None):
+        # outputs: {Path of the published file: market_id}
+        self.outputs = {Path(p).resolve(): m for p, m in outputs.items()}
+        self.on_change = on_change
+        self.use_inotify = INotify is not None if use_inotify is None else use_inotify
+        self._seen = {p: _stat(p) for p in self.outputs}
+        # path -> (stat, first time that stat was seen) while waiting for the file to settle
+        self._pending = {}
+        self._inotify = None
+        self._wd_dirs = {}
+        if self.use_inotify:
+            self._inotify = INotify()
+            for directory in {p.parent for p in self.outputs}:
+                wd = self._inotify.add_watch(directory, flags.MOVED_TO | flags.CLOSE_WRITE)
+                self._wd_dirs[wd] = directory
+
+    @property
+    def mode(self):
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    def _events(self, timeout_s):
+        """Output paths touched within timeout_s (inotify) or all outputs (polling)."""
+        if self._inotify is None:
+            time.sleep(timeout_s)
+            return set(self.outputs)
+        touched = set()
+        for event in self._inotify.read(timeout=int(timeout_s * 1000)):
+            path = self._wd_dirs.get(event.wd, Path('.')) / event.name
+            if path in self.outputs:
+                touched.add(path)
+        return touched
+
+    def step(self, timeout_s=POLL_INTERVAL_S):
+        """Wait for events once, hand over settled files. Returns the markets handed over."""
+        for path in self._events(timeout_s if not self._pending else min(timeout_s, SETTLE_S)):
+            st = _stat(path)
+            if st is not None and st != self._seen.get(path) and self._pending.get(path, (None,))[0] != st:
+                self._pending[path] = (st, time.monotonic())
+        now = time.monotonic()
+        changed = []
+        for path, (st, since) in list(self._pending.items()):
+            current = _stat(path)
+            if current != st:
+                # still being written; start the settle time again
+                if current is None:
+                    del self._pending[path]
+                else:
+                    self._pending[path] = (current, now)
+                continue
+            if now - since >= SETTLE_S:
+                del self._pending[path]
+                self._seen[path] = st
+                changed.append(self.outputs[path])
+        for market_id in changed:
+            self.on_change(market_id)
+        return changed
+
+    def run(self, on_tick=None):
+        print(f"Watching {len(self.outputs)} scraper outputs ({self.mode})")
+        while True:
+            self.step()
+            if on_tick is not None:
+                on_tick()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+İzmir Historical Backfill
+- Walks a date range of the İzmir `?date=` pages with bounded concurrency (async_fetcher)
+- Skips dates that already have İzmir rows in `prices`
+- Bulk-inserts parsed rows straight into `prices` (no Excel in between)
+- Stores a checkpoint in the DB after every chunk, so an interrupted run resumes where it stopped; the
+  checkpoint never moves past a day whose pages failed to download, so a resumed run retries it
+- Products listed on both the sebze and meyve page of a day are inserted once (last page wins)
+
+Usage:
+- Backfill a range: python izmir_backfill.py 2023-01-01 2025-01-01
+- Chunk size (days fetched concurrently): python izmir_backfill.py 2023-01-01 2025-01-01 --days-per-chunk 14
+- Ignore the stored checkpoint: python izmir_backfill.py 2023-01-01 2025-01-01 --no-resume
+"""
+import argparse
+import importlib.util
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import db_updater
+import product_catalog
+import product_search
+import rollups
+from async_fetcher import IZMIR_TIPLER, date_range, fetch_all_sync, izmir_urls
+
+MARKET_ID = 'izmir_market'
+SOURCE_FILE = 'izmir_backfill'
+IZMIR_SCRIPT = db_updater.BASE / 'veri çekme izmir.py'
+DAYS_PER_CHUNK = 7
+
+CHECKPOINT_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    market_id TEXT PRIMARY KEY,
+    last_date TEXT,
+    updated_at INTEGER
+);
+'''
+
+
+
+def load_izmir_module():
+    # same loading approach as run_three_loader (file name contains spaces)
+    spec = importlib.util.spec_from_file_location('veri_cekme_izmir', str(IZMIR_SCRIPT))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_checkpoint(conn):
+    row = conn.execute('SELECT last_date FROM backfill_checkpoints WHERE market_id=?', (MARKET_ID,)).fetchone()
+    return row[0] if row else None
+
+
+def set_checkpoint(conn, last_date):
+    conn.execute('''
+        INSERT INTO backfill_checkpoints (market_id, last_date, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(market_id) DO UPDATE SET last_date=excluded.last_date, updated_at=excluded.updated_at
+    ''', (MARKET_ID, last_date, int(time.time())))
+
+
+def loaded_dates(conn):
+    cur = conn.execute('SELECT DISTINCT substr(date_scraped, 1, 10) FROM prices WHERE market_id=?', (MARKET_ID,))
+    return {r[0] for r in cur.fetchall()}
+
+
+def fetched(day, results):
+    """True if every page of the day was downloaded (a day without a table is still complete)."""
+    return all(results.get((day, url_type)) is not None and results[(day, url_type)].text is not None
+               for url_type in IZMIR_TIPLER.values())
+
+
+def parse_day(izmir, day, results):
+    """Combine the sebze and meyve pages of one day into `prices` rows."""
+    dfs = []
+    for url_type in IZMIR_TIPLER.values():
+        res = results.get((day, url_type))
+        if res is None or res.text is None:
+            continue
+        df = izmir.izmir_tablosunu_esle(res.text, url_type)
+        if df is not None:
+            dfs.append(df)
+    if not dfs:
+        return []
+    df = pd.concat(dfs, ignore_index=True)
+    df['Kategori'] = df['Ürün Adı'].apply(lambda urun: izmir.kategori_belirle(urun, izmir.kategori_df))
+    rows = db_updater.df_to_rows(df[db_updater.EXPECTED_COLS], MARKET_ID, day, SOURCE_FILE)
+    # one row per (product, date) as in apply_changes(), the UNIQUE constraint would reject the second
+    return list({(r[2], r[7]): r for r in rows if r[2] is not None and not pd.isna(r[2])}.values())
+
+
+def backfill(start, end, days_per_chunk=DAYS_PER_CHUNK, resume=True):
+    db_updater.ensure_db()
+    conn = sqlite3.connect(db_updater.DB_PATH)
+    conn.execute(CHECKPOINT_TABLE_SQL)
+    conn.commit()
+
+    checkpoint = get_checkpoint(conn) if resume else None
+    # only resume inside the requested range; older ranges are still filtered by loaded_dates()
+    if checkpoint and start <= checkpoint < end:
+        start = (datetime.strptime(checkpoint, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        print(f"Resuming after checkpoint {checkpoint}")
+    done = loaded_dates(conn)
+    days = [d.strftime('%Y-%m-%d') for d in date_range(start, end)]
+    todo = [d for d in days if d not in done]
+    print(f"Backfill {start} -> {end}: {len(days)} days, {len(days) - len(todo)} already loaded, {len(todo)} to fetch")
+
+    izmir = load_izmir_module()
+    total = 0
+    failed = []
+    for i in range(0, len(todo), days_per_chunk):
+        chunk = todo[i:i + days_per_chunk]
+        started = time.monotonic()
+        results = fetch_all_sync(izmir_urls(chunk))
+        rows = []
+        for day in chunk:
+            if not fetched(day, results):
+                # retried by the next run: not loaded, and the checkpoint stays before it
+                failed.append(day)
+                continue
+            rows.extend(parse_day(izmir, day, results))
+        # rows and checkpoint are committed together, so a crash never leaves a half-loaded chunk
+        with conn:
+            if rows:
+                conn.executemany(db_updater.PRICE_INSERT_SQL, [r + (product_catalog.resolve(conn, r[2]),) for r in rows])
+                rollups.update_rollups(conn, MARKET_ID, {r[7] for r in rows})
+            if not failed:
+                set_checkpoint(conn, chunk[-1])
+        total += len(rows)
+        print(f"{chunk[0]} -> {chunk[-1]}: {len(rows)} rows in {time.monotonic() - started:.1f}s")
+    with conn:
+        if failed:
+            # up to the day before the first failure; later days that did load are skipped by loaded_dates()
+            set_checkpoint(conn, (datetime.strptime(failed[0], '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d'))
+        else:
+            # also move the checkpoint over trailing days that were already loaded
+            set_checkpoint(conn, end)
+        product_search.sync_market(conn, MARKET_ID)
+    conn.close()
+    if failed:
+        print(f"Could not download {len(failed)} days, run again to retry: {', '.join(failed[:10])}{' ...' if len(failed) > 10 else ''}")
+    print(f"Backfill finished. {total} rows inserted.")
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill İzmir hal prices into the DB')
+    parser.add_argument('start', help='first date (YYYY-MM-DD)')
+    parser.add_argument('end', nargs='?', default=datetime.now().strftime('%Y-%m-%d'), help='last date (YYYY-MM-DD), default today')
+    parser.add_argument('--days-per-chunk', type=int, default=DAYS_PER_CHUNK)
+    parser.add_argument('--no-resume', action='store_true')
+    args = parser.parse_args()
+    backfill(args.start, args.end, args.days_per_chunk, resume=not args.no_resume)
@@ -9,7 +9,12 @@ import os
 import sys
 import shutil
 import threading
-import urllib.error
+from contextlib import ExitStack
+from io import StringIO
+from async_fetcher import fetch_all_sync, MARKET_URLS
+import leases
+import lkg_store
+import metrics
 
 # --- Kaynak Yolu (EXE için) ---
 def kaynak_yolu(relative_path):
@@ -65,8 +70,10 @@ def kategori_belirle(urun_adi, kurallar_df):
 
 # --- Global Ayarlar (Değişiklik yok) ---
 ssl._create_default_https_context = ssl._create_unverified_context
-URL = "https://www.batiakdeniztv.com/kumluca-hal-fiyatlari/"
+URL = MARKET_URLS['kumluca_market']
 EXCEL_DOSYASI = "kumluca_hal_fiyatlari.xlsx"
+# Önce buraya yazılır, sonra os.replace ile tek adımda yayınlanır (db_updater yarım dosya okumasın)
+EXCEL_GECICI = ".kumluca_hal_fiyatlari.tmp.xlsx"
 YEDekLER_KLASORU = "yedekler"
 
 is_running_lock = threading.Lock()
@@ -113,6 +120,28 @@ def excel_stillerini_uygula(dosya_yolu):
     except Exception as e:
         print(f"!!! HATA: [Kumluca] Excel stilleri uygulanırken bir hata oluştu: {e}")
 
+# --- Son Başarılı Veri (lkg_store: data/lkg/kumluca_market.arrow) ---
+MARKET_ID = 'kumluca_market'
+
+def son_iyi_veriyi_kaydet(df):
+    """ Başarılı çekimi ortak last-known-good deposuna kaydeder; API site çöktüğünde bunu sunar. """
+    try:
+        if lkg_store.save(MARKET_ID, df) is not None:
+            print(f"--- BİLGİ: [Kumluca] Son başarılı veri kaydedildi ({len(df)} satır).")
+    except Exception as e:
+        print(f"--- UYARI: [Kumluca] Son başarılı veri kaydedilemedi: {e}")
+
+def son_iyi_veri_bilgisi():
+    """ Çekim başarısız olduğunda elde kalan son başarılı verinin yaşını yazar. """
+    try:
+        bilgi = lkg_store.info(MARKET_ID)
+    except Exception as e:
+        bilgi = None
+        print(f"--- UYARI: [Kumluca] Son başarılı veri okunamadı: {e}")
+    if bilgi and bilgi['saved_at']:
+        zaman = datetime.fromtimestamp(bilgi['saved_at']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"--- BİLGİ: [Kumluca] API son başarılı veriyi ({zaman}, {bilgi['rows']} satır) sunmaya devam edecek.")
+
 # --- Ana İşlem (Kumluca'ya özel "header=0" mantığı) ---
 def verileri_cek_ve_kaydet():
     if kategori_df is None:
@@ -122,35 +151,41 @@ def verileri_cek_ve_kaydet():
     if not is_running_lock.acquire(blocking=False):
         print("Önceki görev tamamlanmadı; bu döngü atlandı.")
         return
-        
+
+    # Başka süreç/sunucudaki güncelleyicilerle ortak kiralama (leases.py); db_updater'dan çalışınca onunkine girilir
+    with ExitStack() as kiralama:
+        kiralama.callback(is_running_lock.release) # Kiralama alınamazsa ya da hata verirse de kilit açılır
+        if kiralama.enter_context(leases.held(leases.market_lease(MARKET_ID))) is None:
+            print("--- BİLGİ: [Kumluca] Pazar başka bir güncelleyicide işleniyor (kiralama); bu döngü atlandı.")
+            return
+        kiralama = kiralama.pop_all() # Kiralama ve kilit aşağıdaki finally'de bırakılır
+
+    zamanlayici = metrics.StageTimer() # Aşama süreleri (STAGE_TIMINGS satırı, db_updater okur)
+    tum_tablolar = False # Yazılan Excel'de tüm tablolar var mı (db_updater eksik ürünleri ancak o zaman siler)
+    atlanan_tablo = False
     try:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [Kumluca] Görev başladı. Veriler çekiliyor...")
         
         STANDARD_COLS_ORDER = ['Ürün Adı', 'Kategori', 'En Düşük Fiyat (TL)', 'En Yüksek Fiyat (TL)', 'Birim']
         
-        # --- YENİDEN DENEME BLOĞU ---
+        # --- YENİDEN DENEME BLOĞU (async_fetcher: bloklamayan exponential backoff) ---
         tablolar = None
-        max_retries = 3
-        for attempt in range(1, max_retries + 1):
+        print(f"--- BİLGİ: [Kumluca] Veri çekiliyor: {URL}")
+        sonuc = fetch_all_sync({'kumluca_market': URL})['kumluca_market']
+        zamanlayici.mark('fetch')
+        if sonuc.text is None:
+            print(f"--- UYARI: [Kumluca] AĞ HATASI ({sonuc.attempts} deneme): {sonuc.error}")
+        else:
             try:
-                print(f"--- BİLGİ: [Kumluca] Veri çekiliyor (Deneme {attempt}/{max_retries}): {URL}")
                 # header=0 -> Tespit script'inde veriyi gören doğru parametre buydu.
-                tablolar = pd.read_html(URL, header=0) 
-                print(f"--- BİLGİ: [Kumluca] Veri (Deneme {attempt}/{max_retries}) BAŞARILI. {len(tablolar)} tablo bulundu.")
-                break 
-            except (urllib.error.URLError, ssl.SSLError, ConnectionError, OSError) as e:
-                print(f"--- UYARI: [Kumluca] AĞ HATASI (Deneme {attempt}/{max_retries}): {e}")
-                if attempt < max_retries:
-                    print(f"    ... 3 saniye beklenip yeniden denenecek ...")
-                    time.sleep(3)
-                else:
-                    print(f"    ... {max_retries} deneme de başarısız oldu. Bu URL atlanıyor.")
+                tablolar = pd.read_html(StringIO(sonuc.text), header=0)
+                print(f"--- BİLGİ: [Kumluca] Veri (Deneme {sonuc.attempts}) BAŞARILI. {len(tablolar)} tablo bulundu.")
             except Exception as e:
                 print(f"--- UYARI: [Kumluca] VERİ HATASI (muhtemelen boş sayfa/veri yok): {e}")
-                break
         
         if not tablolar:
-            print(f"!!! HATA: [Kumluca] Veri çekme işlemi {max_retries} deneme sonunda başarısız oldu.")
+            print(f"!!! HATA: [Kumluca] Veri çekme işlemi {sonuc.attempts} deneme sonunda başarısız oldu.")
+            son_iyi_veri_bilgisi()
             return 
         # --- YENİDEN DENEME BLOĞU SONU ---
 
@@ -185,6 +220,7 @@ def verileri_cek_ve_kaydet():
                 all_data_rows.append(data_df)
             except Exception as e:
                 print(f"--- UYARI: [Kumluca] Bir alt-tablo işlenirken hata (atlandı): {e}")
+                atlanan_tablo = True
 
         # 3. Tüm parçaları (df_0 + diğerleri) birleştir
         toplam_df = pd.concat(all_data_rows, ignore_index=True)
@@ -202,18 +238,25 @@ def verileri_cek_ve_kaydet():
         fiyat_df['En Yüksek Fiyat (TL)'] = fiyat_df['En Yüksek Fiyat (TL)'].astype(str).str.replace('₺', '', regex=False).str.strip()
         
         # --- BİRLEŞTİRME BLOĞU SONU ---
+        zamanlayici.mark('parse')
 
         # Kategorizasyon (Akıllı fonksiyonu kullanır)
         fiyat_df['Kategori'] = fiyat_df['Ürün Adı'].apply(lambda urun: kategori_belirle(urun, kategori_df))
         
         # Sütunları sırala
         fiyat_df = fiyat_df[STANDARD_COLS_ORDER] 
+        zamanlayici.mark('categorize')
         
         print("--- BİLGİ: [Kumluca] Kategorizasyon sonrası verilerin ilk 5 satırı:")
         print(fiyat_df.head())
         
-        fiyat_df.to_excel(EXCEL_DOSYASI, index=False, engine='openpyxl')
-        excel_stillerini_uygula(EXCEL_DOSYASI)
+        fiyat_df.to_excel(EXCEL_GECICI, index=False, engine='openpyxl')
+        excel_stillerini_uygula(EXCEL_GECICI)
+        os.replace(EXCEL_GECICI, EXCEL_DOSYASI)
+        tum_tablolar = not atlanan_tablo
+        zamanlayici.mark('excel')
+        son_iyi_veriyi_kaydet(fiyat_df)
+        zamanlayici.mark('lkg')
         
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [Kumluca] Veriler başarıyla '{EXCEL_DOSYASI}' dosyasına kaydedildi.")
         print("-" * 50)
@@ -224,7 +267,8 @@ def verileri_cek_ve_kaydet():
              print("--- BİLGİ: Sitede 'No tables found' hatası alındı. Muhtemelen site güncelleniyor.")
         print("-" * 50)
     finally:
-        is_running_lock.release()
+        metrics.emit_stage_timings(MARKET_ID, zamanlayici.stages, complete=tum_tablolar)
+        kiralama.close() # Önce kiralama, sonra kilit
 
 # --- Yedekleme (Değişiklik yok) ---
 def gunluk_ogleden_sonra_3_yedek():
@@ -0,0 +1,164 @@
+"""
+Job Leases (one worker per market refresh, across processes and machines)
+- `leases` table in a small SQLite file of its own (data/leases.sqlite; HAL_LEASE_DB points every node at
+  the same shared file): one row per job name with the owner, a fencing token and an expiry time
+- acquire() takes a free or expired lease in a BEGIN IMMEDIATE transaction, so two workers can never both
+  win; the token goes up on every takeover, so a worker that was presumed dead can tell it lost the lease
+- The holder renews it (heartbeat) every TTL/3 from a background thread; a worker that crashes or hangs
+  stops renewing and its lease is taken over once it expires
+- Owner ids are "<host>:<pid>"; db_updater passes its owner to the scraper subprocess in HAL_LEASE_OWNER,
+  so the scraper re-enters the lease its parent holds instead of skipping the run
+- Standard library only, so the scrapers can import it
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+LEASE_DB = Path(os.environ.get('HAL_LEASE_DB') or Path(__file__).parent / 'data' / 'leases.sqlite')
+OWNER_ENV = 'HAL_LEASE_OWNER'
+# longer than a normal scraper run with retries would pause between heartbeats
+LEASE_TTL_S = 120
+BUSY_TIMEOUT_S = 10
+
+SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    token INTEGER NOT NULL,
+    acquired_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+def owner_id():
+    """This worker's owner id: the one inherited from the parent updater, else <host>:<pid>."""
+    return os.environ.get(OWNER_ENV) or f'{socket.gethostname()}:{os.getpid()}'
+
+
+def market_lease(market_id):
+    return f'market:{market_id}'
+
+
+def connect(db=None):
+    db = Path(db or LEASE_DB)
+    db.parent.mkdir(parents=True, exist_ok=True)
+    # autocommit; every write below opens its own short transaction
+    conn = sqlite3.connect(db, timeout=BUSY_TIMEOUT_S, isolation_level=None, check_same_thread=False)
+    conn.executescript(SCHEMA_SQL)
+    return conn
+
+
+def acquire(conn, name, owner, ttl=LEASE_TTL_S, now=None):
+    """Take (or re-enter) a lease. Returns the fencing token, or None if another owner holds it."""
+    now = time.time() if now is None else now
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT owner, token, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+        if row is not None and row[0] != owner and row[2] > now:
+            conn.execute('ROLLBACK')
+            return None
+        if row is not None and row[0] == owner:
+            token = row[1]
+            conn.execute('UPDATE leases SET heartbeat_at = ?, expires_at = ? WHERE name = ?', (now, now + ttl, name))
+        else:
+            token = (row[1] if row else 0) + 1
+            conn.execute('''
+                INSERT OR REPLACE INTO leases (name, owner, token, acquired_at, heartbeat_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (name, owner, token, now, now, now + ttl))
+        conn.execute('COMMIT')
+        return token
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def heartbeat(conn, name, owner, token, ttl=LEASE_TTL_S, now=None):
+    """Extend a held lease. False if it expired and was taken over (the caller should stop)."""
+    now = time.time() if now is None else now
+    cur = conn.execute('UPDATE leases SET heartbeat_at = ?, expires_at = ? WHERE name = ? AND owner = ? AND token = ?',
+                       (now, now + ttl, name, owner, token))
+    return cur.rowcount == 1
+
+
+def release(conn, name, owner, token):
+    conn.execute('DELETE FROM leases WHERE name = ? AND owner = ? AND token = ?', (name, owner, token))
+
+
+def holder(conn, name, now=None):
+    """(owner, token, expires_at) of the current unexpired lease, or None."""
+    now = time.time() if now is None else now
+    row = conn.execute('SELECT owner, token, expires_at FROM leases WHERE name = ? AND expires_at > ?', (name, now)).fetchone()
+    return tuple(row) if row else None
+
+
+def current_owner(name, db=None):
+    """Owner of an unexpired lease (for log lines), or None."""
+    conn = connect(db)
+    try:
+        return (holder(conn, name) or (None,))[0]
+    finally:
+        conn.close()
+
+
+class Lease:
+    """A held lease renewed from a background thread until release()."""
+
+    def __init__(self, conn, name, owner, token, ttl):
+        self.conn = conn
+        self.name = name
+        self.owner = owner
+        self.token = token
+        self.ttl = ttl
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, name=f'lease-{name}', daemon=True)
+        self._thread.start()
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                if not heartbeat(self.conn, self.name, self.owner, self.token, self.ttl):
+                    self.lost = True
+                    print(f"Lease {self.name} lost to another worker")
+                    return
+            except sqlite3.Error as e:
+                # keep trying; the lease only ends if it actually expires
+                print(f"Lease {self.name} heartbeat failed: {e}")
+
+    def release(self):
+        self._stop.set()
+        self._thread.join()
+        if not self.lost:
+            release(self.conn, self.name, self.owner, self.token)
+
+
+@contextmanager
+def held(name, owner=None, ttl=LEASE_TTL_S, db=None):
+    """
+    with leases.held('market:x') as lease: ...  -- lease is None if another worker holds it.
+    A parent's lease (same owner) is re-entered and left to the parent to release.
+    """
+    owner = owner or owner_id()
+    conn = connect(db)
+    lease = None
+    try:
+        inherited = (holder(conn, name) or (None,))[0] == owner
+        token = acquire(conn, name, owner, ttl)
+        if token is not None:
+            lease = Lease(conn, name, owner, token, ttl)
+        yield lease
+    finally:
+        if lease is not None:
+            if inherited:
+                lease._stop.set()
+                lease._thread.join()
+            else:
+                lease.release()
+        conn.close()
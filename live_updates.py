@@ -0,0 +1,206 @@
+"""
+Live Price Updates (Server-Sent Events for api_server)
+- One background thread per API process watches the DB: `PRAGMA data_version` on a long-lived connection
+  changes whenever another connection (db_updater) commits, so an idle DB costs one cheap pragma per poll
+- On a change it reads the collapsed change_log delta since the last version it saw (change_log.py)
+  and hands each subscriber only the rows of the markets it subscribed to
+- A swapped-in DB file (shadow_db.py rebuild, main DB appearing) is detected by inode and reopened;
+  subscribers then get a `resync` event, as they do when the delta is too large or was pruned
+- Subscribers have bounded queues: a client that does not keep up is sent `resync` instead of a backlog
+- Standard library only; events are plain `text/event-stream` frames with the data version as event id,
+  so a reconnecting client's Last-Event-ID resumes exactly where it stopped
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import change_log
+
+POLL_INTERVAL_S = 1.0
+KEEPALIVE_S = 15
+# client reconnect delay sent with the stream (ms)
+RETRY_MS = 5000
+QUEUE_SIZE = 64
+MAX_SUBSCRIBERS = 500
+
+RESYNC = 'resync'
+
+
+def sse(event, data, event_id=None):
+    """One text/event-stream frame."""
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+def split_by_market(delta):
+    """Collapsed change_log delta -> {market_id: {'upserts': [...], 'deletes': [...]}}."""
+    by_market = {}
+    for kind in ('upserts', 'deletes'):
+        for row in delta.get(kind, []):
+            by_market.setdefault(row['market_id'], {'upserts': [], 'deletes': []})[kind].append(row)
+    return by_market
+
+
+class Subscriber:
+    def __init__(self, market_ids):
+        self.market_ids = set(market_ids)
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    def wants(self, market_id):
+        return not self.market_ids or market_id in self.market_ids
+
+    def put(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            # drop the backlog, the client has to reload anyway
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait(sse(RESYNC, {'reason': 'client too slow'}))
+
+
+class Broadcaster:
+    """Watches the DB from a single thread and fans change events out to subscribers."""
+
+    def __init__(self, db_path_fn, interval=POLL_INTERVAL_S):
+        self.db_path_fn = db_path_fn
+        self.interval = interval
+        self.version = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._conn = None
+        self._inode = None
+        self._data_version = None
+
+    def subscribe(self, market_ids):
+        with self._lock:
+            if len(self._subscribers) >= MAX_SUBSCRIBERS:
+                return None
+            sub = Subscriber(market_ids)
+            self._subscribers.add(sub)
+            if self._worker is None:
+                # baseline version before anyone can miss a change; the worker does every later poll
+                self.poll()
+                self._worker = threading.Thread(target=self._run, name='live-updates', daemon=True)
+                self._worker.start()
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _broadcast(self, frames_for):
+        subs = list(self._subscribers)
+        for sub in subs:
+            frame = frames_for(sub)
+            if frame:
+                sub.put(frame)
+
+    def _open(self):
+        path = self.db_path_fn()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if not path.exists():
+            return False
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._inode = os.stat(path).st_ino
+        self._data_version = None
+        return True
+
+    def _swapped(self):
+        try:
+            return os.stat(self.db_path_fn()).st_ino != self._inode
+        except OSError:
+            return True
+
+    def poll(self):
+        """One check; returns True if something was sent. Called with the lock held."""
+        if self._conn is None or self._swapped():
+            had_conn = self._conn is not None
+            if not self._open():
+                return False
+            if had_conn:
+                self.version = None
+                self._broadcast(lambda sub: sse(RESYNC, {'reason': 'database replaced'}))
+                return True
+        data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            return False
+        self._data_version = data_version
+        try:
+            # one read transaction, so the version matches the rows read
+            self._conn.execute('BEGIN')
+            if self.version is None:
+                self.version = change_log.current_version(self._conn)
+                return False
+            delta = change_log.changes_since(self._conn, self.version)
+        except sqlite3.OperationalError:
+            # DB without change log
+            return False
+        finally:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+        if delta['version'] == self.version:
+            return False
+        self.version = delta['version']
+        if delta['full_resync']:
+            self._broadcast(lambda sub: sse(RESYNC, {'reason': 'too many changes', 'version': self.version},
+                                            self.version))
+            return True
+        by_market = split_by_market(delta)
+
+        def frames_for(sub):
+            mine = {m: rows for m, rows in by_market.items() if sub.wants(m)}
+            if not mine:
+                return None
+            return sse('changes', {'version': delta['version'], 'markets': mine}, delta['version'])
+        self._broadcast(frames_for)
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.subscriber_count():
+                continue
+            try:
+                with self._lock:
+                    self.poll()
+            except sqlite3.Error as e:
+                print(f"live updates: poll failed: {e}")
+                self._conn = None
+
+
+def stream(broadcaster, sub, since=None, catch_up=None):
+    """
+    Generator of text/event-stream frames for one subscriber. `catch_up(since)` returns the delta
+    after version `since` (for reconnecting clients). Unsubscribes when the client goes away.
+    """
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        yield sse('hello', {'version': broadcaster.version, 'markets': sorted(sub.market_ids)})
+        if since is not None and catch_up is not None:
+            delta = catch_up(since)
+            if delta is None or delta['full_resync']:
+                yield sse(RESYNC, {'reason': 'cannot resume', 'version': delta and delta['version']})
+            elif delta['version'] != since:
+                mine = {m: rows for m, rows in split_by_market(delta).items() if sub.wants(m)}
+                yield sse('changes', {'version': delta['version'], 'markets': mine}, delta['version'])
+        while True:
+            try:
+                yield sub.queue.get(timeout=KEEPALIVE_S)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+    finally:
+        broadcaster.unsubscribe(sub)
@@ -0,0 +1,139 @@
+"""
+Last-Known-Good Store
+- One Arrow IPC file per market: data/lkg/<market_id>.arrow, the last table a scraper parsed successfully
+- Written to a temp file and renamed, so a reader sees either the old or the new table, never half a file
+- Schema metadata holds the market id, format version, row count and saved_at (epoch seconds)
+- Files are read through a memory map (closed again after each read), so the API can serve a market
+  instantly when its site is down
+- market_id comes from API requests: only plain names (letters, digits, '_', '-') map to a file, anything
+  else is a ValueError, so a request can never point the store at a path outside LKG_DIR
+- Replaces the pickle cache (son_basarili_veri.pkl) of the Gazipaşa scraper: nothing executable is loaded
+"""
+import os
+import re
+import time
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+except ImportError:  # the store is optional, scrapers keep working without pyarrow
+    pa = None
+
+BASE = Path(__file__).parent
+LKG_DIR = BASE / 'data' / 'lkg'
+FORMAT_VERSION = '1'
+MARKET_ID_RE = re.compile(r'[A-Za-z0-9_-]+')
+
+# scraper column -> prices column, used when the API serves a stored table
+FIELD_MAP = {
+    'Ürün Adı': 'product',
+    'Kategori': 'category',
+    'En Düşük Fiyat (TL)': 'price_min',
+    'En Yüksek Fiyat (TL)': 'price_max',
+    'Birim': 'unit',
+}
+PRICE_FIELDS = ('price_min', 'price_max')
+
+
+def available():
+    return pa is not None
+
+
+def path_for(market_id, lkg_dir=None):
+    """<lkg_dir>/<market_id>.arrow. Raises ValueError for a market_id that is not a plain name."""
+    if not isinstance(market_id, str) or not MARKET_ID_RE.fullmatch(market_id):
+        raise ValueError(f'invalid market id {market_id!r}')
+    return Path(lkg_dir or LKG_DIR) / f'{market_id}.arrow'
+
+
+def _to_table(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed columns ('12,50' next to 12.5): store them as text, the DB side parses prices anyway
+        return pa.Table.from_pandas(df.astype(str).where(df.notna(), None), preserve_index=False)
+
+
+def save(market_id, df, saved_at=None, lkg_dir=None):
+    """Store df as the market's last good table. Returns the file path, or None without pyarrow."""
+    if pa is None:
+        return None
+    table = _to_table(df)
+    meta = dict(table.schema.metadata or {})
+    meta.update({
+        b'market_id': str(market_id).encode(),
+        b'format_version': FORMAT_VERSION.encode(),
+        b'rows': str(table.num_rows).encode(),
+        b'saved_at': str(int(saved_at if saved_at is not None else time.time())).encode(),
+    })
+    table = table.replace_schema_metadata(meta)
+    out = path_for(market_id, lkg_dir)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f'.{out.name}.{os.getpid()}.tmp')
+    with pa.OSFile(str(tmp), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, out)
+    return out
+
+
+def _meta(schema):
+    meta = schema.metadata or {}
+    return {
+        'market_id': meta.get(b'market_id', b'').decode() or None,
+        'saved_at': int(meta[b'saved_at']) if b'saved_at' in meta else None,
+        'rows': int(meta[b'rows']) if b'rows' in meta else None,
+    }
+
+
+def _read(market_id, lkg_dir, convert):
+    """(convert(table), info dict) or None. The memory map is closed before returning."""
+    path = path_for(market_id, lkg_dir)
+    if pa is None or not path.exists():
+        return None
+    with pa.memory_map(str(path), 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+        return convert(table), _meta(table.schema)
+
+
+def load(market_id, lkg_dir=None):
+    """(DataFrame, saved_at) of the market's last good table, or None."""
+    loaded = _read(market_id, lkg_dir, lambda table: table.to_pandas())
+    if loaded is None:
+        return None
+    df, info = loaded
+    return df, info['saved_at']
+
+
+def info(market_id, lkg_dir=None):
+    """Metadata (market_id, saved_at, rows) without reading the columns, or None."""
+    path = path_for(market_id, lkg_dir)
+    if pa is None or not path.exists():
+        return None
+    with pa.memory_map(str(path), 'r') as source:
+        return _meta(pa.ipc.open_file(source).schema)
+
+
+def _price(v):
+    if v is None:
+        return None
+    try:
+        return float(str(v).replace('₺', '').replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def records(market_id, lkg_dir=None):
+    """(rows as prices-like dicts, info dict) for the API, or None."""
+    loaded = _read(market_id, lkg_dir, lambda table: table.to_pylist())
+    if loaded is None:
+        return None
+    pylist, meta = loaded
+    rows = []
+    for r in pylist:
+        row = {'market_id': market_id}
+        for col, field in FIELD_MAP.items():
+            v = r.get(col)
+            row[field] = _price(v) if field in PRICE_FIELDS else v
+        rows.append(row)
+    return rows, meta
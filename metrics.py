@@ -0,0 +1,228 @@
+"""
+Pipeline Metrics
+- Scrapers time their stages with StageTimer and print one `STAGE_TIMINGS {json}` line at the end of a run;
+  `complete` in that line says whether every page of the market was fetched (db_updater only removes rows
+  that are missing from a complete scrape)
+- db_updater parses that line from the scraper output, adds its own stages (script, db_write) and stores
+  the run in `ingest_runs` / `ingest_stage_timings` with the rows it changed
+- Histogram / Counter render the Prometheus text format; api_server exposes them on /metrics together
+  with histograms built from the stored ingest runs
+- The ingest series are kept in process and only new runs (higher id) are added on each scrape, so their
+  _total / _count never go down when prune() removes old runs; they start over with the process, or when
+  the DB is replaced by one with fewer runs, which Prometheus reads as a counter reset
+- Standard library only, so the scrapers can import it
+"""
+import json
+import threading
+import time
+
+SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS ingest_runs (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    market_id TEXT NOT NULL,
+    ok INTEGER,
+    rows INTEGER,
+    inserted INTEGER,
+    updated INTEGER,
+    deleted INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_ingest_runs_market ON ingest_runs(market_id, ts);
+CREATE TABLE IF NOT EXISTS ingest_stage_timings (
+    run_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (run_id, stage)
+) WITHOUT ROWID;
+'''
+
+STAGE_TIMINGS_PREFIX = 'STAGE_TIMINGS '
+# ingest runs kept in the DB (about a month of 10-minute refreshes for three markets)
+KEEP_RUNS = 15000
+# seconds; covers fast DB writes up to slow scraper runs with retries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 240)
+
+
+def ensure_schema(conn):
+    conn.executescript(SCHEMA_SQL)
+
+
+# --- Stage timing (scrapers and db_updater) ---
+
+class StageTimer:
+    """Accumulates wall time per stage: call mark(stage) when a stage ends."""
+
+    def __init__(self):
+        self.stages = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self._last)
+        self._last = now
+        return self.stages[stage]
+
+
+def emit_stage_timings(market_id, stages, **extra):
+    """Print the machine-readable timing line db_updater looks for in the scraper output."""
+    print(STAGE_TIMINGS_PREFIX + json.dumps({'market_id': market_id, 'stages': stages, **extra}), flush=True)
+
+
+def parse_report(output):
+    """The last STAGE_TIMINGS line of a scraper's output as a dict ({} if none)."""
+    for line in reversed((output or '').splitlines()):
+        if line.startswith(STAGE_TIMINGS_PREFIX):
+            try:
+                report = json.loads(line[len(STAGE_TIMINGS_PREFIX):])
+            except ValueError:
+                return {}
+            return report if isinstance(report, dict) else {}
+    return {}
+
+
+def parse_stage_timings(output):
+    """{stage: seconds} from the last STAGE_TIMINGS line of a scraper's output ({} if none)."""
+    return dict(parse_report(output).get('stages', {}))
+
+
+def parse_complete(output):
+    """True / False if the scraper reported whether it fetched every page, None if it did not say."""
+    complete = parse_report(output).get('complete')
+    return complete if isinstance(complete, bool) else None
+
+
+def record_run(conn, market_id, stages, ok, info=None, ts=None):
+    """Store one ingest run with its stage timings. Does not commit. Returns the run id."""
+    info = info if isinstance(info, dict) else {}
+    cur = conn.execute('''
+        INSERT INTO ingest_runs (ts, market_id, ok, rows, inserted, updated, deleted)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (int(ts if ts is not None else time.time()), market_id, int(bool(ok)),
+          info.get('rows'), info.get('inserted'), info.get('updated'), info.get('deleted')))
+    run_id = cur.lastrowid
+    conn.executemany('INSERT OR REPLACE INTO ingest_stage_timings (run_id, stage, seconds) VALUES (?, ?, ?)',
+                     [(run_id, stage, float(s)) for stage, s in stages.items()])
+    return run_id
+
+
+def prune(conn, keep=KEEP_RUNS):
+    row = conn.execute('SELECT MAX(id) FROM ingest_runs').fetchone()
+    if not row or row[0] is None or row[0] <= keep:
+        return 0
+    cutoff = row[0] - keep
+    conn.execute('DELETE FROM ingest_stage_timings WHERE run_id <= ?', (cutoff,))
+    return conn.execute('DELETE FROM ingest_runs WHERE id <= ?', (cutoff,)).rowcount
+
+
+# --- Prometheus text format ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", repr(float(bound)))])} {count}')
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", "+Inf")])} {series["count"]}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {series["sum"]}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {series["count"]}')
+        return lines
+
+
+def render(*metrics):
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class IngestMetrics:
+    """Histograms / counters of the stored ingest runs, advanced by the runs added since the last collect()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.stage_hist = Histogram('hal_ingest_stage_seconds', 'Wall time per ingest stage and market.', ('market_id', 'stage'))
+        self.rows_changed = Counter('hal_ingest_rows_changed_total', 'Rows changed by ingest runs.', ('market_id', 'op'))
+        self.runs = Counter('hal_ingest_runs_total', 'Ingest runs by result.', ('market_id', 'ok'))
+        self.last_id = 0
+
+    def collect(self, conn):
+        with self._lock:
+            max_id = conn.execute('SELECT MAX(id) FROM ingest_runs').fetchone()[0] or 0
+            if max_id < self.last_id:
+                # another DB file (rebuilt or restored): start over, like a restart
+                self._reset()
+            for market_id, stage, seconds in conn.execute('''
+                SELECT r.market_id, t.stage, t.seconds FROM ingest_stage_timings t JOIN ingest_runs r ON r.id = t.run_id
+                WHERE r.id > ? AND r.id <= ?
+            ''', (self.last_id, max_id)):
+                self.stage_hist.observe(seconds, market_id=market_id, stage=stage)
+            for market_id, ok, n, inserted, updated, deleted in conn.execute('''
+                SELECT market_id, ok, COUNT(*), SUM(inserted), SUM(updated), SUM(deleted) FROM ingest_runs
+                WHERE id > ? AND id <= ? GROUP BY market_id, ok
+            ''', (self.last_id, max_id)):
+                self.runs.inc(n, market_id=market_id, ok=ok)
+                for op, value in (('inserted', inserted), ('updated', updated), ('deleted', deleted)):
+                    if value:
+                        self.rows_changed.inc(value, market_id=market_id, op=op)
+            self.last_id = max_id
+            return self.stage_hist, self.rows_changed, self.runs
+
+
+_ingest = IngestMetrics()
+
+
+def ingest_metrics(conn):
+    """Histograms / counters of the stored ingest runs for the API's /metrics (monotonic, see IngestMetrics)."""
+    return _ingest.collect(conn)
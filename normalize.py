@@ -0,0 +1,30 @@
+"""
+Product name normalization shared by the DB side (rollups, search, product matching).
+Same folding as `normalize_turkish` in the scraper scripts (ı/İ, ğ, ü, ş, ö, ç and \xa0).
+"""
+import re
+
+TURKISH_REPLACEMENTS = (
+    ("ı", "i"), ("İ", "i"), ("ğ", "g"), ("Ğ", "g"), ("ü", "u"), ("Ü", "u"),
+    ("ş", "s"), ("Ş", "s"), ("ö", "o"), ("Ö", "o"), ("ç", "c"), ("Ç", "c")
+)
+
+
+def normalize_turkish(text):
+    if not isinstance(text, str):
+        text = str(text)
+    # \xa0 (non-breaking space) dahil, garip boşlukları temizle
+    text = text.replace('\xa0', ' ')
+    for old, new in TURKISH_REPLACEMENTS:
+        text = text.replace(old, new)
+    return text.lower()
+
+
+def product_key(name):
+    """Folded name with collapsed whitespace: 'BİBER  ÇARLİSTON\xa0' -> 'biber carliston'."""
+    return ' '.join(normalize_turkish(name).split())
+
+
+def tokens(name):
+    """Alphanumeric tokens of the folded name: 'DOMATES (KOKTEYL)' -> ['domates', 'kokteyl']."""
+    return re.findall(r'[a-z0-9]+', normalize_turkish(name))
@@ -0,0 +1,111 @@
+"""
+Offline Data Bundle (for the mobile apps)
+- A small standalone SQLite file with the latest snapshot of every market (or a chosen subset), so an app
+  loads everything in one request, keeps it on the device and queries it locally
+- Dictionary-encoded: `markets` and `products` (name, category, unit, canonical product id) are stored
+  once, `prices` holds integer keys and the two prices in a WITHOUT ROWID table keyed by (market, product)
+- `meta` carries the bundle format and the data version (change_log); clients compare the version (or the
+  HTTP ETag) to skip downloads and continue with /api/prices/changes from it
+- The same data gives the same bytes, so an unchanged bundle keeps its content-hashed name
+- db_updater publishes the all-markets bundle with the static JSON snapshots (static_publish.py, gzip and
+  brotli variants); api_server builds subset bundles on request
+"""
+import os
+import sqlite3
+import tempfile
+
+import change_log
+import compact_schema
+
+# bumped whenever the bundle schema changes incompatibly
+BUNDLE_FORMAT = 1
+MIMETYPE = 'application/vnd.sqlite3'
+
+SCHEMA_SQL = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE markets (
+    id INTEGER PRIMARY KEY,
+    market_id TEXT NOT NULL UNIQUE,
+    market_name TEXT,
+    date_scraped TEXT
+);
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    category TEXT,
+    unit TEXT,
+    product_id INTEGER
+);
+CREATE TABLE prices (
+    market INTEGER NOT NULL,
+    product INTEGER NOT NULL,
+    price_min REAL,
+    price_max REAL,
+    PRIMARY KEY (market, product)
+) WITHOUT ROWID;
+CREATE INDEX idx_products_product_id ON products(product_id);
+'''
+
+
+def latest_snapshot(conn, market_id):
+    """(date_scraped, rows) of the newest snapshot of one market; rows are dicts."""
+    date_cols = compact_schema.date_columns(conn)
+    row = conn.execute(f'''
+        SELECT date_scraped FROM prices WHERE market_id=? AND date_scraped IS NOT NULL
+        ORDER BY {', '.join(f'{c} DESC' for c in date_cols)} LIMIT 1
+    ''', (market_id,)).fetchone()
+    if row is None:
+        return None, []
+    cols = ['market_name', 'product', 'category', 'unit', 'price_min', 'price_max', 'product_id']
+    has_product_id = 'product_id' in [r[1] for r in conn.execute('PRAGMA table_info(prices)').fetchall()]
+    select = ', '.join(c if c != 'product_id' or has_product_id else 'NULL' for c in cols)
+    where = ' AND '.join(f'{c}=?' for c in date_cols)
+    cur = conn.execute(f'SELECT {select} FROM prices WHERE market_id=? AND {where}',
+                       (market_id, *compact_schema.date_values(date_cols, row[0])))
+    return row[0], [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def build(conn, market_ids=None):
+    """Bundle bytes (an uncompressed SQLite file) for the given markets, default all."""
+    if market_ids is None:
+        market_ids = [r[0] for r in conn.execute('SELECT DISTINCT market_id FROM prices WHERE market_id IS NOT NULL')]
+    try:
+        version = change_log.current_version(conn)
+    except sqlite3.OperationalError:
+        version = None
+    fd, tmp = tempfile.mkstemp(prefix='bundle-', suffix='.sqlite')
+    os.close(fd)
+    try:
+        out = sqlite3.connect(tmp)
+        out.execute('PRAGMA page_size = 1024')
+        out.execute('PRAGMA journal_mode = OFF')
+        out.executescript(SCHEMA_SQL)
+        products = {}
+        for market_id in sorted(set(market_ids)):
+            date_scraped, rows = latest_snapshot(conn, market_id)
+            if date_scraped is None:
+                continue
+            market = out.execute('INSERT INTO markets (market_id, market_name, date_scraped) VALUES (?, ?, ?)',
+                                 (market_id, rows[0]['market_name'] if rows else None, date_scraped)).lastrowid
+            prices = {}
+            for r in rows:
+                if r['product'] is None:
+                    continue
+                key = (r['product'], r['category'], r['unit'], r['product_id'])
+                if key not in products:
+                    products[key] = out.execute('INSERT INTO products (name, category, unit, product_id) VALUES (?, ?, ?, ?)',
+                                                key).lastrowid
+                prices[products[key]] = (r['price_min'], r['price_max'])
+            out.executemany('INSERT INTO prices (market, product, price_min, price_max) VALUES (?, ?, ?, ?)',
+                            [(market, p, lo, hi) for p, (lo, hi) in prices.items()])
+        out.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', [
+            ('format', str(BUNDLE_FORMAT)),
+            ('version', '' if version is None else str(version)),
+        ])
+        out.commit()
+        out.execute('VACUUM')
+        out.close()
+        with open(tmp, 'rb') as f:
+            return f.read()
+    finally:
+        os.unlink(tmp)
@@ -0,0 +1,121 @@
+"""
+Keyset Pagination and Field Projection (market endpoints)
+- Rows of a market are paged newest first on (date_scraped, product, id); id only breaks ties in DBs
+  without the UNIQUE constraint (run_three_* snapshots)
+- The cursor is an opaque URL-safe token holding the market id and the last row's key, so a page is one
+  index range scan (idx_prices_market_date_product) however deep the client pages, never an OFFSET;
+  on a compact DB the range is on price_facts' clustered (day, tod) instead (compact_schema.date_columns)
+- A cursor whose key does not have the stored types and date format is a PaginationError, not a SQL error
+- `fields=` is validated against FIELDS and becomes the SQL column list; the key columns are selected
+  for the cursor and dropped from the rows again if they were not requested
+- Without `fields=` every column in FIELDS is returned; columns the DB does not have yet (product_id in the
+  run_three_* snapshots) come back as null, naming one of them in `fields=` is an error
+"""
+import base64
+import json
+
+import compact_schema
+
+FIELDS = ('id', 'market_id', 'market_name', 'product', 'category', 'price_min', 'price_max', 'unit',
+          'date_scraped', 'source_file', 'inserted_at', 'product_id')
+KEY_FIELDS = ('date_scraped', 'product', 'id')
+MAX_LIMIT = 1000
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def parse_fields(value):
+    """`fields=` value -> tuple of columns (None = all)."""
+    if not value:
+        return None
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown or not fields:
+        raise PaginationError(f'unknown fields {unknown}, allowed: {list(FIELDS)}')
+    return fields
+
+
+def parse_limit(value, default):
+    if not value:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise PaginationError(f'limit must be between 1 and {MAX_LIMIT}')
+    return limit
+
+
+def encode_cursor(market_id, key):
+    raw = json.dumps([market_id, *key], separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, market_id):
+    """Key (date_scraped, product, id) after which the next page starts."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_market, date_scraped, product, row_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise PaginationError('invalid cursor')
+    if cursor_market != market_id:
+        raise PaginationError('cursor belongs to another market')
+    if not (_is_date(date_scraped) and isinstance(product, str)
+            and isinstance(row_id, int) and not isinstance(row_id, bool)):
+        raise PaginationError('invalid cursor')
+    return date_scraped, product, row_id
+
+
+def _is_date(value):
+    """'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS', the date_scraped values a cursor can hold."""
+    if not isinstance(value, str) or len(value) not in (10, 19) or (len(value) == 19 and value[10] != ' '):
+        return False
+    try:
+        compact_schema.date_key(value)
+    except ValueError:
+        return False
+    return True
+
+
+def page(conn, market_id, limit, fields=None, cursor=None):
+    """
+    One page of a market's rows, newest first: (rows as dicts, next cursor or None).
+    `cursor` is a token from a previous page of the same market.
+    """
+    columns = fields or FIELDS
+    existing = {r[1] for r in conn.execute('PRAGMA table_info(prices)').fetchall()}
+    if fields:
+        missing = [f for f in fields if f not in existing]
+        if missing:
+            raise PaginationError(f'fields {missing} are not available in this database')
+    select = list(columns) + [k for k in KEY_FIELDS if k not in columns]
+    exprs = [c if c in existing else f'NULL AS {c}' for c in select]
+    sql = f'SELECT {", ".join(exprs)} FROM prices WHERE market_id = ?'
+    params = [market_id]
+    date_cols = compact_schema.date_columns(conn)
+    key_cols = (*date_cols, 'product', 'id')
+    if cursor:
+        date_scraped, product, row_id = decode_cursor(cursor, market_id)
+        key = (*compact_schema.date_values(date_cols, date_scraped), product, row_id)
+        # the leading column on its own as well, so the scan starts at the cursor instead of filtering
+        sql += f' AND {key_cols[0]} <= ? AND ({", ".join(key_cols)}) < ({", ".join("?" * len(key))})'
+        params.extend((key[0], *key))
+    sql += ' ORDER BY ' + ', '.join(f'{c} DESC' for c in key_cols) + ' LIMIT ?'
+    params.append(limit)
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) == limit:
+        last = dict(zip(select, rows[-1]))
+        next_cursor = encode_cursor(market_id, [last[k] for k in KEY_FIELDS])
+    n = len(columns)
+    return [dict(zip(columns, r[:n])) for r in rows], next_cursor
+
+
+def project(rows, fields):
+    """Apply a projection to rows that did not come from the DB (last-good fallback)."""
+    if not fields:
+        return rows
+    return [{f: r.get(f) for f in fields} for r in rows]
@@ -0,0 +1,120 @@
+"""
+Price Change History
+- `price_events`: append-only (market_id, product_id, ts, price_min, price_max), one row per value change;
+  product_id is the canonical product id of product_catalog.py, the same as `prices.product_id`
+- DBs with the older `product_names` dictionary get their events re-keyed to the catalog ids once
+- Unchanged prices are never written again, so intraday changes are kept at a fraction of the snapshot size
+- Queries: price of every product at time T, and all changes since T
+"""
+import time
+
+import product_catalog
+
+# most events one changes_since() call returns
+MAX_CHANGES_LIMIT = 10000
+
+SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS price_events (
+    market_id TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    price_min REAL,
+    price_max REAL,
+    PRIMARY KEY (market_id, product_id, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_price_events_ts ON price_events(ts);
+'''
+
+
+def ensure_schema(conn):
+    """Needs product_catalog.ensure_schema() first."""
+    conn.executescript(SCHEMA_SQL)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_names'").fetchone():
+        _rekey_events(conn)
+
+
+def _rekey_events(conn):
+    """Move events from the old product_names ids to catalog ids, then drop product_names. Commits."""
+    remap = [(old, product_catalog.resolve(conn, name)) for old, name in conn.execute('SELECT id, name FROM product_names').fetchall()]
+    conn.execute('CREATE TEMP TABLE product_id_map (old INTEGER PRIMARY KEY, new INTEGER NOT NULL)')
+    conn.executemany('INSERT INTO product_id_map (old, new) VALUES (?, ?)', remap)
+    conn.execute(SCHEMA_SQL.split(';')[0].replace('price_events', 'price_events_rekeyed'))
+    # two spellings of one product may now share an id; the first event of a timestamp is kept
+    conn.execute('''
+        INSERT OR IGNORE INTO price_events_rekeyed (market_id, product_id, ts, price_min, price_max)
+        SELECT e.market_id, m.new, e.ts, e.price_min, e.price_max
+        FROM price_events e JOIN temp.product_id_map m ON m.old = e.product_id
+        ORDER BY e.market_id, e.ts, e.product_id
+    ''')
+    conn.execute('DROP TABLE price_events')
+    conn.execute('ALTER TABLE price_events_rekeyed RENAME TO price_events')
+    conn.execute('DROP TABLE product_names')
+    conn.execute('DROP TABLE temp.product_id_map')
+    conn.executescript(SCHEMA_SQL)
+
+
+def last_prices(conn, market_id):
+    """{product_id: (price_min, price_max)} of the latest event per product of a market."""
+    cur = conn.execute('''
+        SELECT product_id, price_min, price_max FROM price_events e
+        WHERE market_id = ? AND ts = (
+            SELECT MAX(ts) FROM price_events WHERE market_id = e.market_id AND product_id = e.product_id
+        )
+    ''', (market_id,))
+    return {pid: (pmin, pmax) for pid, pmin, pmax in cur.fetchall()}
+
+
+def record_events(conn, market_id, prices, ts=None):
+    """
+    Append an event for every (product, price_min, price_max) whose values differ from the
+    product's last event. Does not commit. Returns the number of events written.
+    """
+    ts = int(ts if ts is not None else time.time())
+    last = last_prices(conn, market_id)
+    events = []
+    for name, pmin, pmax in prices:
+        pid = product_catalog.resolve(conn, name)
+        if last.get(pid) != (pmin, pmax):
+            events.append((market_id, pid, ts, pmin, pmax))
+            last[pid] = (pmin, pmax)
+    conn.executemany('INSERT OR REPLACE INTO price_events (market_id, product_id, ts, price_min, price_max) VALUES (?, ?, ?, ?, ?)', events)
+    return len(events)
+
+
+def price_at(conn, market_id, ts):
+    """Price of every product of a market as it was at epoch second `ts`."""
+    cur = conn.execute('''
+        SELECT n.canonical_name, e.price_min, e.price_max, e.ts FROM price_events e
+        JOIN products n ON n.id = e.product_id
+        WHERE e.market_id = ? AND e.ts = (
+            SELECT MAX(ts) FROM price_events
+            WHERE market_id = e.market_id AND product_id = e.product_id AND ts <= ?
+        )
+        ORDER BY n.canonical_name
+    ''', (market_id, ts))
+    return [{'product': name, 'price_min': pmin, 'price_max': pmax, 'changed_at': t} for name, pmin, pmax, t in cur.fetchall()]
+
+
+def changes_since(conn, since_ts, market_id=None, limit=1000):
+    """Change events after epoch second `since_ts`, oldest first. Raises ValueError unless 1 <= limit <= MAX_CHANGES_LIMIT."""
+    if not 1 <= limit <= MAX_CHANGES_LIMIT:
+        raise ValueError(f'limit must be between 1 and {MAX_CHANGES_LIMIT}')
+    sql = '''
+        SELECT e.market_id, n.canonical_name, e.price_min, e.price_max, e.ts FROM price_events e
+        JOIN products n ON n.id = e.product_id
+        WHERE e.ts {op} ?
+    '''
+    params = []
+    if market_id:
+        sql += ' AND e.market_id = ?'
+        params.append(market_id)
+    sql += ' ORDER BY e.ts, e.market_id, n.canonical_name'
+    rows = conn.execute(sql.format(op='>') + ' LIMIT ?', [since_ts] + params + [limit]).fetchall()
+    if len(rows) == limit:
+        # never cut one refresh (same ts) in half, the caller continues from the last returned ts
+        last_ts = rows[-1][4]
+        if rows[0][4] != last_ts:
+            rows = [r for r in rows if r[4] != last_ts]
+        else:
+            rows = conn.execute(sql.format(op='='), [last_ts] + params).fetchall()
+    return [{'market_id': m, 'product': name, 'price_min': pmin, 'price_max': pmax, 'ts': t} for m, name, pmin, pmax, t in rows]
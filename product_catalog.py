@@ -0,0 +1,153 @@
+"""
+Canonical Product Dictionary
+- `products`: one row per canonical product (first spelling seen becomes the canonical name)
+- `product_aliases`: every spelling seen (by folded key) -> product id
+- Resolution order: exact folded name, same token set ('Biber Çarliston' == 'ÇARLİSTON BİBER'),
+  fuzzy match on the token set (difflib), otherwise a new product
+- The fuzzy match only considers products with exactly the same number tokens: 'ELMA STARKING 1' and
+  'ELMA STARKING 2' (or '1. KALITE' / '2. KALITE') are different grades, not spellings of one product
+- `prices.product_id` stores the resolved id so cross-market comparisons are index lookups; price_events
+  (price_history.py) use the same ids
+- Resolved ids are cached per DB file and inode: a file swapped in at the same path (shadow_db rebuild,
+  restored snapshot) starts with an empty cache instead of writing ids of the old file
+- Ids cached while a transaction is open may still be rolled back (and their products.id reused), so
+  they stay "pending" and are checked against product_aliases until seen outside a transaction
+"""
+import difflib
+import os
+
+import compact_schema
+from normalize import product_key, tokens
+
+SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY,
+    canonical_name TEXT NOT NULL,
+    product_key TEXT NOT NULL UNIQUE,
+    token_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_token_key ON products(token_key);
+CREATE TABLE IF NOT EXISTS product_aliases (
+    alias_key TEXT PRIMARY KEY,
+    product_id INTEGER NOT NULL,
+    method TEXT
+) WITHOUT ROWID;
+'''
+
+# difflib ratio needed to treat two token sets as the same product
+FUZZY_CUTOFF = 0.92
+ASSIGN_BATCH = 1000
+
+# (db file, inode) -> {alias_key: product_id}
+_alias_cache = {}
+# (db file, inode) -> alias keys cached inside a transaction, not known to be committed yet
+_pending = {}
+
+
+def ensure_schema(conn):
+    conn.executescript(SCHEMA_SQL)
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(prices)').fetchall()]
+    if 'product_id' not in cols:
+        conn.execute('ALTER TABLE prices ADD COLUMN product_id INTEGER')
+    # the compact layout indexes price_facts(product_id, day) instead
+    if not compact_schema.is_compact(conn):
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_prices_product_date ON prices(product_id, date_scraped)')
+
+
+def token_key(name):
+    return ' '.join(sorted(set(tokens(name))))
+
+
+def _numbers(tkey):
+    return {t for t in tkey.split() if any(ch.isdigit() for ch in t)}
+
+
+def _cache(conn):
+    db_file = conn.execute('PRAGMA database_list').fetchone()[2]
+    try:
+        inode = os.stat(db_file).st_ino if db_file else None
+    except OSError:
+        inode = None
+    key = (db_file, inode)
+    if key not in _alias_cache:
+        # drop the caches of files that were replaced at this path
+        for old in [k for k in _alias_cache if k[0] == db_file]:
+            del _alias_cache[old]
+            _pending.pop(old, None)
+    return _alias_cache.setdefault(key, {}), _pending.setdefault(key, set())
+
+
+def lookup(conn, name):
+    """Product id of a known spelling (exact or same token set), without creating anything."""
+    row = conn.execute('SELECT product_id FROM product_aliases WHERE alias_key = ?', (product_key(name),)).fetchone()
+    if row is None:
+        row = conn.execute('SELECT id FROM products WHERE token_key = ? ORDER BY id LIMIT 1', (token_key(name),)).fetchone()
+    return row[0] if row else None
+
+
+def resolve(conn, name):
+    """Product id for an incoming name; creates the product and alias if needed. Does not commit."""
+    if name is None:
+        return None
+    cache, pending = _cache(conn)
+    alias = product_key(name)
+    pid = cache.get(alias)
+    if pid is not None and alias not in pending:
+        return pid
+    row = conn.execute('SELECT product_id FROM product_aliases WHERE alias_key = ?', (alias,)).fetchone()
+    if row:
+        _remember(conn, cache, pending, alias, row[0])
+        return row[0]
+
+    tkey = token_key(name)
+    method = 'tokens'
+    row = conn.execute('SELECT id FROM products WHERE token_key = ? ORDER BY id LIMIT 1', (tkey,)).fetchone()
+    if row is None and tkey:
+        method = 'fuzzy'
+        numbers = _numbers(tkey)
+        known = {k: pid for k, pid in conn.execute('SELECT token_key, id FROM products').fetchall() if _numbers(k) == numbers}
+        close = difflib.get_close_matches(tkey, list(known), n=1, cutoff=FUZZY_CUTOFF)
+        row = (known[close[0]],) if close else None
+    if row is None:
+        method = 'new'
+        cur = conn.execute('INSERT INTO products (canonical_name, product_key, token_key) VALUES (?, ?, ?)',
+                           (' '.join(str(name).split()), alias, tkey))
+        row = (cur.lastrowid,)
+    conn.execute('INSERT OR IGNORE INTO product_aliases (alias_key, product_id, method) VALUES (?, ?, ?)', (alias, row[0], method))
+    _remember(conn, cache, pending, alias, row[0])
+    return row[0]
+
+
+def _remember(conn, cache, pending, alias, pid):
+    cache[alias] = pid
+    # read or written inside an open transaction: trusted only once it is seen again after it ended
+    if conn.in_transaction:
+        pending.add(alias)
+    else:
+        pending.discard(alias)
+
+
+def assign_missing_ids(conn):
+    """Resolve prices rows without product_id (older rows, other writers) in batches. Commits."""
+    total = 0
+    while True:
+        # product_id IS NULL is answered by idx_prices_product_date, updates go by rowid
+        rows = conn.execute('''
+            SELECT id, product FROM prices WHERE product_id IS NULL AND product IS NOT NULL LIMIT ?
+        ''', (ASSIGN_BATCH,)).fetchall()
+        if not rows:
+            break
+        conn.executemany('UPDATE prices SET product_id = ? WHERE id = ?', [(resolve(conn, name), rid) for rid, name in rows])
+        conn.commit()
+        total += len(rows)
+    return total
+
+
+def product_key_of(conn, name):
+    """Canonical product_key for a name (falls back to its own folded key if unknown)."""
+    pid = lookup(conn, name)
+    if pid is not None:
+        row = conn.execute('SELECT product_key FROM products WHERE id = ?', (pid,)).fetchone()
+        if row:
+            return row[0]
+    return product_key(name)
@@ -0,0 +1,84 @@
+"""
+Product Search (SQLite FTS5)
+- `search_products`: one row per (market_id, product) currently listed by a market
+- `product_fts`: FTS5 index over the Turkish-folded names (normalize.py), rowid = search_products.id
+- Kept in sync per market by db_updater (only added/removed names are written)
+- Queries fold the same way, so 'carliston', 'Çarli' and 'ÇARLİSTON' match the same rows
+"""
+from normalize import normalize_turkish, tokens
+
+SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS search_products (
+    id INTEGER PRIMARY KEY,
+    market_id TEXT NOT NULL,
+    product TEXT NOT NULL,
+    UNIQUE (market_id, product)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+    name_folded,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+'''
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def ensure_schema(conn):
+    conn.executescript(SCHEMA_SQL)
+
+
+def current_products(conn, market_id):
+    """Product names of the latest date a market has rows for."""
+    cur = conn.execute('''
+        SELECT DISTINCT product FROM prices
+        WHERE market_id = ? AND product IS NOT NULL
+          AND date_scraped = (SELECT MAX(date_scraped) FROM prices WHERE market_id = ?)
+    ''', (market_id, market_id))
+    return {r[0] for r in cur.fetchall()}
+
+
+def sync_market(conn, market_id):
+    """Add new and remove delisted products of a market. Does not commit. Returns (added, removed)."""
+    current = current_products(conn, market_id)
+    indexed = dict(conn.execute('SELECT product, id FROM search_products WHERE market_id = ?', (market_id,)).fetchall())
+    added = [p for p in current if p not in indexed]
+    removed = [indexed[p] for p in indexed if p not in current]
+    if removed:
+        conn.executemany('DELETE FROM product_fts WHERE rowid = ?', [(i,) for i in removed])
+        conn.executemany('DELETE FROM search_products WHERE id = ?', [(i,) for i in removed])
+    for product in added:
+        cur = conn.execute('INSERT INTO search_products (market_id, product) VALUES (?, ?)', (market_id, product))
+        conn.execute('INSERT INTO product_fts (rowid, name_folded) VALUES (?, ?)', (cur.lastrowid, normalize_turkish(product)))
+    return len(added), len(removed)
+
+
+def rebuild(conn):
+    conn.execute('DELETE FROM product_fts')
+    conn.execute('DELETE FROM search_products')
+    markets = [r[0] for r in conn.execute('SELECT DISTINCT market_id FROM prices').fetchall()]
+    for market_id in markets:
+        sync_market(conn, market_id)
+    conn.commit()
+    return len(markets)
+
+
+def match_query(q):
+    """'Çarli bib' -> '"carli"* AND "bib"*' (prefix match on every token)."""
+    return ' AND '.join(f'"{t}"*' for t in tokens(q))
+
+
+def search(conn, q, limit=DEFAULT_LIMIT):
+    """[(market_id, product, rank)] best first (bm25, lower is better)."""
+    match = match_query(q)
+    if not match:
+        return []
+    cur = conn.execute('''
+        SELECT s.market_id, s.product, bm25(product_fts) AS rank
+        FROM product_fts JOIN search_products s ON s.id = product_fts.rowid
+        WHERE product_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    ''', (match, limit))
+    return cur.fetchall()
@@ -0,0 +1,134 @@
+"""
+Request Profiling (opt-in, for api_server)
+- API_PROFILE=all profiles every request, API_PROFILE=header only requests sent with `X-Profile: 1`;
+  unset (default) costs nothing but one dict lookup per request
+- Profiled requests get a Server-Timing header: market-load, distance, query, serialize, compress, total
+- While a profiled request runs, a background thread samples its Python stack every SAMPLE_INTERVAL_S;
+  samples are aggregated as collapsed stacks ("frame;frame;frame count"), the input format of
+  flamegraph.pl / speedscope, and dumped on request. The thread exits when no profiled request is running
+- `X-Profile: 1` and the /debug/profile dump are only honoured for local clients, or for clients sending
+  the API_PROFILE_TOKEN value in `X-Profile-Token` when that variable is set
+"""
+import collections
+import hmac
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+ENV_VAR = 'API_PROFILE'
+TOKEN_ENV_VAR = 'API_PROFILE_TOKEN'
+HEADER = 'X-Profile'
+TOKEN_HEADER = 'X-Profile-Token'
+LOCAL_ADDRS = ('127.0.0.1', '::1')
+STAGES = ('market-load', 'distance', 'query', 'serialize', 'compress')
+SAMPLE_INTERVAL_S = 0.005
+# distinct stacks kept; rare stacks beyond this are counted under "(truncated)"
+MAX_STACKS = 20000
+
+
+def mode():
+    return os.environ.get(ENV_VAR, '').strip().lower()
+
+
+def enabled():
+    return mode() in ('1', 'all', 'header')
+
+
+def authorized(headers, remote_addr):
+    """Profiling access: the configured token if there is one, else local clients only."""
+    token = os.environ.get(TOKEN_ENV_VAR)
+    if token:
+        return hmac.compare_digest(headers.get(TOKEN_HEADER, ''), token)
+    return remote_addr in LOCAL_ADDRS
+
+
+def enabled_for(headers, remote_addr=None):
+    m = mode()
+    return m in ('1', 'all') or (m == 'header' and headers.get(HEADER) == '1' and authorized(headers, remote_addr))
+
+
+class Timings:
+    """Wall time per stage of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def span(self, stage):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0.0) + (time.perf_counter() - t)
+
+    def server_timing(self):
+        """Server-Timing header value (durations in milliseconds)."""
+        parts = [f'{stage};dur={self.stages[stage] * 1000:.2f}' for stage in STAGES if stage in self.stages]
+        parts.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.2f}')
+        return ', '.join(parts)
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Samples the stacks of registered threads (the ones serving profiled requests)."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL_S):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def add(self, thread_id):
+        with self._lock:
+            self._threads.add(thread_id)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._worker.start()
+
+    def remove(self, thread_id):
+        with self._lock:
+            self._threads.discard(thread_id)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                threads = list(self._threads)
+                if not threads:
+                    # idle: stop, add() starts a new worker for the next profiled request
+                    self._worker = None
+                    return
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id in threads:
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = _collapse(frame)
+                    if stack not in self.stacks and len(self.stacks) >= MAX_STACKS:
+                        stack = '(truncated)'
+                    self.stacks[stack] += 1
+                    self.samples += 1
+
+    def dump(self):
+        """Collapsed stacks, one 'frames count' line each, most frequent first."""
+        with self._lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
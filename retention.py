@@ -0,0 +1,191 @@
+"""
+Retention / Compaction
+- Tier 1, the last INTRADAY_KEEP_DAYS days: every stored snapshot (run_three_* timestamps, 10-minute refreshes)
+- Tier 2, up to RAW_KEEP_DAYS: raw rows thinned to the last snapshot of each (market, product, day)
+- Tier 3, older: only the daily / weekly rollups (rollups.py); raw rows are deleted, and so are price_events
+  superseded by a later event before the cutoff (the last one of each product stays, price_at() needs it).
+  With DAILY_KEEP_DAYS set, daily rollups older than that are dropped as well and only weekly ones remain
+- Rollups of a day are computed before any of its raw rows are thinned or deleted; a market's latest day
+  is never touched, so /latest keeps working for markets that stopped publishing
+- Deletes run in batches of BATCH_ROWS, each its own short transaction with a pause in between, so API
+  readers are never locked out for long; afterwards free pages are returned with incremental_vacuum
+  (auto_vacuum=INCREMENTAL DBs) and the planner statistics are refreshed with a bounded ANALYZE
+- On a compact DB (compact_schema.py) days are selected on the clustered `day` column and raw rows are
+  deleted from price_facts directly; progress is counted with total_changes, since a DELETE through the
+  view's INSTEAD OF trigger always reports a rowcount of 0
+- Aging out is not a data change: nothing is written to change_log
+"""
+import time
+from datetime import datetime, timedelta
+
+import compact_schema
+import rollups
+
+INTRADAY_KEEP_DAYS = 14
+RAW_KEEP_DAYS = 180
+# None keeps daily rollups forever
+DAILY_KEEP_DAYS = None
+BATCH_ROWS = 2000
+STEP_SLEEP_S = 0.05
+VACUUM_PAGES_PER_STEP = 512
+# rows sampled per index by ANALYZE (PRAGMA analysis_limit), keeps the run short on big DBs
+ANALYSIS_LIMIT = 1000
+
+
+def _cutoff(today, days):
+    return (today - timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def _day(date):
+    return compact_schema.date_key(date)[0]
+
+
+def _batched(conn, sql, params, pause):
+    """Run a `DELETE ... LIMIT`-style statement until it deletes nothing. Commits per batch."""
+    total = 0
+    while True:
+        # rows changed by triggers included, cursor.rowcount is 0 for a DELETE on a view
+        before = conn.total_changes
+        conn.execute(sql, params)
+        n = conn.total_changes - before
+        conn.commit()
+        total += n
+        if n < BATCH_ROWS:
+            return total
+        time.sleep(pause)
+
+
+def market_days(conn, start, end):
+    """(market_id, day) pairs with raw rows on days in [start, end)."""
+    if compact_schema.is_compact(conn):
+        return conn.execute('''
+            SELECT DISTINCT m.market_id, date(f.day * 86400, 'unixepoch')
+            FROM price_facts f JOIN dim_market m ON m.id = f.market
+            WHERE f.day >= ? AND f.day < ?
+        ''', (_day(start), _day(end))).fetchall()
+    return conn.execute('''
+        SELECT DISTINCT market_id, substr(date_scraped, 1, 10) FROM prices
+        WHERE date_scraped >= ? AND date_scraped < ?
+    ''', (start, end)).fetchall()
+
+
+def latest_days(conn):
+    """{market_id: its latest day with raw rows}."""
+    if compact_schema.is_compact(conn):
+        sql = '''
+            SELECT m.market_id, date(MAX(f.day) * 86400, 'unixepoch')
+            FROM price_facts f JOIN dim_market m ON m.id = f.market GROUP BY f.market
+        '''
+    else:
+        sql = 'SELECT market_id, MAX(substr(date_scraped, 1, 10)) FROM prices GROUP BY market_id'
+    return dict(conn.execute(sql).fetchall())
+
+
+def ensure_rolled_up(conn, pairs):
+    """Compute the rollups of the (market, day) pairs that have none yet. Commits. Returns the count."""
+    missing = [(m, d) for m, d in pairs
+               if conn.execute('SELECT 1 FROM rollup_daily WHERE day = ? AND market_id = ? LIMIT 1', (d, m)).fetchone() is None]
+    for market_id, day in missing:
+        rollups.update_rollups(conn, market_id, [day])
+        conn.commit()
+    return len(missing)
+
+
+def thin_day(conn, market_id, day, pause=STEP_SLEEP_S):
+    """Keep only the last timestamped snapshot per product of one market/day. Returns rows deleted."""
+    if compact_schema.is_compact(conn):
+        return _batched(conn, '''
+            DELETE FROM price_facts WHERE (market, day, product, tod) IN (
+                SELECT f.market, f.day, f.product, f.tod FROM price_facts f
+                WHERE f.market = (SELECT id FROM dim_market WHERE market_id = ?) AND f.day = ? AND f.tod >= 0
+                  AND EXISTS (SELECT 1 FROM price_facts q
+                              WHERE q.market = f.market AND q.day = f.day AND q.product = f.product
+                                AND q.tod > f.tod)
+                LIMIT %d)
+        ''' % BATCH_ROWS, (market_id, _day(day)), pause)
+    return _batched(conn, '''
+        DELETE FROM prices WHERE id IN (
+            SELECT p.id FROM prices p
+            WHERE p.market_id = ? AND p.date_scraped > ? AND p.date_scraped < ?
+              AND EXISTS (SELECT 1 FROM prices q
+                          WHERE q.market_id = p.market_id AND q.product = p.product
+                            AND q.date_scraped > p.date_scraped AND q.date_scraped < ?)
+            LIMIT %d)
+    ''' % BATCH_ROWS, (market_id, day, day + '~', day + '~'), pause)
+
+
+def delete_day(conn, market_id, day, pause=STEP_SLEEP_S):
+    if compact_schema.is_compact(conn):
+        return _batched(conn, '''
+            DELETE FROM price_facts WHERE (market, day, product, tod) IN (
+                SELECT market, day, product, tod FROM price_facts
+                WHERE market = (SELECT id FROM dim_market WHERE market_id = ?) AND day = ? LIMIT %d)
+        ''' % BATCH_ROWS, (market_id, _day(day)), pause)
+    return _batched(conn, '''
+        DELETE FROM prices WHERE id IN (
+            SELECT id FROM prices WHERE market_id = ? AND date_scraped >= ? AND date_scraped < ? LIMIT %d)
+    ''' % BATCH_ROWS, (market_id, day, day + '~'), pause)
+
+
+def incremental_vacuum(conn, pause=STEP_SLEEP_S):
+    """Return free pages to the OS in steps. Returns pages freed (0 unless auto_vacuum=INCREMENTAL)."""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 0
+    start = free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    while free:
+        conn.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})').fetchall()
+        conn.commit()
+        left = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if left >= free:
+            break
+        free = left
+        time.sleep(pause)
+    return start - free
+
+
+def enable_incremental_vacuum(conn):
+    """Switch an existing DB to auto_vacuum=INCREMENTAL. Needs one full VACUUM (rewrites the file)."""
+    conn.commit()
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+
+
+def run(conn, today=None, intraday_days=INTRADAY_KEEP_DAYS, raw_days=RAW_KEEP_DAYS,
+        daily_days=DAILY_KEEP_DAYS, pause=STEP_SLEEP_S):
+    """Apply all retention tiers, then vacuum and analyze. Commits. Returns a summary dict."""
+    today = today or datetime.now()
+    intraday_cutoff = _cutoff(today, intraday_days)
+    raw_cutoff = _cutoff(today, raw_days)
+    conn.commit()
+    summary = {'rolled_up': 0, 'thinned': 0, 'deleted': 0, 'events_deleted': 0, 'daily_deleted': 0}
+
+    latest = latest_days(conn)
+    pairs = [(m, d) for m, d in market_days(conn, '0001-01-01', intraday_cutoff) if d != latest.get(m)]
+    summary['rolled_up'] = ensure_rolled_up(conn, pairs)
+    for market_id, day in pairs:
+        if day >= raw_cutoff:
+            summary['thinned'] += thin_day(conn, market_id, day, pause)
+        else:
+            summary['deleted'] += delete_day(conn, market_id, day, pause)
+
+    raw_ts = int(datetime.strptime(raw_cutoff, '%Y-%m-%d').timestamp())
+    summary['events_deleted'] = _batched(conn, '''
+        DELETE FROM price_events WHERE (market_id, product_id, ts) IN (
+            SELECT market_id, product_id, ts FROM price_events e
+            WHERE ts < ? AND EXISTS (
+                SELECT 1 FROM price_events
+                WHERE market_id = e.market_id AND product_id = e.product_id AND ts > e.ts AND ts <= ?
+            )
+            LIMIT %d)
+    ''' % BATCH_ROWS, (raw_ts, raw_ts), pause)
+    if daily_days is not None:
+        summary['daily_deleted'] = _batched(conn, '''
+            DELETE FROM rollup_daily WHERE (day, product_key, market_id) IN (
+                SELECT day, product_key, market_id FROM rollup_daily WHERE day < ? LIMIT %d)
+        ''' % BATCH_ROWS, (_cutoff(today, daily_days),), pause)
+
+    summary['pages_freed'] = incremental_vacuum(conn, pause)
+    conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+    compact_schema.analyze(conn)
+    conn.commit()
+    return summary
@@ -0,0 +1,184 @@
+"""
+Price Rollups
+- `rollup_daily`: one row per (day, product_key, market_id) with min, max and mid price of that day
+- `rollup_weekly`: the same per ISO week (week = Monday, YYYY-MM-DD), built from the daily rows
+- Updated incrementally by db_updater for the (market, day) pairs a refresh touched
+- product_key is the canonical product's key (product_catalog.py), so spelling variants share a row
+- Cross-market statistics (min, max, mean, median, spread) are computed from these small tables,
+  never by scanning `prices`
+"""
+import statistics
+from datetime import datetime, timedelta
+
+import product_catalog
+from normalize import product_key
+
+SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS rollup_daily (
+    day TEXT NOT NULL,
+    product_key TEXT NOT NULL,
+    market_id TEXT NOT NULL,
+    product TEXT,
+    price_min REAL,
+    price_max REAL,
+    price_mid REAL,
+    samples INTEGER,
+    PRIMARY KEY (day, product_key, market_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rollup_daily_product ON rollup_daily(product_key, day);
+CREATE TABLE IF NOT EXISTS rollup_weekly (
+    week TEXT NOT NULL,
+    product_key TEXT NOT NULL,
+    market_id TEXT NOT NULL,
+    product TEXT,
+    price_min REAL,
+    price_max REAL,
+    price_mid REAL,
+    days INTEGER,
+    PRIMARY KEY (week, product_key, market_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rollup_weekly_product ON rollup_weekly(product_key, week);
+'''
+
+PERIODS = ('daily', 'weekly')
+
+
+def ensure_schema(conn):
+    conn.executescript(SCHEMA_SQL)
+
+
+def week_of(day):
+    d = datetime.strptime(day[:10], '%Y-%m-%d').date()
+    return (d - timedelta(days=d.weekday())).strftime('%Y-%m-%d')
+
+
+def _mid(pmin, pmax):
+    if pmin is None and pmax is None:
+        return None
+    if pmin is None or pmax is None:
+        return pmin if pmax is None else pmax
+    return (pmin + pmax) / 2
+
+
+def update_day(conn, market_id, day):
+    """Recompute the daily rollup of one market/day (all snapshots of that day)."""
+    # date_scraped is either YYYY-MM-DD or a full timestamp (run_three_* snapshots)
+    cur = conn.execute('''
+        SELECT p.product, p.price_min, p.price_max, c.product_key FROM prices p
+        LEFT JOIN products c ON c.id = p.product_id
+        WHERE p.market_id = ? AND p.date_scraped >= ? AND p.date_scraped < ?
+    ''', (market_id, day, day + '~'))
+    groups = {}
+    for product, pmin, pmax, key in cur.fetchall():
+        if product is None:
+            continue
+        g = groups.setdefault(key or product_key(product), {'product': product, 'mins': [], 'maxs': [], 'mids': []})
+        if pmin is not None:
+            g['mins'].append(pmin)
+        if pmax is not None:
+            g['maxs'].append(pmax)
+        mid = _mid(pmin, pmax)
+        if mid is not None:
+            g['mids'].append(mid)
+    conn.execute('DELETE FROM rollup_daily WHERE day = ? AND market_id = ?', (day, market_id))
+    conn.executemany('''
+        INSERT INTO rollup_daily (day, product_key, market_id, product, price_min, price_max, price_mid, samples)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(day, key, market_id, g['product'],
+           min(g['mins']) if g['mins'] else None,
+           max(g['maxs']) if g['maxs'] else None,
+           sum(g['mids']) / len(g['mids']) if g['mids'] else None,
+           len(g['mids'])) for key, g in groups.items()])
+
+
+def update_week(conn, market_id, week):
+    end = (datetime.strptime(week, '%Y-%m-%d') + timedelta(days=7)).strftime('%Y-%m-%d')
+    conn.execute('DELETE FROM rollup_weekly WHERE week = ? AND market_id = ?', (week, market_id))
+    conn.execute('''
+        INSERT INTO rollup_weekly (week, product_key, market_id, product, price_min, price_max, price_mid, days)
+        SELECT ?, product_key, market_id, MAX(product), MIN(price_min), MAX(price_max), AVG(price_mid), COUNT(*)
+        FROM rollup_daily
+        WHERE day >= ? AND day < ? AND market_id = ?
+        GROUP BY product_key, market_id
+    ''', (week, week, end, market_id))
+
+
+def update_rollups(conn, market_id, days):
+    """Refresh daily and weekly rollups for the given days of a market. Does not commit."""
+    days = {d[:10] for d in days}
+    for day in days:
+        update_day(conn, market_id, day)
+    for week in {week_of(d) for d in days}:
+        update_week(conn, market_id, week)
+
+
+def rebuild(conn):
+    """
+    Rebuild the rollups from `prices` (first run or after manual edits). Days before the oldest raw row
+    were aged out by retention.py and only exist as rollups, so those are kept.
+    """
+    first = conn.execute('SELECT MIN(substr(date_scraped, 1, 10)) FROM prices').fetchone()[0]
+    if first is None:
+        return 0
+    conn.execute('DELETE FROM rollup_daily WHERE day >= ?', (first,))
+    conn.execute('DELETE FROM rollup_weekly WHERE week >= ?', (week_of(first),))
+    cur = conn.execute('SELECT DISTINCT market_id, substr(date_scraped, 1, 10) FROM prices WHERE date_scraped IS NOT NULL')
+    pairs = cur.fetchall()
+    by_market = {}
+    for market_id, day in pairs:
+        by_market.setdefault(market_id, set()).add(day)
+    for market_id, days in by_market.items():
+        update_rollups(conn, market_id, days)
+    conn.commit()
+    return len(pairs)
+
+
+def _cross_market(rows):
+    """Statistics across markets for the rollup rows of one product and period."""
+    mids = [r[3] for r in rows if r[3] is not None]
+    mins = [r[1] for r in rows if r[1] is not None]
+    maxs = [r[2] for r in rows if r[2] is not None]
+    return {
+        'markets': len(rows),
+        'min': min(mins) if mins else None,
+        'max': max(maxs) if maxs else None,
+        'mean': sum(mids) / len(mids) if mids else None,
+        'median': statistics.median(mids) if mids else None,
+        # difference between the cheapest and the most expensive market (by mid price)
+        'spread': max(mids) - min(mids) if mids else None,
+        'by_market': {r[0]: r[3] for r in rows},
+    }
+
+
+def latest_day(conn):
+    row = conn.execute('SELECT MAX(day) FROM rollup_daily').fetchone()
+    return row[0]
+
+
+def product_stats(conn, day=None):
+    """Per-product statistics across markets for one day (default: latest rolled-up day)."""
+    day = day or latest_day(conn)
+    cur = conn.execute('''
+        SELECT product_key, product, market_id, price_min, price_max, price_mid FROM rollup_daily
+        WHERE day = ? ORDER BY product_key
+    ''', (day,))
+    groups = {}
+    for key, product, market_id, pmin, pmax, pmid in cur.fetchall():
+        g = groups.setdefault(key, {'product': product, 'rows': []})
+        g['rows'].append((market_id, pmin, pmax, pmid))
+    return day, [dict(product_key=key, product=g['product'], **_cross_market(g['rows'])) for key, g in groups.items()]
+
+
+def product_series(conn, name, start=None, end=None, period='daily'):
+    """Cross-market statistics of one product per day or per week between start and end."""
+    table, col = ('rollup_weekly', 'week') if period == 'weekly' else ('rollup_daily', 'day')
+    key = product_catalog.product_key_of(conn, name)
+    cur = conn.execute(f'''
+        SELECT {col}, market_id, price_min, price_max, price_mid FROM {table}
+        WHERE product_key = ? AND {col} >= ? AND {col} <= ?
+        ORDER BY {col}
+    ''', (key, start or '0000-00-00', end or '9999-99-99'))
+    periods = {}
+    for p, market_id, pmin, pmax, pmid in cur.fetchall():
+        periods.setdefault(p, []).append((market_id, pmin, pmax, pmid))
+    return key, [dict(period=p, **_cross_market(rows)) for p, rows in periods.items()]
@@ -8,6 +8,8 @@ import sqlite3
 import os
 import traceback
 
+import shadow_db
+
 BASE = Path(__file__).parent
 SCRIPTS = [
     (BASE / 'gazipasa veri.py', 'gazipasa_hal_fiyatlari.xlsx', 'gazipasa_market'),
@@ -17,10 +19,8 @@ SCRIPTS = [
 DB_PATH = BASE / 'data' / 'hal_prices_three.sqlite'
 DB_PATH.parent.mkdir(exist_ok=True)
 
-# remove existing DB to start fresh
-if DB_PATH.exists():
-    print(f"Removing existing DB: {DB_PATH}")
-    DB_PATH.unlink()
+# the DB is rebuilt in a shadow file and swapped in at the end of main() (see shadow_db.py),
+# so db_updater / the API never see it missing or half filled
 
 CREATE_TABLE_SQL = '''
 CREATE TABLE IF NOT EXISTS prices (
@@ -38,6 +38,12 @@ CREATE TABLE IF NOT EXISTS prices (
 );
 '''
 
+# created after the bulk load, same indexes as db_updater's prices table
+INDEX_SQL = [
+    'CREATE INDEX IF NOT EXISTS idx_prices_market_product_date ON prices(market_id, product, date_scraped)',
+    'CREATE INDEX IF NOT EXISTS idx_prices_market_date_product ON prices(market_id, date_scraped, product)',
+]
+
 EXPECTED_COLS = ['Ürün Adı', 'Kategori', 'En Düşük Fiyat (TL)', 'En Yüksek Fiyat (TL)', 'Birim']
 
 
@@ -98,8 +104,7 @@ def load_module_and_run(path: Path):
         return None
 
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
+def load(conn):
     conn.execute(CREATE_TABLE_SQL)
     conn.commit()
 
@@ -150,10 +155,16 @@ def main():
         else:
             summary.append((script_path.name, False, 'no rows'))
 
+    return summary
+
+
+def main():
+    with shadow_db.rebuild(DB_PATH, indexes=INDEX_SQL) as conn:
+        summary = load(conn)
+
     print('\n== Summary ==')
     for item in summary:
         print(item)
-    conn.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Online SQLite Snapshots
+- Copies the whole DB (all history and side tables) with the SQLite online backup API in small page
+  batches, sleeping between batches so the API's readers are never blocked for long
+- The copy is checked with PRAGMA integrity_check before it is kept, then gzip-compressed
+- Snapshots are written to a temp file and renamed: backups/db/hal_prices_YYYYMMDD-HHMMSS.sqlite.gz
+- Only the newest KEEP_SNAPSHOTS files are kept
+
+Usage:
+- Take a snapshot now: python snapshot.py
+- Verify a snapshot: python snapshot.py --verify backups/db/<file>.sqlite.gz
+- Restore: gunzip -c backups/db/<file>.sqlite.gz > data/hal_prices.sqlite (with the updater stopped)
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+BASE = Path(__file__).parent
+SNAPSHOT_DIR = BASE / 'backups' / 'db'
+SNAPSHOT_PREFIX = 'hal_prices_'
+KEEP_SNAPSHOTS = 7
+# pages copied per backup step (4 KiB pages -> 1 MiB) and the pause between steps
+PAGES_PER_STEP = 256
+STEP_SLEEP_S = 0.05
+
+
+def integrity_ok(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchall()
+    finally:
+        conn.close()
+    return result == [('ok',)]
+
+
+def _copy(db_path, dest):
+    """Online backup of db_path into dest. Returns the number of pages copied."""
+    progress = {'pages': 0}
+
+    def on_progress(status, remaining, total):
+        progress['pages'] = total
+
+    # read-only source: the backup only takes short shared locks, one per step
+    src = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst, pages=PAGES_PER_STEP, progress=on_progress, sleep=STEP_SLEEP_S)
+    finally:
+        dst.close()
+        src.close()
+    return progress['pages']
+
+
+def rotate(out_dir, keep=KEEP_SNAPSHOTS):
+    """Remove all but the newest `keep` snapshots. Returns the removed paths."""
+    snapshots = sorted(Path(out_dir).glob(f'{SNAPSHOT_PREFIX}*.sqlite.gz'))
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        path.unlink()
+    return removed
+
+
+def snapshot(db_path, out_dir=None, keep=KEEP_SNAPSHOTS):
+    """
+    Take a verified, compressed snapshot of db_path.
+    Returns (path, pages, seconds); raises RuntimeError if the copy fails the integrity check.
+    """
+    out_dir = Path(out_dir or SNAPSHOT_DIR)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    started = time.time()
+    out = out_dir / f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}.sqlite.gz"
+    fd, raw = tempfile.mkstemp(suffix='.sqlite', dir=out_dir)
+    os.close(fd)
+    tmp = out.with_name(f'.{out.name}.tmp')
+    try:
+        pages = _copy(db_path, raw)
+        if not integrity_ok(raw):
+            raise RuntimeError(f'integrity_check failed for snapshot of {db_path}')
+        with open(raw, 'rb') as f_in, gzip.open(tmp, 'wb', compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        os.replace(tmp, out)
+    finally:
+        for path in (raw, tmp):
+            if os.path.exists(path):
+                os.remove(path)
+    rotate(out_dir, keep)
+    return out, pages, time.time() - started
+
+
+def verify(snapshot_path):
+    """Decompress a snapshot to a temp file and run integrity_check on it."""
+    fd, raw = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    try:
+        with gzip.open(snapshot_path, 'rb') as f_in, open(raw, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        return integrity_ok(raw)
+    finally:
+        os.remove(raw)
+
+
+if __name__ == '__main__':
+    if '--verify' in sys.argv:
+        path = sys.argv[sys.argv.index('--verify') + 1]
+        ok = verify(path)
+        print(f"{path}: {'ok' if ok else 'CORRUPT'}")
+        sys.exit(0 if ok else 1)
+    import db_updater
+    path, pages, seconds = snapshot(db_updater.DB_PATH)
+    print(f"Snapshot {path} ({pages} pages, {path.stat().st_size} bytes) in {seconds:.1f}s")
@@ -0,0 +1,166 @@
+"""
+Static JSON Snapshots
+- After every refresh db_updater renders the latest prices of each market (same body as
+  /api/market/<id>/latest) and of all markets (/api/latest) into PUBLISH_DIR, together with the
+  all-markets offline bundle (offline_bundle.py, /api/bundle)
+- File names carry the content hash (latest-<market>.<sha256[:16]>.json), with .gz and .br variants
+  (brotli only if the package is installed); a file is never rewritten once published
+- `manifest.json` maps each document to its current files and is replaced atomically (temp file + rename),
+  so readers see either the old or the new set, never a mix
+- The manifest stores the DB file's mtime at publish time; api_server only serves the files while
+  the DB is unchanged since then and falls back to the DB otherwise
+- Files dropped from the manifest are deleted after STALE_AFTER_S, long enough for readers of the
+  previous manifest to finish
+- The directory can be served as-is by any static file server / CDN (hashed files are immutable)
+"""
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import change_log
+import offline_bundle
+import pagination
+
+PUBLISH_DIR = Path(__file__).parent / 'data' / 'publish'
+MANIFEST = 'manifest.json'
+# rows per market, same as /api/market/<id>/latest
+LATEST_LIMIT = 100
+STALE_AFTER_S = 300
+ALL_MARKETS = 'all'
+BUNDLE = 'bundle'
+# file name prefixes of published documents (cleanup only touches these)
+PREFIXES = ('latest-', 'bundle-', '.latest-', '.bundle-')
+
+# Content-Encoding -> manifest key, preferred first
+ENCODINGS = (('br', 'br'), ('gzip', 'gz'))
+
+
+def latest_page(conn, market_id, limit=LATEST_LIMIT):
+    """First page of a market's rows (pagination.py): (rows as dicts, next cursor or None)."""
+    return pagination.page(conn, market_id, limit)
+
+
+def _version(conn):
+    try:
+        return change_log.current_version(conn)
+    except sqlite3.OperationalError:
+        return None
+
+
+def render(payload):
+    # the same bytes Flask's jsonify produces outside debug mode
+    return (json.dumps(payload, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _write_atomic(path, data):
+    tmp = path.with_name(f'.{path.name}.tmp-{os.getpid()}')
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _publish_doc(out_dir, name, body, suffix='.json'):
+    """Write one document and its compressed variants under content-hashed names. Returns its manifest entry."""
+    digest = hashlib.sha256(body).hexdigest()
+    stem = f'{name}.{digest[:16]}{suffix}'
+    entry = {'sha256': digest, 'bytes': len(body), 'path': stem}
+    variants = [(stem, lambda: body), (stem + '.gz', lambda: gzip.compress(body, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((stem + '.br', lambda: brotli.compress(body, quality=11)))
+    for fname, make in variants:
+        path = out_dir / fname
+        if not path.exists():
+            _write_atomic(path, make())
+        if fname != stem:
+            entry[fname.rsplit('.', 1)[1]] = fname
+    return entry
+
+
+def publish(conn, db_file, out_dir=None):
+    """Render every market plus the all-markets document and swap in a new manifest. Returns the manifest."""
+    out_dir = Path(out_dir or PUBLISH_DIR)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    version = _version(conn)
+    market_ids = [r[0] for r in conn.execute('SELECT DISTINCT market_id FROM prices WHERE market_id IS NOT NULL')]
+    docs = {}
+    everything = []
+    for market_id in sorted(market_ids):
+        data, next_cursor = latest_page(conn, market_id)
+        everything.append({'market_id': market_id, 'data': data, 'next_cursor': next_cursor})
+        docs[f'market/{market_id}'] = _publish_doc(out_dir, f'latest-{market_id}', render(
+            {'market_id': market_id, 'data': data, 'version': version, 'next_cursor': next_cursor}))
+    docs[ALL_MARKETS] = _publish_doc(out_dir, 'latest-all', render({'markets': everything, 'version': version}))
+    docs[BUNDLE] = _publish_doc(out_dir, 'bundle-all', offline_bundle.build(conn, market_ids), suffix='.sqlite')
+    docs[BUNDLE]['version'] = version
+    manifest = {'generated_at': int(time.time()), 'version': version,
+                'db_mtime_ns': Path(db_file).stat().st_mtime_ns, 'docs': docs}
+    _write_atomic(out_dir / MANIFEST, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    cleanup(out_dir, manifest)
+    return manifest
+
+
+def cleanup(out_dir, manifest):
+    keep = {MANIFEST}
+    for entry in manifest['docs'].values():
+        keep.update(v for k, v in entry.items() if k in ('path', 'gz', 'br'))
+    cutoff = time.time() - STALE_AFTER_S
+    removed = 0
+    for path in Path(out_dir).iterdir():
+        if path.name not in keep and path.name.startswith(PREFIXES) and path.stat().st_mtime < cutoff:
+            path.unlink()
+            removed += 1
+    return removed
+
+
+# --- reading side (api_server) ---
+
+_manifest_cache = {'mtime_ns': None, 'manifest': None}
+
+
+def load_manifest(out_dir=None):
+    """Current manifest, re-read only when the file changed. None if nothing was published."""
+    path = Path(out_dir or PUBLISH_DIR) / MANIFEST
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    if _manifest_cache['mtime_ns'] != mtime_ns:
+        try:
+            manifest = json.loads(path.read_bytes())
+        except (OSError, ValueError):
+            return None
+        _manifest_cache.update(mtime_ns=mtime_ns, manifest=manifest)
+    return _manifest_cache['manifest']
+
+
+def lookup(doc, db_file, accept_encoding='', out_dir=None):
+    """
+    (path, content_encoding or None, sha256) of the best published variant of `doc`, or None when
+    nothing is published or the DB changed after the last publish.
+    """
+    manifest = load_manifest(out_dir)
+    if manifest is None or doc not in manifest.get('docs', {}):
+        return None
+    try:
+        if Path(db_file).stat().st_mtime_ns != manifest.get('db_mtime_ns'):
+            return None
+    except OSError:
+        return None
+    out_dir = Path(out_dir or PUBLISH_DIR)
+    entry = manifest['docs'][doc]
+    for encoding, key in ENCODINGS:
+        if key in entry and encoding in accept_encoding and (out_dir / entry[key]).exists():
+            return out_dir / entry[key], encoding, entry['sha256']
+    path = out_dir / entry['path']
+    return (path, None, entry['sha256']) if path.exists() else None
@@ -9,7 +9,12 @@ import os
 import sys
 import shutil
 import threading
-import urllib.error # <-- YENİDEN DENEME İÇİN EKLENDİ
+from contextlib import ExitStack
+from io import StringIO
+from async_fetcher import fetch_all_sync, izmir_urls
+import leases
+import lkg_store
+import metrics
 
 # --- Kaynak Yolu (EXE için) ---
 def kaynak_yolu(relative_path):
@@ -98,8 +103,9 @@ def kategori_belirle(urun_adi, kurallar_df):
 
 # --- Global Ayarlar ---
 ssl._create_default_https_context = ssl._create_unverified_context
-BASE_URL = "https://eislem.izmir.bel.tr/tr/HalFiyatlari/20"
 EXCEL_DOSYASI = "izmir_hal_fiyatlari.xlsx"
+# Önce buraya yazılır, sonra os.replace ile tek adımda yayınlanır (db_updater yarım dosya okumasın)
+EXCEL_GECICI = ".izmir_hal_fiyatlari.tmp.xlsx"
 YEDekLER_KLASORU = "yedekler"
 
 is_running_lock = threading.Lock()
@@ -148,7 +154,80 @@ def excel_stillerini_uygula(dosya_yolu):
     except Exception as e:
         print(f"!!! HATA: [İzmir] Excel stilleri uygulanırken bir hata oluştu: {e}")
 
-# --- Ana İşlem (Yeniden Deneme Mekanizması ile Güncellendi) ---
+# --- Dinamik Sütun Eşleştirme ---
+COLUMN_MAP = {
+    'Ürün Adı': ['Adı', 'Mal Adı', 'Ürün Adı'],
+    'Birim': ['Birimi', 'Birim'],
+    'En Düşük Fiyat (TL)': ['En Az', 'En Az Fiyat', 'En Düşük Fiyat (TL)'],
+    'En Yüksek Fiyat (TL)': ['En Çok', 'En Çok Fiyat', 'En Yüksek Fiyat (TL)']
+}
+STANDARD_COLS_ORDER = ['Ürün Adı', 'Kategori', 'En Düşük Fiyat (TL)', 'En Yüksek Fiyat (TL)', 'Birim']
+REQUIRED_STANDARD_COLS = list(COLUMN_MAP.keys())
+
+def izmir_tablosunu_esle(html, url_type):
+    """
+    Sayfa HTML'inden ilk tabloyu okur ve sütunları standart isimlere eşler.
+    Tablo yoksa veya sütunlar eşleşmezse None döner. (Backfill de bunu kullanır.)
+    """
+    try:
+        df_list = pd.read_html(StringIO(html))
+    except Exception as e:
+        print(f"--- UYARI: [İzmir] {url_type} VERİ HATASI (muhtemelen boş sayfa/veri yok): {e}")
+        return None
+
+    if not df_list:
+        print(f"--- UYARI: [İzmir] {url_type} sayfasında tablo bulunamadı.")
+        return None
+
+    try:
+        df = df_list[0]
+        actual_columns = list(df.columns)
+
+        rename_map = {}
+        found_cols = []
+
+        for standard_name, possible_names in COLUMN_MAP.items():
+            for possible in possible_names:
+                if possible in actual_columns:
+                    rename_map[possible] = standard_name
+                    found_cols.append(standard_name)
+                    break
+
+        if all(col in found_cols for col in REQUIRED_STANDARD_COLS):
+            df_renamed = df.rename(columns=rename_map)
+            print(f"--- BİLGİ: [İzmir] {url_type} verisi bulundu ve {rename_map} ile eşleştirildi.")
+            return df_renamed[REQUIRED_STANDARD_COLS]
+
+        print(f"--- UYARI: [İzmir] {url_type} tablosunda gerekli sütunlar bulunamadı.")
+        print(f"    Siteden gelen: {actual_columns}")
+        print(f"    Bulunabilenler: {found_cols}")
+    except Exception as e:
+        print(f"!!! HATA: [İzmir] {url_type} verisi işlenirken (eşleştirme) hata oluştu: {e}")
+    return None
+
+# --- Son Başarılı Veri (lkg_store: data/lkg/izmir_market.arrow) ---
+MARKET_ID = 'izmir_market'
+
+def son_iyi_veriyi_kaydet(df):
+    """ Başarılı çekimi ortak last-known-good deposuna kaydeder; API site çöktüğünde bunu sunar. """
+    try:
+        if lkg_store.save(MARKET_ID, df) is not None:
+            print(f"--- BİLGİ: [İzmir] Son başarılı veri kaydedildi ({len(df)} satır).")
+    except Exception as e:
+        print(f"--- UYARI: [İzmir] Son başarılı veri kaydedilemedi: {e}")
+
+def son_iyi_veri_bilgisi():
+    """ Çekim başarısız olduğunda elde kalan son başarılı verinin yaşını yazar. """
+    try:
+        bilgi = lkg_store.info(MARKET_ID)
+    except Exception as e:
+        bilgi = None
+        print(f"--- UYARI: [İzmir] Son başarılı veri okunamadı: {e}")
+    if bilgi and bilgi['saved_at']:
+        zaman = datetime.fromtimestamp(bilgi['saved_at']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"--- BİLGİ: [İzmir] API son başarılı veriyi ({zaman}, {bilgi['rows']} satır) sunmaya devam edecek.")
+
+# --- Ana İşlem (Sebze ve Meyve sayfaları asyncio ile aynı anda çekilir) ---
 def verileri_cek_ve_kaydet():
     if kategori_df is None:
         print("Kategorizasyon kuralları yüklenemediği için işlem durduruldu.")
@@ -157,103 +236,65 @@ def verileri_cek_ve_kaydet():
     if not is_running_lock.acquire(blocking=False):
         print("Önceki görev tamamlanmadı; bu döngü atlandı.")
         return
-        
+
+    # Başka süreç/sunucudaki güncelleyicilerle ortak kiralama (leases.py); db_updater'dan çalışınca onunkine girilir
+    with ExitStack() as kiralama:
+        kiralama.callback(is_running_lock.release) # Kiralama alınamazsa ya da hata verirse de kilit açılır
+        if kiralama.enter_context(leases.held(leases.market_lease(MARKET_ID))) is None:
+            print("--- BİLGİ: [İzmir] Pazar başka bir güncelleyicide işleniyor (kiralama); bu döngü atlandı.")
+            return
+        kiralama = kiralama.pop_all() # Kiralama ve kilit aşağıdaki finally'de bırakılır
+
+    zamanlayici = metrics.StageTimer() # Aşama süreleri (STAGE_TIMINGS satırı, db_updater okur)
+    tum_sayfalar = False # Yazılan Excel'de Sebze ve Meyve sayfalarının ikisi de var mı (db_updater eksik ürünleri ancak o zaman siler)
     try:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [İzmir] Görev başladı. Veriler çekiliyor...")
-        
-        # Dinamik Sütun Eşleştirme (Değişiklik yok)
-        COLUMN_MAP = {
-            'Ürün Adı': ['Adı', 'Mal Adı', 'Ürün Adı'],
-            'Birim': ['Birimi', 'Birim'],
-            'En Düşük Fiyat (TL)': ['En Az', 'En Az Fiyat', 'En Düşük Fiyat (TL)'],
-            'En Yüksek Fiyat (TL)': ['En Çok', 'En Çok Fiyat', 'En Yüksek Fiyat (TL)']
-        }
-        STANDARD_COLS_ORDER = ['Ürün Adı', 'Kategori', 'En Düşük Fiyat (TL)', 'En Yüksek Fiyat (TL)', 'Birim']
-        REQUIRED_STANDARD_COLS = list(COLUMN_MAP.keys()) 
 
         tarih_str = datetime.now().strftime("%Y-%m-%d")
-        sebze_url = f"{BASE_URL}?date={tarih_str}&tip=1&aranacak="
-        meyve_url = f"{BASE_URL}?date={tarih_str}&tip=2&aranacak="
-        
+
+        # Yeniden deneme (bloklamayan exponential backoff) async_fetcher içinde yapılır
+        sonuclar = fetch_all_sync(izmir_urls([tarih_str]))
+        zamanlayici.mark('fetch')
+
         valid_dfs = [] 
 
-        for url_type, url in [("Sebze", sebze_url), ("Meyve", meyve_url)]:
-            
-            # Yeniden Deneme Bloğu (Değişiklik yok)
-            df_list = None
-            max_retries = 3
-            for attempt in range(1, max_retries + 1):
-                try:
-                    print(f"--- BİLGİ: [İzmir] {url_type} verisi çekiliyor (Deneme {attempt}/{max_retries}): {url}")
-                    df_list = pd.read_html(url) # AĞ İSTEĞİ
-                    
-                    print(f"--- BİLGİ: [İzmir] {url_type} verisi (Deneme {attempt}/{max_retries}) BAŞARILI.")
-                    break 
-                    
-                except (urllib.error.URLError, ssl.SSLError, ConnectionError, OSError) as e:
-                    print(f"--- UYARI: [İzmir] {url_type} AĞ HATASI (Deneme {attempt}/{max_retries}): {e}")
-                    if attempt < max_retries:
-                        print(f"    ... 3 saniye beklenip yeniden denenecek ...")
-                        time.sleep(3)
-                    else:
-                        print(f"    ... {max_retries} deneme de başarısız oldu. Bu URL atlanıyor.")
-                except Exception as e:
-                    print(f"--- UYARI: [İzmir] {url_type} VERİ HATASI (muhtemelen boş sayfa/veri yok): {e}")
-                    break
-            
-            # Yeniden Deneme Bloğu Sonu (Değişiklik yok)
-            
-            if not df_list:
-                print(f"--- UYARI: [İzmir] {url_type} verisi {max_retries} deneme sonunda alınamadı/bulunamadı.")
-                continue 
-            
-            # Dinamik Eşleştirme Bloğu (Değişiklik yok)
-            try:
-                df = df_list[0]
-                actual_columns = list(df.columns) 
-                
-                rename_map = {} 
-                found_cols = [] 
-                
-                for standard_name, possible_names in COLUMN_MAP.items():
-                    for possible in possible_names:
-                        if possible in actual_columns:
-                            rename_map[possible] = standard_name
-                            found_cols.append(standard_name)
-                            break 
-                
-                if all(col in found_cols for col in REQUIRED_STANDARD_COLS):
-                    df_renamed = df.rename(columns=rename_map)
-                    df_final = df_renamed[REQUIRED_STANDARD_COLS] 
-                    valid_dfs.append(df_final)
-                    print(f"--- BİLGİ: [İzmir] {url_type} verisi bulundu ve {rename_map} ile eşleştirildi.")
-                else:
-                    print(f"--- UYARI: [İzmir] {url_type} tablosunda gerekli sütunlar bulunamadı.")
-                    print(f"    Siteden gelen: {actual_columns}")
-                    print(f"    Bulunabilenler: {found_cols}")
-            
-            except Exception as e:
-                print(f"!!! HATA: [İzmir] {url_type} verisi işlenirken (eşleştirme) hata oluştu: {e}")
+        for (_, url_type), sonuc in sonuclar.items():
+            if sonuc.text is None:
+                print(f"--- UYARI: [İzmir] {url_type} verisi {sonuc.attempts} deneme sonunda alınamadı: {sonuc.error}")
+                continue
+            print(f"--- BİLGİ: [İzmir] {url_type} verisi (Deneme {sonuc.attempts}) BAŞARILI: {sonuc.url}")
+
+            df_final = izmir_tablosunu_esle(sonuc.text, url_type)
+            if df_final is not None:
+                valid_dfs.append(df_final)
         
         # --- URL Döngüsü Sonu ---
         
         if not valid_dfs:
             print("!!! HATA: [İzmir] Bugün için geçerli Sebze veya Meyve verisi bulunamadı. İşlem atlanıyor.")
+            son_iyi_veri_bilgisi()
             return 
 
         toplam_df = pd.concat(valid_dfs, ignore_index=True)
+        zamanlayici.mark('parse')
         fiyat_df = toplam_df
 
         # Bu satır artık "börülce", "darı", "biber" ve "boşluk" sorunlarını
         # çözen en güncel 'kategori_belirle' fonksiyonunu kullanıyor.
         fiyat_df['Kategori'] = fiyat_df['Ürün Adı'].apply(lambda urun: kategori_belirle(urun, kategori_df))
         fiyat_df = fiyat_df[STANDARD_COLS_ORDER] 
+        zamanlayici.mark('categorize')
         
         print("--- BİLGİ: [İzmir] Kategorizasyon sonrası verilerin ilk 5 satırı:")
         print(fiyat_df.head())
         
-        fiyat_df.to_excel(EXCEL_DOSYASI, index=False, engine='openpyxl')
-        excel_stillerini_uygula(EXCEL_DOSYASI)
+        fiyat_df.to_excel(EXCEL_GECICI, index=False, engine='openpyxl')
+        excel_stillerini_uygula(EXCEL_GECICI)
+        os.replace(EXCEL_GECICI, EXCEL_DOSYASI)
+        tum_sayfalar = len(valid_dfs) == len(sonuclar) # yazılan Excel'e göre
+        zamanlayici.mark('excel')
+        son_iyi_veriyi_kaydet(fiyat_df)
+        zamanlayici.mark('lkg')
         
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [İzmir] Veriler başarıyla '{EXCEL_DOSYASI}' dosyasına kaydedildi.")
         print("-" * 50)
@@ -262,7 +303,8 @@ def verileri_cek_ve_kaydet():
         print(f"!!! HATA: [İzmir] Ana işlem sırasında beklenmedik bir hata oluştu: {e}")
         print("-" * 50)
     finally:
-        is_running_lock.release()
+        metrics.emit_stage_timings(MARKET_ID, zamanlayici.stages, complete=tum_sayfalar)
+        kiralama.close() # Önce kiralama, sonra kilit
 
 # --- Yedekleme (Değişiklik yok) ---
 def gunluk_ogleden_sonra_3_yedek():